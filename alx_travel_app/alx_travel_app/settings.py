@@ -66,6 +66,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Development aid: count the SQL queries of every request against listings.query_budget.QUERY_BUDGETS
+# (X-Query-Count header, warning in the log; QUERY_BUDGET_STRICT=True raises instead)
+QUERY_BUDGET_MIDDLEWARE = env.bool('QUERY_BUDGET_MIDDLEWARE', default=False)
+QUERY_BUDGET_STRICT = env.bool('QUERY_BUDGET_STRICT', default=False)
+if QUERY_BUDGET_MIDDLEWARE:
+    MIDDLEWARE.append('listings.query_budget.QueryBudgetMiddleware')
+
 ROOT_URLCONF = 'alx_travel_app.urls'
 
 TEMPLATES = [
@@ -110,6 +117,14 @@ REST_FRAMEWORK = {
         # 'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
+    # Keyset pagination on (ordering field, primary key); clients may ask for up to 100 rows with ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'listings.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 20,
+    # orjson-backed JSON rendering (falls back to the stdlib encoder when orjson is not installed)
+    'DEFAULT_RENDERER_CLASSES': [
+        'listings.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 SWAGGER_SETTINGS = {
@@ -126,6 +141,49 @@ SWAGGER_SETTINGS = {
 # CORS settings (allow all origins for development)
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Cache
+# Local memory by default; set REDIS_CACHE_URL (e.g. redis://localhost:6379/1) so that every worker
+# shares the same cache and version counters. The version-keyed caches (facets, listing fragments,
+# calendars, rate tables) and ETags are turned off with a process-local cache, unless CACHE_SINGLE_PROCESS
+# declares that one process serves the site (runserver, tests); see listings/caching.py.
+REDIS_CACHE_URL = env('REDIS_CACHE_URL', default='')
+CACHE_SINGLE_PROCESS = env.bool('CACHE_SINGLE_PROCESS', default=False)
+# The 'fragments' cache holds serialized listings (see listings/fragments.py). Locally it is bounded
+# to LISTING_FRAGMENT_CACHE_SIZE entries and evicts the least recently used entry one at a time.
+LISTING_FRAGMENT_CACHE_SIZE = env.int('LISTING_FRAGMENT_CACHE_SIZE', default=10000)
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        },
+        'fragments': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+            'KEY_PREFIX': 'fragments',
+            'TIMEOUT': 60 * 60 * 24,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'alx-travel-default',
+        },
+        'fragments': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'alx-travel-fragments',
+            'TIMEOUT': 60 * 60 * 24,
+            'OPTIONS': {
+                'MAX_ENTRIES': LISTING_FRAGMENT_CACHE_SIZE,
+                'CULL_FREQUENCY': LISTING_FRAGMENT_CACHE_SIZE,
+            },
+        },
+    }
+
+# Seconds a computed /api/listings/facets/ response is reused for the same filters
+LISTING_FACETS_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -179,6 +237,28 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
+CELERY_BEAT_SCHEDULE = {
+    # Move old bookings and their settled payments to the archive tables (listings/archive.py)
+    'archive-old-bookings': {
+        'task': 'listings.tasks.archive_old_bookings',
+        'schedule': 24 * 60 * 60,
+    },
+    # Verify payments whose webhook never arrived (listings/reconciliation.py)
+    'reconcile-pending-payments': {
+        'task': 'listings.tasks.reconcile_pending_payments',
+        'schedule': 15 * 60,
+    },
+}
+
+# Bookings that ended more than this many days ago are archived
+BOOKING_ARCHIVE_AFTER_DAYS = env.int('BOOKING_ARCHIVE_AFTER_DAYS', default=365)
+
+# Pending payments unchanged for this many minutes are verified with the gateway, with at most
+# PAYMENT_RECONCILE_WORKERS concurrent calls; those the gateway does not know are failed once they have
+# been pending for PAYMENT_ABANDON_AFTER_MINUTES
+PAYMENT_RECONCILE_AFTER_MINUTES = env.int('PAYMENT_RECONCILE_AFTER_MINUTES', default=30)
+PAYMENT_RECONCILE_WORKERS = env.int('PAYMENT_RECONCILE_WORKERS', default=8)
+PAYMENT_ABANDON_AFTER_MINUTES = env.int('PAYMENT_ABANDON_AFTER_MINUTES', default=24 * 60)
 
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -192,6 +272,21 @@ DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='')
 # Chapa Configuration
 CHAPA_SECRET_KEY = os.getenv('CHAPA_SECRET_KEY')
 CHAPA_BASE_URL = os.getenv('CHAPA_BASE_URL', 'https://api.chapa.co/v1')
+# Gateway HTTP client (listings/chapa_service.py): seconds to connect and to wait for an answer,
+# kept-alive connections per process, retries, their backoff factor in seconds and the longest
+# Retry-After wait in seconds
+CHAPA_CONNECT_TIMEOUT = env.float('CHAPA_CONNECT_TIMEOUT', default=3.05)
+CHAPA_READ_TIMEOUT = env.float('CHAPA_READ_TIMEOUT', default=10)
+CHAPA_POOL_SIZE = env.int('CHAPA_POOL_SIZE', default=20)
+CHAPA_MAX_RETRIES = env.int('CHAPA_MAX_RETRIES', default=2)
+CHAPA_RETRY_BACKOFF = env.float('CHAPA_RETRY_BACKOFF', default=0.3)
+CHAPA_MAX_RETRY_AFTER = env.float('CHAPA_MAX_RETRY_AFTER', default=5)
+# Connections of the async client (listings/async_chapa.py) per event loop, i.e. per ASGI worker; one
+# worker can have this many gateway calls in flight
+CHAPA_ASYNC_POOL_SIZE = env.int('CHAPA_ASYNC_POOL_SIZE', default=200)
+# Call the gateway from a Celery task and answer payment creation with 202 Accepted
+# (clients can ask for it per request with `Prefer: respond-async`)
+PAYMENT_INITIATION_ASYNC = env.bool('PAYMENT_INITIATION_ASYNC', default=False)
 
 LOG_DIR = BASE_DIR 
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'listings'
+
+    def ready(self):
+        # Register signal handlers and system checks
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,86 @@
+# Archival of old bookings
+# Bookings that ended more than BOOKING_ARCHIVE_AFTER_DAYS ago are copied to ArchivedBooking (with their
+# payment, once it is settled, to ArchivedPayment) and deleted from the hot tables in batches, each batch
+# in its own transaction. Deleting a booking also drops its BookedNight rows and fires the usual signals,
+# so the availability index and the cache versions stay consistent. Bookings whose payment is still
+# pending stay where they are until the payment settles.
+# Runs from `manage.py archive_bookings` and the periodic listings.tasks.archive_old_bookings task.
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ArchivedBooking, ArchivedPayment, Booking, Payment
+
+ARCHIVE_BATCH_SIZE = 500
+TERMINAL_PAYMENT_STATUSES = ('completed', 'failed', 'canceled')
+
+BOOKING_FIELDS = ['id', 'listing_id', 'user_id', 'start_date', 'end_date', 'total_price', 'created_at']
+PAYMENT_FIELDS = [
+    'transaction_id', 'booking_id', 'amount', 'currency', 'status', 'chapa_reference', 'previous_references',
+    'payment_method', 'checkout_url', 'created_at', 'updated_at', 'paid_at', 'initiation_response',
+    'verification_response',
+]
+
+
+def archive_cutoff(days=None):
+    """
+    Bookings ending before this date are archived
+    """
+    if days is None:
+        days = getattr(settings, 'BOOKING_ARCHIVE_AFTER_DAYS', 365)
+    return timezone.localdate() - timedelta(days=days)
+
+
+def archivable_bookings(cutoff):
+    """
+    Bookings that ended before cutoff and have no payment or a settled one
+    """
+    return Booking.objects.filter(end_date__lt=cutoff).filter(
+        Q(payment__isnull=True) | Q(payment__status__in=TERMINAL_PAYMENT_STATUSES)
+    )
+
+
+def archive_batch(booking_ids, cutoff):
+    """
+    Move the given bookings and their payments to the archive tables; returns (bookings, payments) moved
+    """
+    with transaction.atomic():
+        # Lock the rows and check them again, so a booking rescheduled or a payment retried since the
+        # candidates were selected is left alone
+        bookings = list(
+            Booking.objects.select_for_update().filter(pk__in=booking_ids, end_date__lt=cutoff).values(*BOOKING_FIELDS)
+        )
+        payments = list(
+            Payment.objects.select_for_update().filter(booking_id__in=booking_ids).values(*PAYMENT_FIELDS)
+        )
+        unsettled = {payment['booking_id'] for payment in payments if payment['status'] not in TERMINAL_PAYMENT_STATUSES}
+        bookings = [booking for booking in bookings if booking['id'] not in unsettled]
+        moved = {booking['id'] for booking in bookings}
+        payments = [payment for payment in payments if payment['booking_id'] in moved]
+        ArchivedBooking.objects.bulk_create([ArchivedBooking(**booking) for booking in bookings])
+        ArchivedPayment.objects.bulk_create([ArchivedPayment(**payment) for payment in payments])
+        # Cascades to the payments and booked nights
+        Booking.objects.filter(pk__in=moved).delete()
+    return len(bookings), len(payments)
+
+
+def archive_bookings(days=None, batch_size=ARCHIVE_BATCH_SIZE, limit=None):
+    """
+    Archive every archivable booking (at most limit of them); returns (bookings, payments) moved
+    """
+    cutoff = archive_cutoff(days)
+    candidates = archivable_bookings(cutoff).order_by('pk').values_list('pk', flat=True)
+    moved_bookings = moved_payments = 0
+    last_pk = None
+    while limit is None or moved_bookings < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved_bookings)
+        batch = candidates if last_pk is None else candidates.filter(pk__gt=last_pk)
+        booking_ids = list(batch[:size])
+        if not booking_ids:
+            break
+        bookings, payments = archive_batch(booking_ids, cutoff)
+        moved_bookings += bookings
+        moved_payments += payments
+        last_pk = booking_ids[-1]
+    return moved_bookings, moved_payments
@@ -0,0 +1,226 @@
+# Async Chapa client for the ASGI views
+# AsyncChapaService answers like ChapaService (same result dicts) but awaits the gateway, so one event loop
+# can have hundreds of calls in flight. Its connection pool is shared by every call made on the same event
+# loop (one per ASGI worker) and keeps up to CHAPA_ASYNC_POOL_SIZE connections alive. httpcore scans every
+# connection of a client whenever a request starts or ends, which gets expensive with hundreds of them, so
+# the pool is spread over httpx.AsyncClient shards of at most CONNECTIONS_PER_CLIENT connections, used in
+# turn (with 200 connections: 45 instead of 29 payments/sec in the asgi_payments benchmark). Retries follow
+# the synchronous session: failed connection attempts for every call, read errors and 429/5xx answers only
+# for the verification GET, with exponential, jittered backoff.
+# httpx is optional: without it the synchronous views keep working and AsyncChapaService refuses to start.
+import asyncio
+import itertools
+import logging
+import random
+import weakref
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .chapa_service import RETRY_STATUSES, initialize_payload
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx is optional
+    httpx = None
+
+logger = logging.getLogger('chapa_payment')
+
+CONNECTIONS_PER_CLIENT = 25
+
+# Event loop -> (its clients, round robin over them); clients cannot be shared across event loops
+_clients = weakref.WeakKeyDictionary()
+
+
+def build_async_client(connections):
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    transport = httpx.AsyncHTTPTransport(retries=settings.CHAPA_MAX_RETRIES, limits=limits)
+    # The pool timeout bounds the wait for a free connection when every one is busy
+    timeout = httpx.Timeout(
+        settings.CHAPA_READ_TIMEOUT, connect=settings.CHAPA_CONNECT_TIMEOUT, pool=settings.CHAPA_READ_TIMEOUT,
+    )
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+def get_async_client():
+    """
+    A gateway client of the running event loop (the next shard of its pool)
+    """
+    if httpx is None:
+        raise ImproperlyConfigured('AsyncChapaService needs httpx (pip install httpx)')
+    loop = asyncio.get_running_loop()
+    pool = _clients.get(loop)
+    if pool is None or pool[0][0].is_closed:
+        size = settings.CHAPA_ASYNC_POOL_SIZE
+        shards = -(-size // CONNECTIONS_PER_CLIENT)
+        clients = [build_async_client(size // shards + (index < size % shards)) for index in range(shards)]
+        pool = _clients[loop] = (clients, itertools.cycle(clients))
+    return next(pool[1])
+
+
+async def close_async_client():
+    """
+    Close the clients of the running event loop, e.g. on ASGI lifespan shutdown or after changing the
+    CHAPA_* pool settings
+    """
+    clients, _ = _clients.pop(asyncio.get_running_loop(), ((), None))
+    for client in clients:
+        await client.aclose()
+
+
+class AsyncChapaService:
+    def __init__(self, client=None):
+        self.secret_key = settings.CHAPA_SECRET_KEY
+        self.base_url = settings.CHAPA_BASE_URL
+        self.client = client or get_async_client()
+        self.headers = {
+            'Authorization': f'Bearer {self.secret_key}',
+            'Content-Type': 'application/json'
+        }
+
+    async def initiate_payment(self, amount, email, first_name, last_name, tx_ref,
+                               return_url, currency='ETB', custom_title=None, custom_description=None):
+        """
+        Initiate payment with Chapa API (see ChapaService.initiate_payment)
+        """
+        url = f"{self.base_url}/transaction/initialize"
+        payload = initialize_payload(
+            amount, email, first_name, last_name, tx_ref, return_url, currency, custom_title, custom_description
+        )
+
+        logger.info("🔗 Initiating Chapa payment (async)", extra={
+            'transaction_id': tx_ref,
+            'amount': amount,
+            'currency': currency,
+            'action': 'payment_initiation_start'
+        })
+
+        try:
+            response = await self.client.post(url, json=payload, headers=self.headers)
+            response.raise_for_status()
+            data = response.json()
+
+            logger.info("✅ Chapa payment initiated successfully", extra={
+                'transaction_id': tx_ref,
+                'checkout_url': data.get('data', {}).get('checkout_url'),
+                'chapa_message': data.get('message'),
+                'action': 'payment_initiation_success'
+            })
+
+            return {
+                'success': True,
+                'checkout_url': data['data']['checkout_url'],
+                'transaction_id': data['data'].get('tx_ref', tx_ref),
+                'response_data': data
+            }
+
+        except httpx.HTTPError as e:
+            error_details = {
+                'transaction_id': tx_ref,
+                'error_type': type(e).__name__,
+                'error_message': str(e),
+                'action': 'payment_initiation_failed'
+            }
+            if isinstance(e, httpx.HTTPStatusError):
+                error_details.update({
+                    'response_status': e.response.status_code,
+                    'response_body': e.response.text
+                })
+            logger.error("❌ Chapa payment initiation failed with details:", extra=error_details)
+
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Failed to initiate payment with Chapa'
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("❌ Unexpected error in Chapa payment initiation:", extra={
+                'transaction_id': tx_ref,
+                'error': str(e),
+                'error_type': type(e).__name__,
+                'action': 'payment_initiation_unexpected_error'
+            })
+
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Unexpected error during payment initiation'
+            }
+
+    async def get_with_retries(self, url):
+        # GET is idempotent: read errors and 429/5xx answers are retried with backoff
+        attempts = settings.CHAPA_MAX_RETRIES + 1
+        backoff = settings.CHAPA_RETRY_BACKOFF
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                response = await self.client.get(url, headers=self.headers)
+            except (httpx.ReadError, httpx.ReadTimeout, httpx.RemoteProtocolError):
+                if last:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last:
+                    return response
+            await asyncio.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+
+    async def verify_payment(self, tx_ref):
+        """
+        Ask Chapa for the state of a transaction (see ChapaService.verify_payment)
+        """
+        url = f"{self.base_url}/transaction/verify/{tx_ref}"
+
+        logger.info("🔎 Verifying Chapa payment (async)", extra={
+            'transaction_id': tx_ref,
+            'action': 'payment_verification_start'
+        })
+
+        try:
+            response = await self.get_with_retries(url)
+
+            if response.status_code == 404:
+                return {
+                    'success': False,
+                    'not_found': True,
+                    'error': 'Transaction not found',
+                    'message': 'Chapa does not know this transaction'
+                }
+
+            response.raise_for_status()
+            data = response.json()
+            chapa_status = (data.get('data') or {}).get('status')
+
+            logger.info("✅ Chapa payment verified", extra={
+                'transaction_id': tx_ref,
+                'status': chapa_status,
+                'action': 'payment_verification_success'
+            })
+
+            return {
+                'success': True,
+                'status': chapa_status,
+                'response_data': data
+            }
+
+        except httpx.HTTPError as e:
+            logger.error("❌ Chapa payment verification failed", extra={
+                'transaction_id': tx_ref,
+                'error_type': type(e).__name__,
+                'error_message': str(e),
+                'action': 'payment_verification_failed'
+            })
+
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Failed to verify payment with Chapa'
+            }
+        except ValueError as e:
+            logger.error("❌ Unexpected Chapa verification answer", extra={
+                'transaction_id': tx_ref,
+                'error': str(e),
+                'action': 'payment_verification_bad_response'
+            })
+
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Unexpected answer from Chapa'
+            }
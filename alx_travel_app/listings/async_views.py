@@ -0,0 +1,171 @@
+# Async payment views (ASGI)
+# Same requests and answers as POST /api/payments/ (inline initiation) and GET /api/payments/status/, but
+# the gateway call is awaited with AsyncChapaService instead of holding a worker thread, so under ASGI one
+# worker serves hundreds of payments waiting on Chapa at the same time. DRF views are synchronous, so these
+# are plain Django async views: the database work (DRF authentication, validation, the ORM, serializers)
+# runs in one sync_to_async hop before the gateway call and one after it.
+# Served at /api/async/payments/ and /api/async/payments/status/ (see listings/urls.py).
+import logging
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .async_chapa import AsyncChapaService
+from .models import Booking
+from .payments import apply_verification, initiation_request, new_payment, record_initiation
+from .renderers import dumps
+from .serializers import PaymentInitiationSerializer, PaymentSerializer
+from .views import find_status_payment, wants_verification
+
+logger = logging.getLogger('chapa_payment')
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(dumps(data), status=status_code, content_type='application/json')
+
+
+def api_request(request):
+    """
+    DRF request around a Django request, with the project's authentication classes
+    """
+    return Request(
+        request,
+        parsers=[JSONParser(), FormParser(), MultiPartParser()],
+        authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+
+
+def authentication_error(api):
+    """
+    Error response for a request that is not authenticated (like IsAuthenticated), or None
+    """
+    try:
+        user = api.user
+    except APIException as e:
+        return json_response({'detail': str(e.detail)}, e.status_code)
+    if user and user.is_authenticated:
+        return None
+    response = json_response({'detail': 'Authentication credentials were not provided.'}, status.HTTP_401_UNAUTHORIZED)
+    header = api.authenticators[0].authenticate_header(api) if api.authenticators else None
+    if header:
+        response['WWW-Authenticate'] = header
+    return response
+
+
+def prepare_payment(request):
+    # Everything before the gateway call: returns (error response, None) or (None, (payment, gateway arguments))
+    api = api_request(request)
+    error = authentication_error(api)
+    if error:
+        return error, None
+    try:
+        # Parsing raises ParseError (malformed body) or UnsupportedMediaType, answered like DRF views do
+        serializer = PaymentInitiationSerializer(data=api.data, context={'request': api})
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST), None
+    except APIException as e:
+        return json_response({'detail': str(e.detail)}, e.status_code), None
+    booking_id = serializer.validated_data['booking_id']
+    booking = Booking.objects.select_related('user', 'listing').get(id=booking_id)
+
+    logger.info("Processing payment for booking", extra={
+        'booking_id': str(booking_id),
+        'user': api.user.email,
+        'action': 'payment_processing_start'
+    })
+
+    return_url = api.build_absolute_uri(reverse('payment-success')) + f"?booking={booking_id}"
+    payment = new_payment(booking)
+    return None, (payment, initiation_request(payment, return_url))
+
+
+def finish_payment(payment, result):
+    # Everything after the gateway call
+    record_initiation(payment, result)
+    if not result['success']:
+        logger.error("Payment initiation failed", extra={
+            'booking_id': str(payment.booking_id),
+            'error': result.get('message'),
+            'action': 'payment_initiation_failed'
+        })
+        return json_response(
+            {'error': result['message'], 'transaction_id': str(payment.transaction_id)},
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    logger.info("Payment record created successfully", extra={
+        'transaction_id': str(payment.transaction_id),
+        'booking_id': str(payment.booking_id),
+        'action': 'payment_created'
+    })
+
+    return json_response({
+        'success': True,
+        'payment': PaymentSerializer(payment).data,
+        'checkout_url': result['checkout_url'],
+        'message': 'Payment initiated successfully. Redirect to checkout URL to complete payment.'
+    }, status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+async def create_payment(request):
+    """
+    Async POST /api/payments/: create the pending payment of a booking and initiate it with the gateway
+    """
+    error, prepared = await sync_to_async(prepare_payment)(request)
+    if error:
+        return error
+    payment, gateway_arguments = prepared
+    try:
+        result = await AsyncChapaService().initiate_payment(**gateway_arguments)
+        return await sync_to_async(finish_payment)(payment, result)
+    except Exception as e:
+        logger.error("Unexpected error in payment creation", extra={
+            'transaction_id': str(payment.transaction_id),
+            'error': str(e),
+            'action': 'payment_creation_error'
+        })
+        return json_response(
+            {'error': f'An unexpected error occurred: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+
+def find_payment(request):
+    # Authentication and lookup of the status view: returns (error response, None, None, request) or
+    # (None, payment, serializer class, request)
+    api = api_request(request)
+    error = authentication_error(api)
+    if error:
+        return error, None, None, api
+    payment, serializer_class, error = find_status_payment(api)
+    if error:
+        return json_response(*error), None, None, api
+    return None, payment, serializer_class, api
+
+
+def payment_data(payment, serializer_class, api, result=None):
+    # Apply a verification result, then serialize
+    if result is not None and result['success']:
+        apply_verification(payment, payment.chapa_reference, result)
+    return serializer_class(payment, context={'request': api}).data
+
+
+@require_GET
+async def payment_status(request):
+    """
+    Async GET /api/payments/status/ (?transaction_id= or ?booking_id=, ?verify=true, ?include_archived=true)
+    """
+    error, payment, serializer_class, api = await sync_to_async(find_payment)(request)
+    if error:
+        return error
+    result = None
+    if wants_verification(api, payment, serializer_class):
+        result = await AsyncChapaService().verify_payment(payment.chapa_reference)
+    return json_response(await sync_to_async(payment_data)(payment, serializer_class, api, result))
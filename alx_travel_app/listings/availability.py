@@ -0,0 +1,92 @@
+# Availability index for listings
+# Every booking is expanded into one BookedNight row per occupied night (check-out day excluded),
+# which turns "is this listing free between A and B" into an indexed lookup on (listing, night).
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .models import BookedNight, Booking, Listing
+
+
+def nights_between(start_date, end_date):
+    """
+    Return the nights occupied by a stay from start_date up to (not including) end_date
+    """
+    nights = []
+    night = start_date
+    while night < end_date:
+        nights.append(night)
+        night += timedelta(days=1)
+    return nights
+
+
+def sync_booking_nights(booking):
+    """
+    Rewrite the booked nights of a single booking after it was created or rescheduled
+    """
+    nights = nights_between(booking.start_date, booking.end_date)
+    with transaction.atomic():
+        BookedNight.objects.filter(booking=booking).delete()
+        BookedNight.objects.bulk_create([
+            BookedNight(listing_id=booking.listing_id, booking=booking, night=night)
+            for night in nights
+        ])
+    return len(nights)
+
+
+def rebuild_booked_nights(batch_size=1000):
+    """
+    Rebuild the whole availability index from the booking table
+    """
+    total = 0
+    pending = []
+    bookings = Booking.objects.only('id', 'listing_id', 'start_date', 'end_date').order_by('pk')
+    with transaction.atomic():
+        BookedNight.objects.all().delete()
+        for booking in bookings.iterator(chunk_size=batch_size):
+            pending.extend(
+                BookedNight(listing_id=booking.listing_id, booking_id=booking.id, night=night)
+                for night in nights_between(booking.start_date, booking.end_date)
+            )
+            if len(pending) >= batch_size:
+                BookedNight.objects.bulk_create(pending, batch_size=batch_size)
+                total += len(pending)
+                pending = []
+        if pending:
+            BookedNight.objects.bulk_create(pending, batch_size=batch_size)
+            total += len(pending)
+    return total
+
+
+def booked_between(start_date, end_date):
+    """
+    Subquery matching listings that have at least one booked night in [start_date, end_date)
+    """
+    return BookedNight.objects.filter(
+        listing=OuterRef('pk'),
+        night__gte=start_date,
+        night__lt=end_date,
+    )
+
+
+def filter_available(queryset, start_date, end_date):
+    """
+    Keep only the listings of a queryset that are free for the whole stay
+    """
+    return queryset.filter(~Exists(booked_between(start_date, end_date)))
+
+
+def available_listing_ids(listing_ids, ranges):
+    """
+    For every (start_date, end_date) of ranges, the subset of listing_ids free for the whole stay.
+    Returns (one list of ids per range, ids that match no listing), from a single query with one
+    NOT EXISTS probe of the (listing, night) index per listing and range.
+    """
+    flags = {f'free_{i}': ~Exists(booked_between(start, end)) for i, (start, end) in enumerate(ranges)}
+    rows = {
+        row[0]: row[1:]
+        for row in Listing.objects.filter(pk__in=listing_ids).annotate(**flags).values_list('pk', *flags)
+    }
+    # Answers keep the order of the request
+    available = [[pk for pk in listing_ids if pk in rows and rows[pk][i]] for i in range(len(ranges))]
+    unknown = [pk for pk in listing_ids if pk not in rows]
+    return available, unknown
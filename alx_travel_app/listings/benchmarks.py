@@ -0,0 +1,840 @@
+# Benchmarks for the performance sensitive code paths
+# Run with: python manage.py benchmark <scenario>
+# Every scenario works inside a transaction that is rolled back, so no benchmark data is left behind.
+import asyncio
+import base64
+import io
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+import requests
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from .models import User, Listing, Booking, BookedNight, NightlyRate, StayDiscount, Payment
+from .availability import available_listing_ids, filter_available, nights_between
+from .serializers import ListingSerializer, BookingSerializer
+from .fastpath import listing_values, booking_values
+from .renderers import StreamingJSONResponse, dumps
+from .calendar import calendar_payload, listing_occupancy, month_window, occupied_ranges
+from .pricing import build_rate_tables, price_page, rate_tables
+from .exports import export_lines
+from .imports import import_listings
+from .booking_engine import BookingConflict, create_booking
+from .chapa_service import ChapaService, get_session, reset_session
+from .async_chapa import close_async_client
+from .fake_gateway import FakeChapaGateway
+from .reconciliation import reconcile_payments, throughput
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """
+    Register a benchmark scenario under the given name
+    """
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def rolled_back():
+    """
+    Run the block in a transaction that is always rolled back
+    """
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def timed(func, repeat=5):
+    """
+    Return the best wall clock time of func() over repeat runs, in milliseconds
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def make_user(role='guest'):
+    token = uuid.uuid4().hex[:12]
+    return User.objects.create(
+        username=f'bench_{token}',
+        email=f'bench_{token}@example.com',
+        first_name='Bench',
+        last_name=role.title(),
+        role=role,
+    )
+
+
+def make_listings(host, count):
+    return Listing.objects.bulk_create([
+        Listing(
+            host=host,
+            title=f'Benchmark listing {i}',
+            description='Benchmark listing',
+            property_type='apartment',
+            amenities=['wifi'],
+            address=f'{i} Benchmark street',
+            price_per_night=Decimal('100.00'),
+        )
+        for i in range(count)
+    ])
+
+
+def make_bookings(listings, guest, count, first_day, span_days=365):
+    """
+    Bulk insert random bookings together with their booked nights
+    """
+    bookings = []
+    for _ in range(count):
+        start = first_day + timedelta(days=random.randrange(span_days))
+        bookings.append(Booking(
+            listing=random.choice(listings),
+            user=guest,
+            start_date=start,
+            end_date=start + timedelta(days=random.randint(1, 7)),
+            total_price=Decimal('100.00'),
+        ))
+    Booking.objects.bulk_create(bookings, batch_size=1000)
+    BookedNight.objects.bulk_create([
+        BookedNight(listing_id=booking.listing_id, booking_id=booking.id, night=night)
+        for booking in bookings
+        for night in nights_between(booking.start_date, booking.end_date)
+    ], batch_size=1000)
+    return bookings
+
+
+@scenario('availability')
+def availability(stdout, sizes, repeat, listings=200, **kwargs):
+    """
+    Compare the legacy exclude()+distinct() availability search with the booked nights anti-join
+    """
+    sizes = sizes or [1000, 5000, 20000]
+    first_day = date.today()
+    start_date = first_day + timedelta(days=180)
+    end_date = start_date + timedelta(days=3)
+
+    def legacy():
+        return list(
+            Listing.objects.exclude(
+                bookings__start_date__lt=end_date,
+                bookings__end_date__gt=start_date,
+            ).distinct().values_list('id', flat=True)
+        )
+
+    def indexed():
+        return list(filter_available(Listing.objects.all(), start_date, end_date).values_list('id', flat=True))
+
+    def expected():
+        # exclude() does not tie both booking conditions to the same booking, so the legacy query
+        # can over-exclude; check the index against the intended overlap rule instead
+        busy = set(Booking.objects.filter(
+            start_date__lt=end_date, end_date__gt=start_date,
+        ).values_list('listing_id', flat=True))
+        return [listing.id for listing in created if listing.id not in busy]
+
+    with rolled_back():
+        host = make_user('host')
+        guest = make_user('guest')
+        created = make_listings(host, listings)
+        total = 0
+        stdout.write(f'{"bookings":>10} {"legacy ms":>12} {"indexed ms":>12}')
+        for size in sorted(sizes):
+            make_bookings(created, guest, size - total, first_day)
+            total = size
+            assert sorted(expected()) == sorted(indexed())
+            stdout.write(f'{total:>10} {timed(legacy, repeat):>12.2f} {timed(indexed, repeat):>12.2f}')
+
+
+@scenario('batch_availability')
+def batch_availability(stdout, sizes, repeat, bookings=20000, **kwargs):
+    """
+    One availability query per listing (the map view today) vs one batch query for all visible listings
+    """
+    sizes = sizes or [50, 100, 200]
+    first_day = date.today()
+    start_date = first_day + timedelta(days=180)
+    end_date = start_date + timedelta(days=3)
+
+    with rolled_back():
+        host = make_user('host')
+        guest = make_user('guest')
+        created = make_listings(host, max(sizes))
+        make_bookings(created, guest, bookings, first_day)
+        stdout.write(f'{"listings":>8} {"per listing ms":>15} {"batch ms":>9}')
+        for size in sorted(sizes):
+            listing_ids = [listing.pk for listing in created[:size]]
+
+            def per_listing():
+                return [
+                    pk for pk in listing_ids
+                    if filter_available(Listing.objects.filter(pk=pk), start_date, end_date).exists()
+                ]
+
+            def batch():
+                return available_listing_ids(listing_ids, [(start_date, end_date)])[0][0]
+
+            assert per_listing() == batch()
+            stdout.write(f'{size:>8} {timed(per_listing, repeat):>15.2f} {timed(batch, repeat):>9.2f}')
+
+
+@scenario('pricing')
+def pricing(stdout, sizes, repeat, **kwargs):
+    """
+    Pricing a result page listing by listing vs in one pass over the page (cold and cached rate tables)
+    """
+    sizes = sizes or [20, 50, 100]
+    first_day = date.today()
+    start_date = first_day + timedelta(days=30)
+    end_date = start_date + timedelta(days=7)
+
+    with rolled_back():
+        host = make_user('host')
+        created = make_listings(host, max(sizes))
+        # A season of weekend overrides and a weekly discount on every listing
+        NightlyRate.objects.bulk_create([
+            NightlyRate(listing=listing, night=first_day + timedelta(days=day), price=Decimal('150.00'))
+            for listing in created
+            for day in range(0, 90, 7)
+        ])
+        StayDiscount.objects.bulk_create([
+            StayDiscount(listing=listing, min_nights=7, percent=Decimal('10.00')) for listing in created
+        ])
+        stdout.write(f'{"listings":>8} {"per listing ms":>15} {"page ms":>8} {"cached page ms":>15}')
+        for size in sorted(sizes):
+            listing_ids = [listing.pk for listing in created[:size]]
+
+            def per_listing():
+                return {pk: build_rate_tables([pk])[pk].quote(start_date, end_date) for pk in listing_ids}
+
+            def page():
+                return {pk: table.quote(start_date, end_date) for pk, table in build_rate_tables(listing_ids).items()}
+
+            rate_tables(listing_ids)
+            assert per_listing() == page() == price_page(listing_ids, start_date, end_date)
+            stdout.write(
+                f'{size:>8} {timed(per_listing, repeat):>15.2f} {timed(page, repeat):>8.2f} '
+                f'{timed(lambda: price_page(listing_ids, start_date, end_date), repeat):>15.2f}'
+            )
+
+
+@scenario('serialization')
+def serialization(stdout, sizes, repeat, **kwargs):
+    """
+    Compare ModelSerializer(many=True) with the values-based fast path for listing and booking lists
+    (listings.tests.FastPathTests checks that both render the same bytes)
+    """
+    sizes = sizes or [100, 1000, 5000]
+    first_day = date.today()
+
+    with rolled_back():
+        host = make_user('host')
+        guest = make_user('guest')
+        stdout.write(f'{"rows":>8} {"model":>10} {"drf rows/s":>14} {"fast rows/s":>14} {"speedup":>9}')
+        created_listings, total = [], 0
+        for size in sorted(sizes):
+            created_listings += make_listings(host, size - total)
+            make_bookings(created_listings, guest, size - total, first_day)
+            total = size
+            cases = (
+                ('listing', ListingSerializer, listing_values,
+                 Listing.objects.select_related('host').order_by('pk')),
+                ('booking', BookingSerializer, booking_values,
+                 Booking.objects.select_related('user', 'listing__host', 'payment').order_by('pk')),
+            )
+            for name, serializer_class, values, queryset in cases:
+                def drf():
+                    return serializer_class(queryset.all(), many=True).data
+
+                def fast():
+                    return values.serialize(queryset.all())
+
+                drf_ms, fast_ms = timed(drf, repeat), timed(fast, repeat)
+                stdout.write(
+                    f'{total:>8} {name:>10} {total / drf_ms * 1000:>14.0f} '
+                    f'{total / fast_ms * 1000:>14.0f} {drf_ms / fast_ms:>8.1f}x'
+                )
+
+
+def peak_memory(func):
+    """
+    Return the peak memory allocated while running func(), in KiB
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+@scenario('rendering')
+def rendering(stdout, sizes, repeat, **kwargs):
+    """
+    Compare building a whole booking list in memory with the stdlib encoder against the streamed orjson array
+    """
+    sizes = sizes or [1000, 10000, 50000]
+    renderer = JSONRenderer()
+    first_day = date.today()
+
+    with rolled_back():
+        host = make_user('host')
+        guest = make_user('guest')
+        created = make_listings(host, 50)
+        queryset = Booking.objects.filter(listing__host=host)
+
+        def in_memory():
+            data = BookingSerializer(queryset.select_related('user', 'listing__host', 'payment'), many=True).data
+            return renderer.render(data)
+
+        def streamed():
+            response = StreamingJSONResponse(
+                queryset.only('pk', 'created_at'),
+                lambda batch: booking_values.serialize_pks(Booking.objects.all(), [booking.pk for booking in batch]),
+                ordering=['-created_at'],
+            )
+            for _ in response.streaming_content:
+                pass
+
+        stdout.write(f'{"rows":>8} {"memory ms":>10} {"memory KiB":>11} {"stream ms":>10} {"stream KiB":>11}')
+        total = 0
+        for size in sorted(sizes):
+            make_bookings(created, guest, size - total, first_day)
+            total = size
+            stdout.write(
+                f'{total:>8} {timed(in_memory, repeat):>10.0f} {peak_memory(in_memory):>11.0f} '
+                f'{timed(streamed, repeat):>10.0f} {peak_memory(streamed):>11.0f}'
+            )
+
+
+@scenario('calendar')
+def calendar(stdout, sizes, repeat, **kwargs):
+    """
+    Payload size and latency of one month of a listing's bookings as nested objects vs the occupancy calendar
+    """
+    sizes = sizes or [10, 100, 1000]
+    first_day = date.today().replace(day=1)
+    start_date, end_date = month_window(first_day.strftime('%Y-%m'))
+
+    with rolled_back():
+        host = make_user('host')
+        guest = make_user('guest')
+        listing = make_listings(host, 1)[0]
+        month_bookings = Booking.objects.filter(
+            listing=listing, start_date__lt=end_date, end_date__gt=start_date,
+        ).select_related('user', 'listing__host', 'payment')
+
+        def nested():
+            return JSONRenderer().render(BookingSerializer(month_bookings.all(), many=True).data)
+
+        def computed():
+            return dumps(calendar_payload(occupied_ranges(listing.pk, start_date, end_date), start_date, end_date))
+
+        def cached():
+            return dumps(calendar_payload(listing_occupancy(listing.pk, start_date, end_date), start_date, end_date))
+
+        bitmap = len(dumps(calendar_payload([], start_date, end_date, 'bitmap')))
+        stdout.write(
+            f'{"bookings":>8} {"nested B":>9} {"nested ms":>10} {"ranges B":>9} {"bitmap B":>9} '
+            f'{"query ms":>9} {"cached ms":>10}'
+        )
+        total = 0
+        for size in sorted(sizes):
+            # size bookings per year on the listing
+            make_bookings([listing], guest, size - total, first_day)
+            total = size
+            stdout.write(
+                f'{total:>8} {len(nested()):>9} {timed(nested, repeat):>10.1f} {len(computed()):>9} {bitmap:>9} '
+                f'{timed(computed, repeat):>9.2f} {timed(cached, repeat):>10.2f}'
+            )
+
+
+@scenario('export')
+def export(stdout, sizes, repeat, **kwargs):
+    """
+    Time and peak memory of the NDJSON and CSV booking exports as the table grows
+    """
+    sizes = sizes or [10000, 50000, 200000]
+    first_day = date.today()
+
+    with rolled_back():
+        host = make_user('host')
+        guest = make_user('guest')
+        created = make_listings(host, 50)
+
+        def run(export_format):
+            def consume():
+                for _ in export_lines('bookings', export_format):
+                    pass
+            return consume
+
+        stdout.write(f'{"rows":>8} {"ndjson ms":>10} {"ndjson KiB":>11} {"csv ms":>10} {"csv KiB":>11}')
+        total = 0
+        for size in sorted(sizes):
+            make_bookings(created, guest, size - total, first_day)
+            total = size
+            stdout.write(
+                f'{total:>8} {timed(run("ndjson"), repeat):>10.0f} {peak_memory(run("ndjson")):>11.0f} '
+                f'{timed(run("csv"), repeat):>10.0f} {peak_memory(run("csv")):>11.0f}'
+            )
+
+
+@scenario('import')
+def import_(stdout, sizes, repeat, **kwargs):
+    """
+    Compare one ListingSerializer create per listing with the batched NDJSON import
+    """
+    sizes = sizes or [100, 1000, 5000]
+    with rolled_back():
+        host = make_user('host')
+        stdout.write(f'{"rows":>8} {"per row ms":>12} {"bulk ms":>10} {"speedup":>9}')
+        for size in sorted(sizes):
+            rows = [
+                {
+                    'host_id': str(host.pk),
+                    'title': f'Imported listing {i}',
+                    'description': 'Benchmark import',
+                    'property_type': 'house',
+                    'amenities': ['wifi', 'kitchen'],
+                    'address': f'{i} Import road',
+                    'price_per_night': '80.00',
+                }
+                for i in range(size)
+            ]
+            lines = [json.dumps(row) for row in rows]
+
+            def per_row():
+                with rolled_back():
+                    for row in rows:
+                        serializer = ListingSerializer(data=row)
+                        serializer.is_valid(raise_exception=True)
+                        serializer.save()
+
+            def bulk():
+                with rolled_back():
+                    result = import_listings(lines)
+                    assert result.created == size and not result.errors
+
+            per_row_ms, bulk_ms = timed(per_row, repeat), timed(bulk, repeat)
+            stdout.write(f'{size:>8} {per_row_ms:>12.0f} {bulk_ms:>10.0f} {per_row_ms / bulk_ms:>8.1f}x')
+
+
+@scenario('booking_stress')
+def booking_stress(stdout, sizes, repeat, listings=5, attempts=200, days=60, **kwargs):
+    """
+    Concurrent booking attempts on a few listings from N threads: measures bookings/sec and checks
+    that no night is ever booked twice. Threads need committed data, so this scenario commits its
+    fixtures and deletes them afterwards instead of rolling back.
+    """
+    sizes = sizes or [1, 4, 8, 16]
+    first_day = date.today() + timedelta(days=30)
+    host = make_user('host')
+    guest = make_user('guest')
+    try:
+        stdout.write(f'{"threads":>8} {"attempts":>9} {"booked":>7} {"conflicts":>10} {"errors":>7} {"bookings/s":>11} {"attempts/s":>11}')
+        for threads in sorted(sizes):
+            created = make_listings(host, listings)
+            counts = {'booked': 0, 'conflicts': 0, 'errors': 0}
+            lock = threading.Lock()
+
+            def worker(seed):
+                rng = random.Random(seed)
+                try:
+                    for _ in range(attempts // threads):
+                        start = first_day + timedelta(days=rng.randrange(days))
+                        end = start + timedelta(days=rng.randint(1, 5))
+                        try:
+                            create_booking(rng.choice(created), guest, start, end)
+                            outcome = 'booked'
+                        except BookingConflict:
+                            outcome = 'conflicts'
+                        except OperationalError:
+                            # Lock wait timeouts / deadlocks reported by the database
+                            outcome = 'errors'
+                        with lock:
+                            counts[outcome] += 1
+                finally:
+                    connection.close()
+
+            workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+            started = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            # No listing night may belong to two bookings, and every booking must own all of its nights
+            listing_ids = [listing.pk for listing in created]
+            doubled = BookedNight.objects.filter(listing_id__in=listing_ids).values('listing_id', 'night') \
+                .annotate(taken=Count('id')).filter(taken__gt=1)
+            assert not doubled.exists(), f'Double-booked nights: {list(doubled[:5])}'
+            bookings = Booking.objects.filter(listing_id__in=listing_ids)
+            expected_nights = sum(len(nights_between(b.start_date, b.end_date)) for b in bookings)
+            assert BookedNight.objects.filter(listing_id__in=listing_ids).count() == expected_nights
+            assert bookings.count() == counts['booked']
+
+            total = sum(counts.values())
+            stdout.write(
+                f'{threads:>8} {total:>9} {counts["booked"]:>7} {counts["conflicts"]:>10} {counts["errors"]:>7} '
+                f'{counts["booked"] / elapsed:>11.1f} {total / elapsed:>11.1f}'
+            )
+            Listing.objects.filter(pk__in=listing_ids).delete()
+    finally:
+        host.delete()
+        guest.delete()
+
+
+@scenario('chapa_client')
+def chapa_client(stdout, sizes, repeat, calls=200, latency=0.005, handshake_latency=0.02, **kwargs):
+    """
+    Payment initiation against a local stand-in gateway (listings/fake_gateway.py) from N threads: one new
+    connection per call (plain requests.post, the previous behaviour) vs the pooled keep-alive session.
+    Every answer takes `latency` seconds and every new connection `handshake_latency` more (TCP + TLS).
+    """
+    sizes = sizes or [1, 8, 32]
+
+    def run(gateway, session, threads):
+        errors = []
+        timings = []
+        lock = threading.Lock()
+
+        def worker(index):
+            service = ChapaService(session=session)
+            for call in range(calls // threads):
+                started = time.perf_counter()
+                result = service.initiate_payment(
+                    amount=Decimal('100.00'), email='bench@example.com', first_name='Bench', last_name='Guest',
+                    tx_ref=uuid.uuid4().hex, return_url='http://localhost/payment/success/',
+                )
+                with lock:
+                    timings.append(time.perf_counter() - started)
+                    if not result['success']:
+                        errors.append(result['error'])
+
+        workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+        connections = gateway.connections
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        return {
+            'p50': timings[len(timings) // 2] * 1000,
+            'p95': timings[int(len(timings) * 0.95)] * 1000,
+            'rate': len(timings) / elapsed,
+            'connections': gateway.connections - connections,
+            'errors': len(errors),
+        }
+
+    with FakeChapaGateway(latency=latency, handshake_latency=handshake_latency) as gateway, \
+            override_settings(CHAPA_BASE_URL=gateway.base_url, CHAPA_POOL_SIZE=max(sizes)):
+        reset_session()
+        stdout.write(
+            f'{"threads":>8} {"client":>7} {"p50 ms":>7} {"p95 ms":>7} {"calls/s":>8} {"connections":>12} {"errors":>7}'
+        )
+        try:
+            for threads in sorted(sizes):
+                # requests.post opens (and closes) a connection per call, like ChapaService used to
+                for label, session in (('fresh', requests), ('pooled', get_session())):
+                    result = run(gateway, session, threads)
+                    stdout.write(
+                        f'{threads:>8} {label:>7} {result["p50"]:>7.1f} {result["p95"]:>7.1f} {result["rate"]:>8.1f} '
+                        f'{result["connections"]:>12} {result["errors"]:>7}'
+                    )
+        finally:
+            reset_session()
+
+
+@scenario('payment_initiation')
+def payment_initiation(stdout, sizes, repeat, **kwargs):
+    """
+    Web request time of POST /api/payments/ when the gateway is called inline vs in async mode (202),
+    for gateway latencies of `--sizes` milliseconds. The async request ends before the task is queued
+    (the queueing happens on commit), so the broker round trip is not included.
+    """
+    sizes = sizes or [50, 200, 1000]
+    first_day = date.today() + timedelta(days=30)
+
+    with rolled_back(), FakeChapaGateway() as gateway, \
+            override_settings(CHAPA_BASE_URL=gateway.base_url, ALLOWED_HOSTS=['testserver']):
+        reset_session()
+        host = make_user('host')
+        guest = make_user('guest')
+        listing = make_listings(host, 1)[0]
+        bookings = iter(make_bookings([listing], guest, 2 * repeat * len(sizes), first_day))
+        client = APIClient()
+        client.force_authenticate(guest)
+
+        def pay(**headers):
+            started = time.perf_counter()
+            response = client.post('/api/payments/', {'booking_id': str(next(bookings).pk)}, format='json', **headers)
+            assert response.status_code in (201, 202), response.content
+            return (time.perf_counter() - started) * 1000
+
+        stdout.write(f'{"gateway ms":>10} {"inline ms":>10} {"async ms":>9}')
+        try:
+            for latency in sorted(sizes):
+                gateway.latency = latency / 1000
+                inline = min(pay(HTTP_PREFER='respond-sync') for _ in range(repeat))
+                queued = min(pay(HTTP_PREFER='respond-async') for _ in range(repeat))
+                stdout.write(f'{latency:>10} {inline:>10.1f} {queued:>9.1f}')
+        finally:
+            reset_session()
+
+
+@scenario('reconciliation')
+def reconciliation(stdout, sizes, repeat, payments=400, latency=0.02, **kwargs):
+    """
+    Reconciliation of `payments` stale pending payments against the local stand-in gateway with
+    `--sizes` concurrent verifications (1 is the sequential baseline). Every verification takes
+    `latency` seconds; the updates are one bulk_update per batch whatever the concurrency.
+    """
+    sizes = sizes or [1, 8, 32]
+    first_day = date.today() + timedelta(days=30)
+
+    with FakeChapaGateway(latency=latency) as gateway, \
+            override_settings(CHAPA_BASE_URL=gateway.base_url, CHAPA_POOL_SIZE=max(sizes)):
+        reset_session()
+        stdout.write(
+            f'{"workers":>8} {"seconds":>8} {"payments/s":>11} {"completed":>10} {"errors":>7} {"connections":>12}'
+        )
+        try:
+            for workers in sorted(sizes):
+                with rolled_back():
+                    host = make_user('host')
+                    guest = make_user('guest')
+                    listing = make_listings(host, 1)[0]
+                    # One night each, back to back; the availability index plays no part here
+                    bookings = Booking.objects.bulk_create([
+                        Booking(
+                            listing=listing, user=guest, start_date=first_day + timedelta(days=i),
+                            end_date=first_day + timedelta(days=i + 1), total_price=Decimal('100.00'),
+                        )
+                        for i in range(payments)
+                    ])
+                    stale = [Payment(booking=booking, amount=booking.total_price) for booking in bookings]
+                    for payment in stale:
+                        # Sent to the gateway under its transaction_id, like payments.new_payment()
+                        payment.chapa_reference = str(payment.transaction_id)
+                    Payment.objects.bulk_create(stale)
+                    for payment in stale:
+                        gateway.transactions[payment.chapa_reference] = {'amount': str(payment.amount)}
+                    Payment.objects.filter(pk__in=[payment.pk for payment in stale]).update(
+                        updated_at=timezone.now() - timedelta(days=1),
+                    )
+                    connections = gateway.connections
+                    stats = reconcile_payments(minutes=60, workers=workers)
+                    stdout.write(
+                        f'{workers:>8} {stats["seconds"]:>8.2f} {throughput(stats):>11.1f} {stats["completed"]:>10} '
+                        f'{stats["errors"]:>7} {gateway.connections - connections:>12}'
+                    )
+        finally:
+            reset_session()
+
+
+@contextmanager
+def gateway_process(latency):
+    """
+    Run the stand-in gateway in a separate process and yield its base URL
+    """
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'listings.fake_gateway', '--latency', str(latency)],
+        cwd=settings.BASE_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.stdin.close()
+        process.wait(timeout=10)
+
+
+def wsgi_call(application, method, path, body=b'', headers=None):
+    """
+    Call a WSGI application the way a threaded WSGI server would; returns the status code
+    """
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        'HTTP_HOST': 'testserver',
+    }
+    for name, value in (headers or {}).items():
+        environ[f'HTTP_{name.upper().replace("-", "_")}'] = value
+    status = []
+    response = application(environ, lambda status_line, response_headers, exc_info=None: status.append(status_line))
+    try:
+        b''.join(response)
+    finally:
+        response.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_call(application, method, path, body=b'', headers=None):
+    """
+    Call an ASGI application the way an ASGI server would; returns the status code
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        'headers': [
+            (b'host', b'testserver'), (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ] + [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    }
+    delivered = False
+    status = []
+
+    async def receive():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # The client never disconnects; Django cancels this wait once the response is sent
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+@scenario('asgi_payments')
+def asgi_payments(stdout, sizes, repeat, calls=400, threads=16, concurrency=200, **kwargs):
+    """
+    Load test of payment creation with the gateway called inline, for gateway latencies of `--sizes`
+    milliseconds: the synchronous view under WSGI with `threads` worker threads (a threaded WSGI server)
+    vs the async view (listings/async_views.py) under ASGI with up to `concurrency` requests in flight on
+    one event loop (one ASGI worker). Both applications are driven in process, without an HTTP server in
+    front; the gateway runs in a process of its own so it does not compete for the GIL. Worker threads and
+    the ASGI per-request threads need committed data, so this scenario commits its fixtures and deletes
+    them afterwards: run it against a scratch database.
+    """
+    sizes = sizes or [50, 200, 1000]
+    first_day = date.today() + timedelta(days=30)
+    password = uuid.uuid4().hex
+    wsgi_application = get_wsgi_application()
+    asgi_application = get_asgi_application()
+
+    with override_settings(
+        CHAPA_POOL_SIZE=threads, CHAPA_ASYNC_POOL_SIZE=concurrency, ALLOWED_HOSTS=['testserver'],
+        PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    ):
+        host = make_user('host')
+        guest = make_user('guest')
+        guest.set_password(password)
+        guest.save(update_fields=['password'])
+        credentials = base64.b64encode(f'{guest.username}:{password}'.encode()).decode()
+        headers = {'Authorization': f'Basic {credentials}', 'Prefer': 'respond-sync'}
+        listing = make_listings(host, 1)[0]
+        # One night each, back to back; every request pays for its own booking
+        booking_ids = iter(str(booking.pk) for booking in Booking.objects.bulk_create([
+            Booking(
+                listing=listing, user=guest, start_date=first_day + timedelta(days=i),
+                end_date=first_day + timedelta(days=i + 1), total_price=Decimal('100.00'),
+            )
+            for i in range(2 * calls * len(sizes))
+        ]))
+        lock = threading.Lock()
+
+        def body():
+            with lock:
+                return json.dumps({'booking_id': next(booking_ids)}).encode()
+
+        def summary(timings, statuses, elapsed):
+            timings.sort()
+            return {
+                'rate': len(timings) / elapsed,
+                'p50': timings[len(timings) // 2] * 1000,
+                'p95': timings[int(len(timings) * 0.95)] * 1000,
+                'errors': sum(1 for code in statuses if code != 201),
+            }
+
+        def run_wsgi():
+            timings, statuses = [], []
+
+            def worker(count):
+                try:
+                    for _ in range(count):
+                        started = time.perf_counter()
+                        code = wsgi_call(wsgi_application, 'POST', '/api/payments/', body(), headers)
+                        with lock:
+                            timings.append(time.perf_counter() - started)
+                            statuses.append(code)
+                finally:
+                    connection.close()
+
+            workers = [threading.Thread(target=worker, args=(calls // threads,)) for _ in range(threads)]
+            started = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            return summary(timings, statuses, time.perf_counter() - started)
+
+        async def run_asgi():
+            timings, statuses = [], []
+            slots = asyncio.Semaphore(concurrency)
+
+            async def call():
+                async with slots:
+                    started = time.perf_counter()
+                    code = await asgi_call(asgi_application, 'POST', '/api/async/payments/', body(), headers)
+                    timings.append(time.perf_counter() - started)
+                    statuses.append(code)
+
+            started = time.perf_counter()
+            try:
+                await asyncio.gather(*(call() for _ in range(calls // threads * threads)))
+            finally:
+                await close_async_client()
+            return summary(timings, statuses, time.perf_counter() - started)
+
+        stdout.write(
+            f'{"gateway ms":>10} {"server":>14} {"requests/s":>11} {"p50 ms":>8} {"p95 ms":>8} {"errors":>7}'
+        )
+        try:
+            for latency in sorted(sizes):
+                with gateway_process(latency / 1000) as base_url, override_settings(CHAPA_BASE_URL=base_url):
+                    reset_session()
+                    for label, result in (
+                        (f'wsgi x{threads}', run_wsgi()),
+                        (f'asgi x{concurrency}', asyncio.run(run_asgi())),
+                    ):
+                        stdout.write(
+                            f'{latency:>10} {label:>14} {result["rate"]:>11.1f} {result["p50"]:>8.1f} '
+                            f'{result["p95"]:>8.1f} {result["errors"]:>7}'
+                        )
+        finally:
+            reset_session()
+            listing.delete()
+            host.delete()
+            guest.delete()
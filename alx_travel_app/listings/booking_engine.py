@@ -0,0 +1,89 @@
+# Booking engine
+# Every booking write for a listing (create, reschedule) runs inside a transaction holding a row lock on
+# that listing (SELECT ... FOR UPDATE), so writes for one listing are serialized while different listings
+# are booked in parallel. Under the lock the requested nights are checked against the BookedNight index
+# (listings/availability.py) before the booking is saved. Requests for nights that are already taken are
+# rejected with a 409 before any lock is taken. total_price is the quote of listings.pricing, computed
+# under the lock from a rate table read from the database rather than the cache, which may lag behind.
+from decimal import Decimal
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .models import BookedNight, Booking, Listing
+from .pricing import build_rate_tables
+
+
+class BookingConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The listing is already booked for some of the requested nights.'
+    default_code = 'booking_conflict'
+
+    def __init__(self, nights=(), detail=None):
+        self.nights = list(nights)
+        super().__init__({
+            'error': detail or self.default_detail,
+            'conflicting_nights': [night.isoformat() for night in self.nights],
+        })
+
+
+def conflicting_nights(listing_id, start_date, end_date, exclude_booking=None):
+    """
+    Nights of [start_date, end_date) already taken on the listing (by another booking than exclude_booking)
+    """
+    nights = BookedNight.objects.filter(listing_id=listing_id, night__gte=start_date, night__lt=end_date)
+    if exclude_booking is not None:
+        nights = nights.exclude(booking_id=exclude_booking.pk)
+    return sorted(set(nights.values_list('night', flat=True)))
+
+
+def stay_price(listing_id, start_date, end_date):
+    # Called with the listing locked: current prices, never a cached table
+    return Decimal(build_rate_tables([listing_id])[listing_id].quote(start_date, end_date)['total'])
+
+
+def _lock_listing(listing_id):
+    """
+    Take the row lock of a listing for the current transaction
+    """
+    Listing.objects.select_for_update().values_list('pk', flat=True).get(pk=listing_id)
+
+
+def _check_available(listing_id, start_date, end_date, exclude_booking=None):
+    nights = conflicting_nights(listing_id, start_date, end_date, exclude_booking)
+    if nights:
+        raise BookingConflict(nights)
+
+
+def create_booking(listing, user, start_date, end_date):
+    """
+    Create a booking if every night is free, or raise BookingConflict
+    """
+    listing_id = listing.pk if isinstance(listing, Listing) else listing
+    # Fast path: most conflicts are visible without waiting for the lock
+    _check_available(listing_id, start_date, end_date)
+    with transaction.atomic():
+        _lock_listing(listing_id)
+        _check_available(listing_id, start_date, end_date)
+        # post_save writes the BookedNight rows inside this transaction (listings/signals.py)
+        return Booking.objects.create(
+            listing_id=listing_id,
+            user=user,
+            start_date=start_date,
+            end_date=end_date,
+            total_price=stay_price(listing_id, start_date, end_date),
+        )
+
+
+def reschedule_booking(booking, start_date, end_date):
+    """
+    Move a booking to new dates if they are free (ignoring the booking's own nights), or raise BookingConflict
+    """
+    _check_available(booking.listing_id, start_date, end_date, exclude_booking=booking)
+    with transaction.atomic():
+        _lock_listing(booking.listing_id)
+        _check_available(booking.listing_id, start_date, end_date, exclude_booking=booking)
+        booking.start_date = start_date
+        booking.end_date = end_date
+        booking.total_price = stay_price(booking.listing_id, start_date, end_date)
+        booking.save(update_fields=['start_date', 'end_date', 'total_price'])
+    return booking
@@ -0,0 +1,91 @@
+# Cache helpers
+# Version counters are stored in the default cache and bumped by signal handlers whenever data in a
+# scope changes ('listings', 'bookings', ...). Cache keys embed the current versions, so stale entries
+# are simply never read again instead of having to be found and deleted.
+# A bump or a fragment deletion only reaches the workers that share the cache, so the version-keyed
+# caches (facets, listing fragments, calendars, rate tables) and conditional GET are only used when the
+# 'default' and 'fragments' caches are shared by every worker, or when CACHE_SINGLE_PROCESS declares
+# that a single process serves the site (see versioned_caching_enabled() and listings/checks.py).
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'version:{scope}'
+
+# Caches read by the version-keyed features, and the backends that keep their entries in one process
+VERSIONED_CACHE_ALIASES = ('default', 'fragments')
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def process_local_caches():
+    """
+    Aliases of the versioned caches whose backend is not shared between processes
+    """
+    return [
+        alias for alias in VERSIONED_CACHE_ALIASES
+        if settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_CACHE_BACKENDS
+    ]
+
+
+def versioned_caching_enabled():
+    """
+    Whether the version-keyed caches and conditional GET may be used: their invalidation has to reach
+    every worker
+    """
+    return getattr(settings, 'CACHE_SINGLE_PROCESS', False) or not process_local_caches()
+
+
+def get_version(scope):
+    """
+    Current version of a scope. A counter starts at the current time in nanoseconds, so a counter that
+    was evicted never comes back with a version that was already used.
+    """
+    key = VERSION_KEY.format(scope=scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(scopes):
+    """
+    Current versions of many scopes as {scope: version}, in one cache round trip when they all exist
+    """
+    keys = {VERSION_KEY.format(scope=scope): scope for scope in scopes}
+    versions = {keys[key]: version for key, version in cache.get_many(list(keys)).items()}
+    for scope in keys.values():
+        if scope not in versions:
+            versions[scope] = get_version(scope)
+    return versions
+
+
+def bump_version(*scopes):
+    """
+    Mark every given scope as changed. The increment is atomic in the cache, so concurrent bumps
+    are never lost.
+    """
+    for scope in scopes:
+        key = VERSION_KEY.format(scope=scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # No counter yet: start one, unless a concurrent bump just did
+            if not cache.add(key, time.time_ns(), None):
+                cache.incr(key)
+
+
+def filter_signature(query_params, ignore=('cursor', 'page_size', 'ordering', 'format')):
+    """
+    Stable hash of a request's filter parameters (parameter and value order do not matter)
+    """
+    items = sorted(
+        (name, sorted(query_params.getlist(name)))
+        for name in query_params
+        if name not in ignore
+    )
+    return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
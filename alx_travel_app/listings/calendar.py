@@ -0,0 +1,87 @@
+# Occupancy calendars
+# A listing's calendar for a date window is built from its overlapping booking intervals in one query and
+# returned either as run-length ranges ([first night, check-out) pairs) or as a bitmap string with one
+# character per night ('1' = booked). Results are cached per listing under a version that the signal
+# handlers bump on every booking change of that listing, so a calendar is recomputed only after it changed.
+from datetime import date
+from django.core.cache import cache
+from .caching import get_version, versioned_caching_enabled
+from .models import Booking
+
+CALENDAR_ENCODINGS = ('ranges', 'bitmap')
+MAX_CALENDAR_NIGHTS = 366
+CALENDAR_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def calendar_scope(listing_id):
+    return f'calendar:{listing_id}'
+
+
+def month_window(month):
+    """
+    Return the [first day, first day of next month) window of a 'YYYY-MM' string; raises ValueError
+    """
+    year, month_number = (int(part) for part in month.split('-'))
+    start = date(year, month_number, 1)
+    end = date(year + month_number // 12, month_number % 12 + 1, 1)
+    return start, end
+
+
+def occupied_ranges(listing_id, start_date, end_date):
+    """
+    Merged [start, end) booked intervals of a listing, clipped to the window
+    """
+    intervals = Booking.objects.filter(
+        listing_id=listing_id, start_date__lt=end_date, end_date__gt=start_date,
+    ).order_by('start_date').values_list('start_date', 'end_date')
+    ranges = []
+    for booked_from, booked_until in intervals:
+        booked_from, booked_until = max(booked_from, start_date), min(booked_until, end_date)
+        if ranges and booked_from <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], booked_until)
+        else:
+            ranges.append([booked_from, booked_until])
+    return [tuple(booked) for booked in ranges]
+
+
+def listing_occupancy(listing_id, start_date, end_date, exists=None):
+    """
+    Cached occupied_ranges(), valid until the next booking change of the listing.
+    On a cache miss exists() is called first; None is returned (and nothing cached) when it is false.
+    """
+    if not versioned_caching_enabled():
+        if exists is not None and not exists():
+            return None
+        return occupied_ranges(listing_id, start_date, end_date)
+    key = 'listing-calendar:{}:{}:{}:{}'.format(
+        listing_id, get_version(calendar_scope(listing_id)), start_date.isoformat(), end_date.isoformat(),
+    )
+    ranges = cache.get(key)
+    if ranges is None:
+        if exists is not None and not exists():
+            return None
+        ranges = occupied_ranges(listing_id, start_date, end_date)
+        cache.set(key, ranges, CALENDAR_CACHE_TIMEOUT)
+    return ranges
+
+
+def encode_ranges(ranges):
+    return [[booked_from.isoformat(), booked_until.isoformat()] for booked_from, booked_until in ranges]
+
+
+def encode_bitmap(ranges, start_date, end_date):
+    nights = ['0'] * (end_date - start_date).days
+    for booked_from, booked_until in ranges:
+        for offset in range((booked_from - start_date).days, (booked_until - start_date).days):
+            nights[offset] = '1'
+    return ''.join(nights)
+
+
+def calendar_payload(ranges, start_date, end_date, encoding='ranges'):
+    payload = {'start': start_date.isoformat(), 'end': end_date.isoformat()}
+    if encoding == 'bitmap':
+        payload['bitmap'] = encode_bitmap(ranges, start_date, end_date)
+    else:
+        payload['booked'] = encode_ranges(ranges)
+    return payload
+
@@ -1,15 +1,110 @@
+import os
+import threading
 import requests
 import json
 import logging
 from django.conf import settings
 from django.urls import reverse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger('chapa_payment')
 
+# HTTP session shared by every ChapaService of the process
+# Connections to the gateway are kept alive in a pool, so only the first call of each pooled connection
+# pays for the TCP and TLS handshakes. Failed connection attempts are retried for every method (nothing
+# reached the gateway); read errors and 429/5xx answers only for idempotent methods (GET verification),
+# with exponential, jittered backoff. A Retry-After header on 429/503 answers is honoured for at most
+# CHAPA_MAX_RETRY_AFTER seconds, so the gateway cannot park a worker. Calls use separate connect and
+# read timeouts.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class CappedRetry(Retry):
+    """
+    Retry whose Retry-After waits are capped at CHAPA_MAX_RETRY_AFTER seconds
+    """
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, settings.CHAPA_MAX_RETRY_AFTER)
+
+
+def build_session():
+    retry = CappedRetry(
+        total=settings.CHAPA_MAX_RETRIES,
+        connect=settings.CHAPA_MAX_RETRIES,
+        read=settings.CHAPA_MAX_RETRIES,
+        status=settings.CHAPA_MAX_RETRIES,
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=settings.CHAPA_RETRY_BACKOFF,
+        backoff_jitter=settings.CHAPA_RETRY_BACKOFF,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.CHAPA_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """
+    The process-wide gateway session (created again in forked worker processes)
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def reset_session():
+    """
+    Close the shared session, e.g. after changing the CHAPA_* pool or retry settings
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def initialize_payload(amount, email, first_name, last_name, tx_ref, return_url, currency='ETB',
+                       custom_title=None, custom_description=None):
+    """
+    Body of POST /transaction/initialize (shared with listings.async_chapa.AsyncChapaService)
+    """
+    return {
+        "amount": str(amount),
+        "currency": currency,
+        "email": email,
+        "first_name": first_name,
+        "last_name": last_name,
+        "tx_ref": tx_ref,
+        "return_url": return_url,
+        "customization": {
+            "title": custom_title or "Property Booking Payment",
+            "description": custom_description or "Secure payment for your property booking"
+        }
+    }
+
+
 class ChapaService:
-    def __init__(self):
+    def __init__(self, session=None):
         self.secret_key = settings.CHAPA_SECRET_KEY
         self.base_url = settings.CHAPA_BASE_URL
+        self.session = session or get_session()
+        self.timeout = (settings.CHAPA_CONNECT_TIMEOUT, settings.CHAPA_READ_TIMEOUT)
         self.headers = {
             'Authorization': f'Bearer {self.secret_key}',
             'Content-Type': 'application/json'
@@ -30,19 +125,9 @@ class ChapaService:
         """
         url = f"{self.base_url}/transaction/initialize"
         
-        payload = {
-            "amount": str(amount),
-            "currency": currency,
-            "email": email,
-            "first_name": first_name,
-            "last_name": last_name,
-            "tx_ref": tx_ref,
-            "return_url": return_url,
-            "customization": {
-                "title": custom_title or "Property Booking Payment",
-                "description": custom_description or "Secure payment for your property booking"
-            }
-        }
+        payload = initialize_payload(
+            amount, email, first_name, last_name, tx_ref, return_url, currency, custom_title, custom_description
+        )
         
         # Enhanced logging
         logger.info("🔗 Initiating Chapa payment with details:", extra={
@@ -64,7 +149,7 @@ class ChapaService:
         })
         
         try:
-            response = requests.post(url, json=payload, headers=self.headers, timeout=30)
+            response = self.session.post(url, json=payload, headers=self.headers, timeout=self.timeout)
             
             # Log the raw response for debugging
             logger.debug("Chapa API Raw Response:", extra={
@@ -90,7 +175,8 @@ class ChapaService:
             return {
                 'success': True,
                 'checkout_url': data['data']['checkout_url'],
-                'transaction_id': data['data']['tx_ref'],
+                # The initialize answer only carries the checkout URL
+                'transaction_id': data['data'].get('tx_ref', tx_ref),
                 'response_data': data
             }
             
@@ -130,4 +216,71 @@ class ChapaService:
                 'success': False,
                 'error': str(e),
                 'message': 'Unexpected error during payment initiation'
-            }
\ No newline at end of file
+            }
+    
+    def verify_payment(self, tx_ref):
+        """
+        Ask Chapa for the state of a transaction. GET is idempotent, so the session retries
+        read errors and 429/5xx answers.
+        """
+        url = f"{self.base_url}/transaction/verify/{tx_ref}"
+        
+        logger.info("🔎 Verifying Chapa payment", extra={
+            'transaction_id': tx_ref,
+            'action': 'payment_verification_start'
+        })
+        
+        try:
+            response = self.session.get(url, headers=self.headers, timeout=self.timeout)
+            
+            if response.status_code == 404:
+                # Chapa does not know the reference (never initiated, or initiated elsewhere)
+                return {
+                    'success': False,
+                    'not_found': True,
+                    'error': 'Transaction not found',
+                    'message': 'Chapa does not know this transaction'
+                }
+            
+            response.raise_for_status()
+            data = response.json()
+            chapa_status = (data.get('data') or {}).get('status')
+            
+            logger.info("✅ Chapa payment verified", extra={
+                'transaction_id': tx_ref,
+                'status': chapa_status,
+                'action': 'payment_verification_success'
+            })
+            
+            return {
+                'success': True,
+                'status': chapa_status,
+                'response_data': data
+            }
+            
+        except requests.exceptions.RequestException as e:
+            logger.error("❌ Chapa payment verification failed", extra={
+                'transaction_id': tx_ref,
+                'error_type': type(e).__name__,
+                'error_message': str(e),
+                'action': 'payment_verification_failed'
+            })
+            
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Failed to verify payment with Chapa'
+            }
+        except ValueError as e:
+            # Not JSON
+            logger.error("❌ Unexpected Chapa verification answer", extra={
+                'transaction_id': tx_ref,
+                'error': str(e),
+                'action': 'payment_verification_bad_response'
+            })
+            
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Unexpected answer from Chapa'
+            }
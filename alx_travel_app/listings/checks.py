@@ -0,0 +1,23 @@
+# System checks
+# Registered from ListingsConfig.ready(); run by `manage.py check` and before runserver and migrate.
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+from .caching import process_local_caches
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The version-keyed caches and ETags need a cache shared by every worker
+    """
+    local = process_local_caches()
+    if not local or getattr(settings, 'CACHE_SINGLE_PROCESS', False):
+        return []
+    names = ' and '.join(repr(alias) for alias in local)
+    return [Warning(
+        f'The {names} {"caches are" if len(local) > 1 else "cache is"} local to each process, so the '
+        'listing facet, fragment, calendar and rate table caches and ETags are turned off.',
+        hint='Set REDIS_CACHE_URL to share the cache between workers, or CACHE_SINGLE_PROCESS=True when '
+             'a single process serves the site.',
+        id='listings.W001',
+    )]
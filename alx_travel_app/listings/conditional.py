@@ -0,0 +1,54 @@
+# Conditional GET support (ETag) for read endpoints
+# The ETag is derived from the cache version counters in listings/caching.py, never from the response
+# body, so a matching If-None-Match is answered with 304 before any serializer runs. No Last-Modified is
+# sent: its one-second resolution would answer 304 to an If-Modified-Since taken between two writes in
+# the same second, and every response of these views has an ETag.
+# A version bump only reaches the workers sharing the cache, so without a shared cache no ETag is sent and
+# every request is answered in full (see caching.versioned_caching_enabled()).
+import hashlib
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from .caching import get_version, versioned_caching_enabled
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin adding an ETag to list and retrieve.
+    Other GET actions can opt in by wrapping their body with self.conditional_response().
+    """
+    # Version scopes whose changes can alter this view's responses
+    conditional_scopes = ()
+
+    def get_conditional_scopes(self, request):
+        return self.conditional_scopes
+
+    def get_etag(self, request):
+        """
+        Return the ETag of the current request
+        """
+        versions = [get_version(scope) for scope in self.get_conditional_scopes(request)]
+        user = request.user
+        fingerprint = '|'.join([
+            request.get_full_path(),
+            str(user.pk) if user.is_authenticated else 'anonymous',
+            *(str(version) for version in versions),
+        ])
+        return '"{}"'.format(hashlib.sha1(fingerprint.encode('utf-8')).hexdigest())
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        if not versioned_caching_enabled():
+            return handler(request, *args, **kwargs)
+        etag = self.get_etag(request)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            # Responses differ per user
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
@@ -0,0 +1,141 @@
+# Bulk exports of bookings and payments as NDJSON or CSV
+# Rows are read with .values() in keyset batches (see listings/pagination.py) with the listing title and
+# user details joined in SQL, and encoded one line at a time, so memory stays constant however many rows
+# are exported. Used by the staff export endpoints and by `manage.py export_records`.
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Coalesce, Concat, NullIf, Trim
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Booking, Payment
+from .pagination import keyset_batches
+from .renderers import dumps
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_BATCH_SIZE = 2000
+
+
+def _full_name(prefix):
+    # Same rule as PaymentSerializer.get_user_name: "first last", or the email when both are empty
+    return Coalesce(
+        NullIf(Trim(Concat(f'{prefix}first_name', Value(' '), f'{prefix}last_name')), Value('')),
+        F(f'{prefix}email'),
+        output_field=CharField(),
+    )
+
+
+# Exported columns: (column name, model lookup or expression)
+EXPORTS = {
+    'bookings': (Booking, [
+        ('id', 'id'),
+        ('listing_id', 'listing_id'),
+        ('listing_title', 'listing__title'),
+        ('user_id', 'user_id'),
+        ('user_email', 'user__email'),
+        ('user_name', _full_name('user__')),
+        ('start_date', 'start_date'),
+        ('end_date', 'end_date'),
+        ('total_price', 'total_price'),
+        ('payment_status', 'payment__status'),
+        ('created_at', 'created_at'),
+    ]),
+    'payments': (Payment, [
+        ('transaction_id', 'transaction_id'),
+        ('booking_id', 'booking_id'),
+        ('amount', 'amount'),
+        ('currency', 'currency'),
+        ('status', 'status'),
+        ('chapa_reference', 'chapa_reference'),
+        ('payment_method', 'payment_method'),
+        ('listing_title', 'booking__listing__title'),
+        ('user_email', 'booking__user__email'),
+        ('user_name', _full_name('booking__user__')),
+        ('created_at', 'created_at'),
+        ('updated_at', 'updated_at'),
+        ('paid_at', 'paid_at'),
+    ]),
+}
+
+
+def parse_boundary(value):
+    """
+    Parse an ISO date or datetime into an aware datetime (dates mean midnight); raises ValueError
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date "{value}", expected YYYY-MM-DD or an ISO datetime')
+        parsed = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_queryset(name, since=None, until=None):
+    """
+    Queryset of dictionaries with the export columns of `name`, optionally limited to created_at in [since, until)
+    """
+    model, columns = EXPORTS[name]
+    queryset = model.objects.all()
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+    expressions = {column: lookup for column, lookup in columns if not isinstance(lookup, str)}
+    lookups = [lookup if isinstance(lookup, str) else column for column, lookup in columns]
+    return queryset.annotate(**expressions).values(*lookups)
+
+
+def export_rows(name, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield export rows as lists of values in column order, oldest first
+    """
+    _, columns = EXPORTS[name]
+    lookups = [lookup if isinstance(lookup, str) else column for column, lookup in columns]
+    queryset = export_queryset(name, since, until)
+    for batch in keyset_batches(queryset, ['created_at', 'pk'], batch_size):
+        for row in batch:
+            yield [row[lookup] for lookup in lookups]
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    return value
+
+
+class _Echo:
+    """
+    File-like object handing back what csv.writer writes instead of storing it
+    """
+    def write(self, value):
+        return value
+
+
+def export_lines(name, export_format='ndjson', since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yield the export encoded line by line (str for CSV, bytes for NDJSON)
+    """
+    _, columns = EXPORTS[name]
+    headers = [column for column, _ in columns]
+    rows = export_rows(name, since, until, batch_size)
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(['' if value is None else _plain(value) for value in row])
+    else:
+        for row in rows:
+            yield dumps(dict(zip(headers, map(_plain, row)))) + b'\n'
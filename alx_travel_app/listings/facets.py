@@ -0,0 +1,44 @@
+# Facet counts for listing search
+# All counts are computed in a single aggregate query over the already filtered listing queryset.
+from django.db.models import Count, F, Q
+from .models import AMENITIES, AMENITY_BITS, PROPERTY_TYPES
+
+# Price buckets as (label, lower bound inclusive, upper bound exclusive or None)
+PRICE_BUCKETS = (
+    ('0-50', 0, 50),
+    ('50-100', 50, 100),
+    ('100-200', 100, 200),
+    ('200-500', 200, 500),
+    ('500+', 500, None),
+)
+
+
+def price_filter(lower, upper):
+    condition = Q(price_per_night__gte=lower)
+    if upper is not None:
+        condition &= Q(price_per_night__lt=upper)
+    return condition
+
+
+def listing_facets(queryset):
+    """
+    Return the number of listings in queryset per property type, price bucket and amenity
+    """
+    queryset = queryset.order_by().prefetch_related(None).annotate(**{
+        f'amenity_{code}': F('amenity_mask').bitand(AMENITY_BITS[code]) for code, _ in AMENITIES
+    })
+    aggregates = {'total': Count('pk')}
+    for code, _ in PROPERTY_TYPES:
+        aggregates[f'property_type_{code}'] = Count('pk', filter=Q(property_type=code))
+    for position, (_, lower, upper) in enumerate(PRICE_BUCKETS):
+        aggregates[f'price_{position}'] = Count('pk', filter=price_filter(lower, upper))
+    for code, _ in AMENITIES:
+        aggregates[f'has_{code}'] = Count('pk', filter=Q(**{f'amenity_{code}__gt': 0}))
+    counts = queryset.aggregate(**aggregates)
+
+    return {
+        'total': counts['total'],
+        'property_type': {code: counts[f'property_type_{code}'] for code, _ in PROPERTY_TYPES},
+        'price': {label: counts[f'price_{position}'] for position, (label, _, _) in enumerate(PRICE_BUCKETS)},
+        'amenities': {code: counts[f'has_{code}'] for code, _ in AMENITIES},
+    }
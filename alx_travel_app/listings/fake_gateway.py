@@ -0,0 +1,196 @@
+# Local stand-in for the Chapa API, for benchmarks and manual testing
+# Answers POST /transaction/initialize and GET /transaction/verify/<tx_ref> like the Chapa sandbox, from
+# a thread of the current process. `latency` delays every answer; `handshake_latency` delays the first
+# request of every new connection, standing in for the TCP and TLS handshakes of the real gateway
+# (the fake itself speaks plain HTTP). Transactions initiated here verify as `success` unless
+# `verify_status` says otherwise, `add_transaction()` registers one (with a status of its own) without
+# going through the initialize call, and `fail_next(n)` answers the next n requests with a 503 (with a
+# Retry-After header when `retry_after` is given).
+#
+#   with FakeChapaGateway(latency=0.05) as gateway, override_settings(CHAPA_BASE_URL=gateway.base_url):
+#       ...
+#
+# It can also run in a process of its own (prints its base URL, then serves until stdin is closed), so
+# that load tests do not share the GIL of the process under test:
+#
+#   python -m listings.fake_gateway --latency 0.2
+import argparse
+import json
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for bursts of new connections from many client threads
+    request_queue_size = 256
+
+
+class FakeChapaGateway:
+    def __init__(self, latency=0.0, handshake_latency=0.0, verify_status='success'):
+        self.latency = latency
+        self.handshake_latency = handshake_latency
+        self.verify_status = verify_status
+        self.transactions = {}
+        self.statuses = {}
+        self.requests = 0
+        self.connections = 0
+        self._failures = 0
+        self._retry_after = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def add_transaction(self, tx_ref, status=None, amount='100.00', currency='ETB'):
+        """
+        Register a transaction as if it had been initiated here; it verifies as status (default: verify_status)
+        """
+        with self._lock:
+            self.transactions[tx_ref] = {'tx_ref': tx_ref, 'amount': amount, 'currency': currency}
+            if status is not None:
+                self.statuses[tx_ref] = status
+
+    def fail_next(self, count=1, retry_after=None):
+        with self._lock:
+            self._failures += count
+            self._retry_after = retry_after
+
+    def start(self, port=0):
+        self._server = GatewayServer(('127.0.0.1', port), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def answer(self, method, path, body):
+        """
+        Return (status code, JSON payload, extra headers) for one request
+        """
+        with self._lock:
+            self.requests += 1
+            if self._failures:
+                self._failures -= 1
+                headers = {} if self._retry_after is None else {'Retry-After': str(self._retry_after)}
+                return 503, {'message': 'Service unavailable', 'status': 'failed', 'data': None}, headers
+        return (*self.transaction_answer(method, path, body), {})
+
+    def transaction_answer(self, method, path, body):
+        """
+        Return (status code, JSON payload) of the initialize and verify endpoints
+        """
+        if method == 'POST' and path == '/transaction/initialize':
+            tx_ref = body.get('tx_ref')
+            if not tx_ref or tx_ref in self.transactions:
+                return 400, {'message': 'Transaction reference has been used before', 'status': 'failed', 'data': None}
+            self.transactions[tx_ref] = body
+            return 200, {
+                'message': 'Hosted Link',
+                'status': 'success',
+                'data': {'checkout_url': f'{self.base_url}/checkout/{tx_ref}'},
+            }
+        match = re.fullmatch(r'/transaction/verify/([^/]+)', path)
+        if method == 'GET' and match:
+            tx_ref = match.group(1)
+            initiated = self.transactions.get(tx_ref)
+            if initiated is None:
+                return 404, {'message': 'Invalid transaction or Transaction not found', 'status': 'failed', 'data': None}
+            return 200, {
+                'message': 'Payment details',
+                'status': 'success',
+                'data': {
+                    'tx_ref': tx_ref,
+                    'reference': f'CH{tx_ref[:10]}',
+                    'status': self.statuses.get(tx_ref, self.verify_status),
+                    'amount': initiated.get('amount'),
+                    'currency': initiated.get('currency'),
+                    'email': initiated.get('email'),
+                    'method': 'test',
+                },
+            }
+        return 404, {'message': 'Not found', 'status': 'failed', 'data': None}
+
+    def _handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so clients can reuse their connections
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Headers and body are written separately; do not let Nagle hold back the body
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with gateway._lock:
+                    gateway.connections += 1
+                if gateway.handshake_latency:
+                    time.sleep(gateway.handshake_latency)
+
+            def handle_request(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+                if gateway.latency:
+                    time.sleep(gateway.latency)
+                status, payload, headers = gateway.answer(method, self.path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Chapa API')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before every answer')
+    parser.add_argument('--handshake-latency', type=float, default=0.0, help='Seconds added to every new connection')
+    parser.add_argument('--verify-status', default='success', help='Status of verified transactions')
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on (default: any free port)')
+    args = parser.parse_args()
+    gateway = FakeChapaGateway(args.latency, args.handshake_latency, args.verify_status).start(args.port)
+    print(gateway.base_url, flush=True)
+    try:
+        sys.stdin.read()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.stop()
+
+
+if __name__ == '__main__':
+    main()
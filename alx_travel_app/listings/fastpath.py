@@ -0,0 +1,135 @@
+# Values-based fast serialization path for read-heavy list endpoints
+# A ValuesSerializer is compiled once from a ModelSerializer class: every readable field (including nested
+# serializers) becomes a .values_list() lookup plus a converter taken from the DRF field, so rows are turned
+# into the exact same dictionaries the serializer would produce without instantiating it per row.
+# Only plain fields, forward/reverse one-to-one style relations and nested serializers are supported;
+# anything else (many=True relations, SerializerMethodField, properties) raises at compile time.
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import fields as drf_fields
+from rest_framework import relations, serializers
+from .serializers import BookingSerializer, ListingSerializer
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+def _converter(field):
+    """
+    Fastest equivalent of field.to_representation for the common field types
+    """
+    field_type = type(field)
+    if field_type in (drf_fields.CharField, drf_fields.EmailField, drf_fields.URLField, drf_fields.SlugField):
+        return str
+    if field_type is drf_fields.UUIDField and field.uuid_format == 'hex_verbose':
+        return str
+    if field_type is drf_fields.IntegerField:
+        return int
+    if field_type is drf_fields.JSONField and not field.binary:
+        return None
+    if field_type is relations.PrimaryKeyRelatedField and field.pk_field is None:
+        return None
+    return field.to_representation
+
+
+def _resolve_lookup(model, attrs):
+    """
+    Translate serializer source attributes into a values() lookup, or raise UnsupportedField
+    """
+    for position, attr in enumerate(attrs):
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise UnsupportedField('.'.join(attrs))
+        if model_field.many_to_many or model_field.one_to_many:
+            raise UnsupportedField('.'.join(attrs))
+        if model_field.is_relation and position < len(attrs) - 1:
+            model = model_field.related_model
+    return '__'.join(attrs)
+
+
+class ValuesSerializer:
+    """
+    Read-only, compiled equivalent of a ModelSerializer working on values_list() rows
+    """
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self._compiled = None
+
+    def compile(self):
+        if self._compiled is None:
+            lookups = ['pk']
+            build = self._compile_serializer(self.serializer_class(), self.model, '', lookups)
+            self._compiled = (lookups, build)
+        return self._compiled
+
+    def _compile_serializer(self, serializer, model, prefix, lookups):
+        getters = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            getters.append((name, self._compile_field(field, model, prefix, lookups)))
+
+        def build(row):
+            return {name: getter(row) for name, getter in getters}
+        return build
+
+    def _compile_field(self, field, model, prefix, lookups):
+        attrs = field.source_attrs
+        if isinstance(field, serializers.ListSerializer) or isinstance(field, relations.ManyRelatedField):
+            raise UnsupportedField(field.field_name)
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            raise UnsupportedField(field.field_name)
+
+        if isinstance(field, serializers.BaseSerializer):
+            related_prefix = prefix + _resolve_lookup(model, attrs) + '__'
+            related_model = field.Meta.model
+            # The related primary key tells whether the relation is empty
+            pk_index = len(lookups)
+            lookups.append(related_prefix + 'pk')
+            build = self._compile_serializer(field, related_model, related_prefix, lookups)
+
+            def nested(row):
+                return None if row[pk_index] is None else build(row)
+            return nested
+
+        try:
+            lookup = prefix + _resolve_lookup(model, attrs)
+        except UnsupportedField:
+            # DRF renders unreadable attributes of nullable fields as None
+            if field.allow_null:
+                return lambda row: None
+            raise
+        index = len(lookups)
+        lookups.append(lookup)
+        convert = _converter(field)
+        if convert is None:
+            return lambda row: row[index]
+
+        def value(row):
+            raw = row[index]
+            return None if raw is None else convert(raw)
+        return value
+
+    def serialize_with_pks(self, queryset):
+        """
+        Return [(pk, representation), ...] for the rows of queryset, in queryset order
+        """
+        lookups, build = self.compile()
+        return [(row[0], build(row)) for row in queryset.values_list(*lookups)]
+
+    def serialize(self, queryset):
+        return [representation for _, representation in self.serialize_with_pks(queryset)]
+
+    def serialize_pks(self, queryset, pks):
+        """
+        Serialize the rows with the given primary keys in the order of pks
+        """
+        rendered = dict(self.serialize_with_pks(queryset.filter(pk__in=pks)))
+        return [rendered[pk] for pk in pks if pk in rendered]
+
+
+# Compiled lazily on first use
+listing_values = ValuesSerializer(ListingSerializer)
+booking_values = ValuesSerializer(BookingSerializer)
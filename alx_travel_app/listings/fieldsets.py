@@ -0,0 +1,162 @@
+# Sparse fieldsets and relation expansion for read endpoints
+#
+#   ?fields=id,start_date,listing.title   only render these fields (dotted names select nested fields)
+#   ?expand=listing,listing.host          render only these relations as nested objects; other nested
+#                                         relations are rendered as their primary key
+#
+# Without ?expand= the serializers keep their default nesting. Relations declared in
+# Meta.expandable_fields are only rendered when listed in ?expand=. The *_relations() helpers
+# translate a FieldSet into the select_related/prefetch_related calls the response actually needs.
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def _split(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+def _join(*parts):
+    return '.'.join(part for part in parts if part)
+
+
+class FieldSet:
+    """
+    Parsed ?fields= and ?expand= parameters
+    """
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields or set()
+        self.expand = expand
+        # Expanding "listing.host" implies expanding "listing"
+        self.expanded = set()
+        for path in expand or ():
+            parts = path.split('.')
+            self.expanded.update('.'.join(parts[:end]) for end in range(1, len(parts) + 1))
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        FieldSet of a request, parsed once and kept on the request. Only reads are restricted.
+        """
+        if request is None or request.method not in SAFE_METHODS:
+            return cls()
+        fieldset = getattr(request, '_fieldset', None)
+        if fieldset is None:
+            params = request.query_params
+            fieldset = cls(_split(params.get('fields')), _split(params['expand']) if 'expand' in params else None)
+            request._fieldset = fieldset
+        return fieldset
+
+    @property
+    def is_default(self):
+        return not self.fields and self.expand is None
+
+    def includes(self, path):
+        """
+        Whether the field at a dotted path is rendered
+        """
+        parts = path.split('.')
+        for depth, name in enumerate(parts):
+            prefix = '.'.join(parts[:depth])
+            requested = {
+                field[len(prefix) + 1:].split('.')[0] if prefix else field.split('.')[0]
+                for field in self.fields
+                if not prefix or field.startswith(prefix + '.')
+            }
+            if requested and name not in requested:
+                return False
+        return True
+
+    def expands(self, path, default=True):
+        """
+        Whether the relation at a dotted path is rendered as a nested object
+        """
+        if not self.includes(path):
+            return False
+        if self.expand is None:
+            return default
+        return path in self.expanded
+
+
+class FieldSetMixin:
+    """
+    Serializer mixin applying the request's FieldSet to its fields (also when used as a nested serializer)
+    """
+    def fieldset_path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = FieldSet.from_request(self.context.get('request'))
+        if fieldset.is_default:
+            return fields
+
+        path = self.fieldset_path()
+        for name, field in list(fields.items()):
+            full_path = _join(path, name)
+            if field.write_only:
+                continue
+            if not fieldset.includes(full_path):
+                del fields[name]
+            elif isinstance(field, serializers.BaseSerializer) and not fieldset.expands(full_path):
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=isinstance(field, serializers.ListSerializer), source=field.source,
+                )
+
+        for name, build_field in getattr(self.Meta, 'expandable_fields', {}).items():
+            if fieldset.expands(_join(path, name), default=False):
+                fields[name] = build_field()
+        return fields
+
+
+def listing_relations(fieldset, path=''):
+    """
+    Return (select_related, prefetch_related) lookups needed to render listings at path
+    """
+    prefix = path.replace('.', '__') + '__' if path else ''
+    select, prefetch = [], []
+    if fieldset.expands(_join(path, 'host')):
+        select.append(prefix + 'host')
+    return select, prefetch
+
+
+def booking_relations(fieldset, path=''):
+    """
+    Return (select_related, prefetch_related) lookups needed to render bookings at path
+    """
+    prefix = path.replace('.', '__') + '__' if path else ''
+    select, prefetch = [], []
+    if fieldset.expands(_join(path, 'user')):
+        select.append(prefix + 'user')
+    if fieldset.expands(_join(path, 'listing')):
+        select.append(prefix + 'listing')
+        listing_select, listing_prefetch = listing_relations(fieldset, _join(path, 'listing'))
+        select.extend(listing_select)
+        prefetch.extend(listing_prefetch)
+    if fieldset.includes(_join(path, 'payment_status')) or fieldset.includes(_join(path, 'payment_id')):
+        select.append(prefix + 'payment')
+    return select, prefetch
+
+
+def payment_relations(fieldset):
+    """
+    Return (select_related, prefetch_related) lookups needed to render payments
+    """
+    select, prefetch = [], []
+    if any(fieldset.includes(name) for name in ('booking_id', 'booking_reference')):
+        select.append('booking')
+    if fieldset.includes('listing_title'):
+        select.append('booking__listing')
+    if fieldset.includes('user_email') or fieldset.includes('user_name'):
+        select.append('booking__user')
+    if fieldset.expands('booking', default=False):
+        select.append('booking')
+        booking_select, booking_prefetch = booking_relations(fieldset, 'booking')
+        select.extend(booking_select)
+        prefetch.extend(booking_prefetch)
+    return select, prefetch
@@ -0,0 +1,77 @@
+# Serialized fragment cache
+# Stores the serialized representation of each listing in the 'fragments' cache so list pages can be
+# assembled from cached dictionaries plus one cheap query for the page's listing rows. Entries are
+# deleted by the signal handlers in listings/signals.py when a listing, its reviews (review_count)
+# or its host change. Those deletions only reach other workers through a shared cache, so nothing is
+# read or stored while the cache is process-local (see caching.versioned_caching_enabled()).
+from django.core.cache import caches
+from .caching import versioned_caching_enabled
+from .models import Listing
+from .fastpath import listing_values
+
+# Bump when the ListingSerializer output changes so old fragments are ignored after a deploy
+LISTING_FRAGMENT_VERSION = 2
+
+
+class FragmentCache:
+    """
+    Cache of serialized objects keyed by primary key
+    """
+    def __init__(self, prefix, version, alias='fragments'):
+        self.prefix = prefix
+        self.version = version
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, pk):
+        return f'{self.prefix}:{self.version}:{pk}'
+
+    def get_many(self, pks):
+        """
+        Return {pk: fragment} for the cached subset of pks
+        """
+        if not versioned_caching_enabled():
+            return {}
+        keys = {self.key(pk): pk for pk in pks}
+        return {keys[key]: fragment for key, fragment in self.cache.get_many(list(keys)).items()}
+
+    def set_many(self, fragments):
+        if not versioned_caching_enabled():
+            return
+        self.cache.set_many({self.key(pk): fragment for pk, fragment in fragments.items()})
+
+    def delete_many(self, pks):
+        self.cache.delete_many([self.key(pk) for pk in pks])
+
+    def render(self, objects, serialize_missing):
+        """
+        Return the serialized form of objects in order. serialize_missing(pks) is called once with the
+        primary keys that are not cached and must return {pk: fragment} for them.
+        """
+        return [fragment for _, fragment in self.render_pairs(objects, serialize_missing)]
+
+    def render_pairs(self, objects, serialize_missing):
+        """
+        Like render(), as (pk, fragment) pairs
+        """
+        pks = [obj.pk for obj in objects]
+        fragments = self.get_many(pks)
+        missing = [pk for pk in pks if pk not in fragments]
+        if missing:
+            rendered = serialize_missing(missing)
+            self.set_many(rendered)
+            fragments.update(rendered)
+        return [(pk, fragments[pk]) for pk in pks if pk in fragments]
+
+
+listing_fragments = FragmentCache('listing', LISTING_FRAGMENT_VERSION)
+
+
+def serialize_listings(pks):
+    """
+    Serialize the given listings (and their host) from a single values query
+    """
+    return dict(listing_values.serialize_with_pks(Listing.objects.filter(pk__in=pks)))
@@ -0,0 +1,117 @@
+# Bulk import of listings from NDJSON (one JSON object per line)
+# Rows are validated in batches with a single serializer instance, the hosts of a batch are looked up
+# with one query and the valid rows are written with bulk_create. Invalid rows are reported with their
+# line number and never stop the rest of the import.
+# bulk_create() skips Listing.save() and the post_save signals, so the amenity mask, the search index
+# and the 'listings' cache version are maintained here instead.
+import json
+from django.db import transaction
+from rest_framework import serializers
+from .caching import bump_version
+from .models import Listing, User, amenity_mask
+from .search import index_listings
+from .serializers import ListingImportSerializer
+
+IMPORT_BATCH_SIZE = 500
+
+
+class ImportResult:
+    """
+    Outcome of an import: number of listings created and per-line errors
+    """
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {'created': self.created, 'failed': len(self.errors), 'errors': self.errors}
+
+
+def parse_lines(lines):
+    """
+    Yield (line number, row or None, error) for every non-empty NDJSON line
+    """
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError as e:
+                yield number, None, {'non_field_errors': [f'Invalid UTF-8: {e}']}
+                continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, None, {'non_field_errors': [f'Invalid JSON: {e}']}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {'non_field_errors': ['Each line must be a JSON object.']}
+            continue
+        yield number, row, None
+
+
+def import_batch(rows, result, default_host=None, restrict_to_host=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Validate and insert one batch of (line number, row) pairs.
+    default_host is used for rows without host_id; with restrict_to_host every row must belong to that user.
+    """
+    validator = ListingImportSerializer()
+    validated = []
+    for number, row in rows:
+        try:
+            data = validator.run_validation(row)
+        except serializers.ValidationError as e:
+            result.add_error(number, e.detail)
+            continue
+        host_id = data.pop('host_id', None) or (default_host.pk if default_host else None)
+        if host_id is None:
+            result.add_error(number, {'host_id': ['This field is required.']})
+        elif restrict_to_host is not None and host_id != restrict_to_host.pk:
+            result.add_error(number, {'host_id': ['You can only import listings you host.']})
+        else:
+            validated.append((number, host_id, data))
+
+    # One query for every host referenced by the batch
+    known_hosts = set(User.objects.filter(pk__in={host_id for _, host_id, _ in validated}).values_list('pk', flat=True))
+    listings = []
+    for number, host_id, data in validated:
+        if host_id not in known_hosts:
+            result.add_error(number, {'host_id': [f'Invalid pk "{host_id}" - object does not exist.']})
+            continue
+        listing = Listing(host_id=host_id, **data)
+        listing.amenity_mask = amenity_mask(listing.amenities)
+        listings.append(listing)
+
+    if listings:
+        with transaction.atomic():
+            Listing.objects.bulk_create(listings, batch_size=batch_size)
+            index_listings(listings)
+        result.created += len(listings)
+    return result
+
+
+def import_listings(lines, default_host=None, restrict_to_host=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import listings from an iterable of NDJSON lines and return an ImportResult
+    """
+    result = ImportResult()
+    batch = []
+    for number, row, error in parse_lines(lines):
+        if error is not None:
+            result.add_error(number, error)
+            continue
+        batch.append((number, row))
+        if len(batch) >= batch_size:
+            import_batch(batch, result, default_host, restrict_to_host, batch_size)
+            batch = []
+    if batch:
+        import_batch(batch, result, default_host, restrict_to_host, batch_size)
+    if result.created:
+        bump_version('listings')
+    # Parse errors are reported as they are read and validation errors once their batch is checked
+    result.errors.sort(key=lambda error: error['line'])
+    return result
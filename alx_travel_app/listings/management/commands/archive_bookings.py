@@ -0,0 +1,27 @@
+# Move old bookings and their settled payments out of the hot tables
+from django.core.management.base import BaseCommand, CommandError
+from listings.archive import ARCHIVE_BATCH_SIZE, archive_bookings, archive_cutoff, archivable_bookings
+
+
+class Command(BaseCommand):
+    help = 'Archive bookings that ended more than --days days ago, with their completed, failed or canceled payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Age of the end date in days (default: BOOKING_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='Bookings moved per transaction')
+        parser.add_argument('--limit', type=int, default=None, help='Archive at most this many bookings')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the bookings that would be archived')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        cutoff = archive_cutoff(options['days'])
+        if options['dry_run']:
+            count = archivable_bookings(cutoff).count()
+            self.stdout.write(f'{count} bookings ended before {cutoff} and can be archived')
+            return
+
+        self.stdout.write(f'Archiving bookings that ended before {cutoff}...')
+        bookings, payments = archive_bookings(options['days'], options['batch_size'], options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {bookings} bookings and {payments} payments'))
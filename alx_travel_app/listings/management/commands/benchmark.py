@@ -0,0 +1,23 @@
+# Run one of the registered performance benchmarks
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from listings.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = 'Run a performance benchmark scenario (data is rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', help=f'One of: {", ".join(sorted(SCENARIOS))}')
+        parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                            default=None, help='Comma separated data sizes, e.g. 1000,10000')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement (best is kept)')
+
+    def handle(self, *args, **options):
+        scenario = SCENARIOS.get(options['scenario'])
+        if scenario is None:
+            raise CommandError(f'Unknown scenario "{options["scenario"]}". Choose from: {", ".join(sorted(SCENARIOS))}')
+        self.stdout.write(f'Running benchmark: {options["scenario"]}')
+        # Everything runs in this process, so the version-keyed caches behave as with a shared cache
+        with override_settings(CACHE_SINGLE_PROCESS=True):
+            scenario(self.stdout, sizes=options['sizes'], repeat=options['repeat'])
@@ -0,0 +1,31 @@
+# Check the SQL query budget of every listings route
+from django.core.management.base import BaseCommand, CommandError
+from listings.query_checks import run_route_checks
+
+
+class Command(BaseCommand):
+    help = 'Call every route with a small and a large data set and fail on query budget or N+1 regressions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('routes', nargs='*', help='Route names to check (default: every route in listings/urls.py)')
+        parser.add_argument('--small', type=int, default=2, help='Rows per relation in the small data set')
+        parser.add_argument('--large', type=int, default=10, help='Rows per relation in the large data set')
+        parser.add_argument('--show-queries', action='store_true', help='Print repeated statements of failing routes')
+
+    def handle(self, *args, **options):
+        results = run_route_checks(options['small'], options['large'], options['routes'] or None)
+        self.stdout.write(f'{"route":<28} {"status":>6} {"small":>6} {"large":>6} {"budget":>7}')
+        failed = 0
+        for result in results:
+            line = f'{result.route:<28} {result.status or "-":>6} {result.small if result.small is not None else "-":>6} ' \
+                   f'{result.large if result.large is not None else "-":>6} {result.budget if result.budget is not None else "-":>7}'
+            if result.problems:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{line}  {"; ".join(result.problems)}'))
+                if options['show_queries'] and result.log is not None:
+                    self.stdout.write(result.log.summary(limit=10))
+            else:
+                self.stdout.write(line)
+        if failed:
+            raise CommandError(f'{failed} of {len(results)} routes failed their query budget')
+        self.stdout.write(self.style.SUCCESS(f'All {len(results)} routes are within their query budget'))
@@ -0,0 +1,46 @@
+# Export bookings or payments as NDJSON or CSV in constant memory
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from listings.exports import EXPORTS, EXPORT_FORMATS, EXPORT_BATCH_SIZE, export_lines, parse_boundary
+
+
+class Command(BaseCommand):
+    help = 'Export bookings or payments (with listing title and user details) as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('records', choices=sorted(EXPORTS), help='What to export')
+        parser.add_argument('--export-format', choices=EXPORT_FORMATS, default='ndjson', help='Output format')
+        parser.add_argument('--output', default='-', help='File to write to (default: standard output)')
+        parser.add_argument('--since', help='Only records created on or after this date/datetime')
+        parser.add_argument('--until', help='Only records created before this date/datetime')
+        parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE, help='Rows fetched per query')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_boundary(options['since'])
+            until = parse_boundary(options['until'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = export_lines(options['records'], options['export_format'], since, until, options['batch_size'])
+        binary = options['export_format'] == 'ndjson'
+        if options['output'] == '-':
+            output = sys.stdout.buffer if binary else sys.stdout
+            close = False
+        else:
+            output = open(options['output'], 'wb' if binary else 'w', newline=None if binary else '')
+            close = True
+        count = 0
+        try:
+            for line in lines:
+                output.write(line)
+                count += 1
+        finally:
+            if close:
+                output.close()
+            else:
+                output.flush()
+
+        if options['export_format'] == 'csv':
+            count -= 1  # header row
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} {options["records"]}'))
@@ -0,0 +1,44 @@
+# Bulk import listings from an NDJSON file
+import sys
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from listings.imports import IMPORT_BATCH_SIZE, import_listings
+from listings.models import User
+
+
+class Command(BaseCommand):
+    help = 'Import listings from NDJSON (one listing per line) with batched validation and bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='NDJSON file to import, or - for standard input')
+        parser.add_argument('--host', help='Id, username or email of the host for rows without host_id')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Rows validated and inserted per batch')
+
+    def handle(self, *args, **options):
+        default_host = None
+        if options['host']:
+            lookup = options['host']
+            default_host = (
+                User.objects.filter(username=lookup).first()
+                or User.objects.filter(email=lookup).first()
+            )
+            if default_host is None:
+                try:
+                    default_host = User.objects.filter(pk=lookup).first()
+                except ValidationError:
+                    default_host = None
+            if default_host is None:
+                raise CommandError(f'Unknown host "{lookup}"')
+
+        if options['file'] == '-':
+            result = import_listings(sys.stdin, default_host=default_host, batch_size=options['batch_size'])
+        else:
+            try:
+                with open(options['file'], encoding='utf-8') as lines:
+                    result = import_listings(lines, default_host=default_host, batch_size=options['batch_size'])
+            except OSError as e:
+                raise CommandError(str(e))
+
+        for error in result.errors:
+            self.stderr.write(f'Line {error["line"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(f'Imported {result.created} listings ({len(result.errors)} rejected)'))
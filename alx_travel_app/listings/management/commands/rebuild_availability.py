@@ -0,0 +1,15 @@
+# Rebuild the booked nights availability index
+from django.core.management.base import BaseCommand
+from listings.availability import rebuild_booked_nights
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-night availability index from existing bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per bulk insert')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding availability index...')
+        total = rebuild_booked_nights(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Availability index rebuilt with {total} booked nights'))
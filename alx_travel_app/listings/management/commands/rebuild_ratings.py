@@ -0,0 +1,15 @@
+# Rebuild the denormalized review aggregates on listings
+from django.core.management.base import BaseCommand
+from listings.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute rating_sum, review_count and average_rating for all listings from their reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Listings updated per bulk update')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding listing ratings...')
+        updated = rebuild_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Ratings rebuilt for {updated} listings'))
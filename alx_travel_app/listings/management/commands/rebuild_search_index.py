@@ -0,0 +1,15 @@
+# Rebuild the listing full-text search index
+from django.core.management.base import BaseCommand
+from listings.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the inverted search index from existing listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Listings indexed per batch')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding search index...')
+        total = rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt with {total} tokens'))
@@ -0,0 +1,46 @@
+# Settle pending payments whose webhook never arrived
+from django.core.management.base import BaseCommand, CommandError
+from listings.reconciliation import RECONCILE_BATCH_SIZE, reconcile_cutoff, reconcile_payments, stale_payments, throughput
+
+
+class Command(BaseCommand):
+    help = 'Verify payments pending for more than --minutes minutes with Chapa and record their outcome'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=None,
+                            help='Minutes without change (default: PAYMENT_RECONCILE_AFTER_MINUTES)')
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE, help='Payments written per bulk update')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Concurrent gateway calls (default: PAYMENT_RECONCILE_WORKERS)')
+        parser.add_argument('--limit', type=int, default=None, help='Reconcile at most this many payments')
+        parser.add_argument('--abandon-minutes', type=int, default=None,
+                            help='Fail payments unknown to Chapa after this many minutes without change '
+                                 '(default: PAYMENT_ABANDON_AFTER_MINUTES)')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the payments that would be verified')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        cutoff = reconcile_cutoff(options['minutes'])
+        if options['dry_run']:
+            count = stale_payments(cutoff).count()
+            self.stdout.write(f'{count} payments pending since before {cutoff:%Y-%m-%d %H:%M} can be reconciled')
+            return
+
+        self.stdout.write(f'Reconciling payments pending since before {cutoff:%Y-%m-%d %H:%M}...')
+        stats = reconcile_payments(
+            options['minutes'], options['batch_size'], options['workers'], options['limit'],
+            abandon_minutes=options['abandon_minutes'],
+        )
+        self.stdout.write(
+            f"{stats['completed']} completed, {stats['failed']} failed, {stats['unchanged']} still pending, "
+            f"{stats['not_found']} unknown to the gateway, {stats['skipped']} changed meanwhile"
+        )
+        summary = f"Verified {stats['checked']} payments ({stats['transactions']} transactions) in " \
+                  f"{stats['seconds']:.2f}s ({throughput(stats):.1f}/s)"
+        if stats['errors']:
+            self.stdout.write(self.style.WARNING(f"{summary}, {stats['errors']} verification errors"))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:25
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_booked_nights(apps, schema_editor):
+    # Same rows as listings.availability.rebuild_booked_nights(), from the historical models
+    Booking = apps.get_model('listings', 'Booking')
+    BookedNight = apps.get_model('listings', 'BookedNight')
+    nights = []
+    for booking in Booking.objects.only('id', 'listing_id', 'start_date', 'end_date').iterator(chunk_size=500):
+        night = booking.start_date
+        while night < booking.end_date:
+            nights.append(BookedNight(listing_id=booking.listing_id, booking_id=booking.id, night=night))
+            night += timedelta(days=1)
+        if len(nights) >= 1000:
+            BookedNight.objects.bulk_create(nights)
+            nights = []
+    if nights:
+        BookedNight.objects.bulk_create(nights)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_remove_payment_id_alter_payment_transaction_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookedNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('night', models.DateField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nights', to='listings.booking')),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booked_nights', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing', 'night'], name='bookednight_listing_night_idx')],
+            },
+        ),
+        migrations.RunPython(fill_booked_nights, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_search_index(apps, schema_editor):
+    # The current indexing code: it only reads the indexed listing fields, which all exist at this point
+    from listings.search import rebuild_search_index
+    rebuild_search_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_bookednight'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='listings.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'listing'], name='listingtoken_token_idx')],
+            },
+        ),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+# Snapshot of the amenity codes (in AMENITIES order) at the time of this migration
+AMENITY_CODES = [
+    'wifi', 'kitchen', 'parking', 'pool', 'air_conditioning',
+    'heating', 'washer', 'dryer', 'tv', 'gym',
+]
+
+
+def fill_amenity_mask(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    bits = {code: 1 << position for position, code in enumerate(AMENITY_CODES)}
+    listings = []
+    for listing in Listing.objects.only('id', 'amenities').iterator(chunk_size=500):
+        listing.amenity_mask = sum(bits.get(code, 0) for code in set(listing.amenities or []) if isinstance(code, str))
+        listings.append(listing)
+        if len(listings) >= 500:
+            Listing.objects.bulk_update(listings, ['amenity_mask'])
+            listings = []
+    if listings:
+        Listing.objects.bulk_update(listings, ['amenity_mask'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_listingtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='amenity_mask',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_amenity_mask, migrations.RunPython.noop),
+    ]
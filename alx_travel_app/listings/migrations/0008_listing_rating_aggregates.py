@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_listing_amenity_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='average_rating',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
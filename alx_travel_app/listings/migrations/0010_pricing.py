@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_review_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NightlyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('night', models.DateField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nightly_rates', to='listings.listing')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('listing', 'night'), name='nightlyrate_listing_night_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StayDiscount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_nights', models.PositiveIntegerField()),
+                ('percent', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stay_discounts', to='listings.listing')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('listing', 'min_nights'), name='staydiscount_listing_nights_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='checkout_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+    ]
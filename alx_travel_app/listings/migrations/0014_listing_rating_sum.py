@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:12
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_rating_sum(apps, schema_editor):
+    # Recompute the aggregates from the reviews instead of trusting average_rating * review_count
+    Listing = apps.get_model('listings', 'Listing')
+    Review = apps.get_model('listings', 'Review')
+    aggregates = {
+        row['listing']: (row['total'], row['count'])
+        for row in Review.objects.order_by().values('listing').annotate(total=Sum('rating'), count=Count('id'))
+    }
+    listings = []
+    for listing in Listing.objects.only('id').iterator(chunk_size=500):
+        total, count = aggregates.get(listing.pk, (0, 0))
+        listing.rating_sum = total
+        listing.review_count = count
+        listing.average_rating = total / count if count else 0
+        listings.append(listing)
+        if len(listings) >= 500:
+            Listing.objects.bulk_update(listings, ['rating_sum', 'review_count', 'average_rating'])
+            listings = []
+    if listings:
+        Listing.objects.bulk_update(listings, ['rating_sum', 'review_count', 'average_rating'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0013_webhook_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_sum, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0014_listing_rating_sum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='previous_references',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
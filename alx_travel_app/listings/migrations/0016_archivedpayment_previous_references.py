@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0015_payment_previous_references'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='previous_references',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
@@ -33,6 +33,21 @@ AMENITIES = (
     ('gym', 'Gym'),
 )
 
+# Amenity bitmask: each amenity code owns one bit, in AMENITIES order.
+# Only append new amenities at the end, otherwise stored masks change meaning.
+AMENITY_BITS = {code: 1 << position for position, (code, _) in enumerate(AMENITIES)}
+
+
+def amenity_mask(amenities):
+    """
+    Encode a list of amenity codes as an integer bitmask (unknown codes and non-string entries are ignored)
+    """
+    mask = 0
+    for code in amenities or []:
+        if isinstance(code, str):
+            mask |= AMENITY_BITS.get(code, 0)
+    return mask
+
 # User model
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -57,13 +72,44 @@ class Listing(models.Model):
     description_image = models.URLField(max_length=200, blank=True, null=True)
     property_type = models.CharField(max_length=20, choices=PROPERTY_TYPES, default='apartment')
     amenities = models.JSONField(default=list)
+    # Bitmask derived from amenities on save, see AMENITY_BITS
+    amenity_mask = models.PositiveIntegerField(default=0, db_index=True, editable=False)
     address = models.CharField(max_length=255)
     price_per_night = models.DecimalField(max_digits=10, decimal_places=2)
+    # Review aggregates, maintained incrementally by listings.ratings (0 until the first review)
+    average_rating = models.FloatField(default=0, db_index=True, editable=False)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    # Exact sum of the ratings; average_rating is always derived from it, so no rounding error builds up
+    rating_sum = models.IntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        # Keep the amenity bitmask in sync with the amenities list
+        self.amenity_mask = amenity_mask(self.amenities)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'amenities' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'amenity_mask'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.title
 
+# Listing token model
+# Note: Inverted search index. One row per (listing, token) with a relevance weight built from how often
+# the token occurs and in which field. Rows are rewritten by listings.search whenever a Listing is saved.
+class ListingToken(models.Model):
+    listing = models.ForeignKey(Listing, related_name='search_tokens', on_delete=models.CASCADE)
+    token = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'listing'], name='listingtoken_token_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.token} ({self.weight}) -> {self.listing_id}'
+
 # Review model
 # Note: Each listing can have multiple reviews, but each review is linked to one listing and one user. Only users who have booked a listing can leave a review.
 class Review(models.Model):
@@ -74,6 +120,13 @@ class Review(models.Model):
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Paging a listing's reviews and building its rating histogram
+            models.Index(fields=['listing', 'created_at'], name='review_listing_created_idx'),
+            models.Index(fields=['listing', 'rating'], name='review_listing_rating_idx'),
+        ]
+
     def __str__(self):
         return f'Review by {self.user} for {self.listing.title}'
 
@@ -89,7 +142,56 @@ class Booking(models.Model):
 
     def __str__(self):
         return f'Booking by {self.user} for {self.listing.title} from {self.start_date} to {self.end_date}'
-    
+
+# Booked night model
+# Note: Availability index with one row per occupied night of a booking. Rows are written by
+# listings.availability whenever a Booking is saved and removed with it, so date-range searches
+# can run an indexed anti-join instead of joining and de-duplicating the whole booking table.
+class BookedNight(models.Model):
+    listing = models.ForeignKey(Listing, related_name='booked_nights', on_delete=models.CASCADE)
+    booking = models.ForeignKey(Booking, related_name='nights', on_delete=models.CASCADE)
+    night = models.DateField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing', 'night'], name='bookednight_listing_night_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.listing_id} booked on {self.night}'
+
+# Nightly rate model
+# Note: Per-date price override of a listing (weekends, holidays, seasons). Nights without an override
+# cost the listing's price_per_night. Quotes are computed by listings.pricing.
+class NightlyRate(models.Model):
+    listing = models.ForeignKey(Listing, related_name='nightly_rates', on_delete=models.CASCADE)
+    night = models.DateField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'night'], name='nightlyrate_listing_night_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.listing_id} costs {self.price} on {self.night}'
+
+# Stay discount model
+# Note: Length-of-stay discount of a listing, e.g. 10% from 7 nights. The largest discount whose
+# min_nights the stay reaches applies to the whole stay.
+class StayDiscount(models.Model):
+    listing = models.ForeignKey(Listing, related_name='stay_discounts', on_delete=models.CASCADE)
+    min_nights = models.PositiveIntegerField()
+    percent = models.DecimalField(max_digits=5, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'min_nights'], name='staydiscount_listing_nights_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.percent}% off {self.listing_id} from {self.min_nights} nights'
+
 # Payment model
 class Payment(models.Model):
     PAYMENT_STATUS = [
@@ -103,8 +205,13 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default="NGN")
     status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='pending')
-    chapa_reference = models.CharField(max_length=100, blank=True, null=True)
+    # tx_ref of the current gateway transaction (webhooks are matched on it)
+    chapa_reference = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    # tx_refs of earlier transactions replaced by retries; one of them may still be paid
+    previous_references = models.JSONField(default=list, blank=True, editable=False)
     payment_method = models.CharField(max_length=50, blank=True, null=True)
+    # Hosted checkout page, set once the gateway accepted the transaction (see listings.payments)
+    checkout_url = models.URLField(max_length=500, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     paid_at = models.DateTimeField(blank=True, null=True)
@@ -119,3 +226,82 @@ class Payment(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+
+# Webhook event model
+# Note: Raw Chapa webhook delivery, stored before it is acknowledged. The gateway retries deliveries, so
+# events are unique per (tx_ref, event) and repeated deliveries are dropped. Events are verified and
+# applied to their payment by listings.webhooks in a Celery worker.
+class WebhookEvent(models.Model):
+    STATUS = [
+        ('received', 'Received'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+    tx_ref = models.CharField(max_length=100)
+    event = models.CharField(max_length=50, blank=True, default='')
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS, default='received')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tx_ref', 'event'], name='webhookevent_tx_ref_event_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='webhookevent_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event or "webhook"} for {self.tx_ref} ({self.status})'
+
+# Archived booking model
+# Note: Cold copy of a booking that ended long ago, moved out of the booking table by listings.archive
+# together with its payment. Fields and related names mirror Booking so the same serializers and
+# relation helpers work on both; archived bookings take no part in availability.
+class ArchivedBooking(models.Model):
+    id = models.UUIDField(primary_key=True, editable=False)
+    listing = models.ForeignKey(Listing, related_name='archived_bookings', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='archived_bookings', on_delete=models.CASCADE)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archivedbooking_user_idx'),
+            models.Index(fields=['listing', 'created_at'], name='archivedbooking_listing_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived booking by {self.user} for {self.listing.title} from {self.start_date} to {self.end_date}'
+
+# Archived payment model
+# Note: Cold copy of a settled (completed, failed or canceled) payment of an archived booking
+class ArchivedPayment(models.Model):
+    booking = models.OneToOneField(ArchivedBooking, on_delete=models.CASCADE, related_name='payment')
+    transaction_id = models.UUIDField(primary_key=True, editable=False)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default="NGN")
+    status = models.CharField(max_length=20, choices=Payment.PAYMENT_STATUS)
+    chapa_reference = models.CharField(max_length=100, blank=True, null=True)
+    previous_references = models.JSONField(default=list, blank=True, editable=False)
+    payment_method = models.CharField(max_length=50, blank=True, null=True)
+    checkout_url = models.URLField(max_length=500, blank=True, null=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    paid_at = models.DateTimeField(blank=True, null=True)
+    initiation_response = models.JSONField(blank=True, null=True)
+    verification_response = models.JSONField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived payment {self.transaction_id} - {self.status}"
+
+    class Meta:
+        ordering = ['-created_at']
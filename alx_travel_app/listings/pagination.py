@@ -0,0 +1,176 @@
+# Keyset (cursor) pagination
+# Pages are fetched with a seek predicate on the ordering columns plus the primary key, e.g.
+# WHERE (created_at, id) < (last_created_at, last_id), instead of OFFSET. Deep pages therefore cost
+# the same as the first one and rows inserted while paging cannot shift or duplicate results.
+import json
+from base64 import b64decode, b64encode
+from datetime import date, datetime, time
+from decimal import Decimal
+from operator import attrgetter
+from uuid import UUID
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+def ordering_keys(ordering, pk_name):
+    """
+    Turn ['-created_at', 'title'] into [('created_at', True), ('title', False), (pk_name, True)].
+    The primary key is appended as a tie-breaker so every key tuple is unique.
+    """
+    keys = []
+    for field in ordering:
+        if not isinstance(field, str) or field == '?':
+            continue
+        descending = field.startswith('-')
+        name = field.lstrip('-+')
+        if name == 'pk':
+            name = pk_name
+        if name not in [key for key, _ in keys]:
+            keys.append((name, descending))
+    if pk_name not in [key for key, _ in keys]:
+        keys.append((pk_name, keys[0][1] if keys else True))
+    return keys
+
+
+def seek_filter(keys, values):
+    """
+    Build the Q object selecting rows strictly after `values` for the given (field, descending) keys
+    """
+    condition = Q()
+    for position, (field, descending) in enumerate(keys):
+        step = Q(**{f'{field}__{"lt" if descending else "gt"}': values[position]})
+        for previous, (previous_field, _) in enumerate(keys[:position]):
+            step &= Q(**{previous_field: values[previous]})
+        condition |= step
+    return condition
+
+
+def order_by_keys(keys):
+    return [f'{"-" if descending else ""}{field}' for field, descending in keys]
+
+
+def key_values(item, keys):
+    # Rows from .values() are dictionaries keyed by the lookup itself
+    if isinstance(item, dict):
+        return [item[field] for field, _ in keys]
+    return [attrgetter(field.replace('__', '.'))(item) for field, _ in keys]
+
+
+def keyset_batches(queryset, ordering=None, batch_size=1000):
+    """
+    Yield lists of at most batch_size rows covering queryset, each fetched with a keyset seek.
+    Unlike queryset.iterator() this keeps memory bounded on backends without server-side cursors (MySQL).
+    """
+    keys = ordering_keys(ordering or queryset.query.order_by or ['pk'], queryset.model._meta.pk.name)
+    queryset = queryset.order_by(*order_by_keys(keys))
+    batch = list(queryset[:batch_size])
+    while batch:
+        yield batch
+        if len(batch) < batch_size:
+            return
+        batch = list(queryset.filter(seek_filter(keys, key_values(batch[-1], keys)))[:batch_size])
+
+
+def iterate_keyset(queryset, ordering=None, batch_size=1000):
+    """
+    Yield every row of queryset, fetched in keyset batches (see keyset_batches)
+    """
+    for batch in keyset_batches(queryset, ordering, batch_size):
+        yield from batch
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    return value
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination keyed on the active ordering plus the primary key, e.g. (created_at, id)
+    or (price_per_night, id). Works with OrderingFilter and with orderings set in get_queryset.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-created_at'
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Ordering precedence: explicit queryset.order_by() (OrderingFilter, get_queryset),
+        then view.ordering, then the model's Meta.ordering, then self.ordering.
+        """
+        for ordering in (queryset.query.order_by, getattr(view, 'ordering', None), queryset.model._meta.ordering):
+            if ordering:
+                return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        return (self.ordering,) if isinstance(self.ordering, str) else tuple(self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.keys = ordering_keys(self.get_ordering(request, queryset, view), queryset.model._meta.pk.name)
+        values, reverse = self.decode_cursor(request) or (None, False)
+
+        # Walking backwards is a forward walk over the flipped ordering
+        keys = [(field, not descending) for field, descending in self.keys] if reverse else self.keys
+        queryset = queryset.order_by(*order_by_keys(keys))
+        if values is not None:
+            queryset = queryset.filter(seek_filter(keys, values))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = values is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor((key_values(self.page[-1], self.keys), False))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor((key_values(self.page[0], self.keys), True))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            keys, values, reverse = cursor['k'], cursor['v'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor is only valid for the ordering it was issued for
+        if keys != order_by_keys(self.keys) or len(values) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, cursor):
+        values, reverse = cursor
+        payload = {'k': order_by_keys(self.keys), 'v': [_encode_value(value) for value in values]}
+        if reverse:
+            payload['r'] = 1
+        encoded = b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_html_context(self):
+        return {
+            'previous_url': self.get_previous_link(),
+            'next_url': self.get_next_link(),
+        }
@@ -0,0 +1,15 @@
+# Request body parsers
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline delimited JSON. The body is handed over as an iterator of raw lines and decoded by the caller
+    (see listings/imports.py), so large uploads are never parsed as one document.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return iter(())
+        return iter(stream)
@@ -0,0 +1,205 @@
+# Payment initiation with the gateway
+# A Payment row is created (pending) before the gateway is called; its transaction_id is the tx_ref sent
+# to Chapa, or the chapa_reference of a retry, since Chapa rejects a reused tx_ref. initiate_with_gateway()
+# is shared by the synchronous endpoints and the listings.tasks.initiate_payment task behind the 202
+# (async) mode: it stores the checkout URL on success and marks the payment failed otherwise. A retry
+# starts a new transaction only once the previous one can no longer be paid (ensure_retryable()). The ASGI
+# views (listings/async_views.py) await the gateway themselves and share initiation_request() and
+# record_initiation().
+# apply_verification() moves a payment to the state the gateway reported for one of its transactions,
+# used by the webhook worker (listings/webhooks.py); next_status() is the transition table.
+import uuid
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .caching import bump_version
+from .chapa_service import ChapaService
+from .models import Payment
+
+# Seconds clients are asked to wait (Retry-After) before polling a payment's checkout URL again
+CHECKOUT_RETRY_AFTER = 1
+
+
+class RetryRefused(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This payment cannot be retried.'
+    default_code = 'retry_refused'
+
+    def __init__(self, detail=None, status_code=None):
+        if status_code is not None:
+            self.status_code = status_code
+        super().__init__({'error': detail or self.default_detail})
+
+# Gateway transaction status -> (payment status, payment statuses it may be reached from). A completed
+# payment never changes; a late success still completes a payment an earlier failure was recorded for.
+GATEWAY_TRANSITIONS = {
+    'success': ('completed', ('pending', 'failed')),
+    'failed': ('failed', ('pending',)),
+    'cancelled': ('failed', ('pending',)),
+}
+
+
+def next_status(current, gateway_status):
+    """
+    Payment status after the gateway reported gateway_status, or None when nothing changes
+    """
+    target, allowed = GATEWAY_TRANSITIONS.get(gateway_status, (None, ()))
+    if current not in allowed:
+        return None
+    return target
+
+
+def new_payment(booking):
+    """
+    Create the pending payment of a booking, referenced at the gateway by its transaction_id
+    """
+    transaction_id = uuid.uuid4()
+    return Payment.objects.create(
+        booking=booking,
+        transaction_id=transaction_id,
+        amount=booking.total_price,
+        status='pending',
+        chapa_reference=str(transaction_id),
+    )
+
+
+def ensure_retryable(payment, chapa=None):
+    """
+    Raise RetryRefused unless a new gateway transaction may be started for a payment: it failed, or its
+    current transaction never reached the gateway or was reported failed or cancelled. A pending payment
+    is verified with the gateway first, since its checkout page can still be paid; a paid transaction
+    completes the payment.
+    """
+    if payment.status == 'failed':
+        return
+    if payment.status != 'pending':
+        raise RetryRefused(f'This payment is already {payment.status}.')
+    if not payment.chapa_reference:
+        return
+    result = (chapa or ChapaService()).verify_payment(payment.chapa_reference)
+    if not result['success']:
+        if result.get('not_found'):
+            # The transaction was never created at the gateway, so nothing can be paid under it
+            return
+        raise RetryRefused(
+            'The current transaction could not be checked with the gateway, try again later.',
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    apply_verification(payment, payment.chapa_reference, result)
+    if payment.status == 'completed':
+        raise RetryRefused('This payment is already completed.')
+    if payment.status != 'failed':
+        raise RetryRefused('The checkout of this payment is still open.')
+
+
+def transaction_references(payment):
+    """
+    Every tx_ref the payment was sent to the gateway under, the current one first
+    """
+    references = [payment.chapa_reference, *payment.previous_references, str(payment.transaction_id)]
+    return list(dict.fromkeys(reference for reference in references if reference))
+
+
+def reset_for_retry(payment):
+    """
+    Start a new gateway transaction for a payment, under a fresh tx_ref (after ensure_retryable())
+    """
+    if payment.chapa_reference:
+        payment.previous_references = [*payment.previous_references, payment.chapa_reference]
+    payment.chapa_reference = f'{payment.transaction_id}-{uuid.uuid4().hex[:8]}'
+    payment.status = 'pending'
+    payment.checkout_url = None
+    payment.initiation_response = None
+    payment.verification_response = None
+    payment.paid_at = None
+    payment.save(update_fields=[
+        'chapa_reference', 'previous_references', 'status', 'checkout_url', 'initiation_response', 'verification_response',
+        'paid_at', 'updated_at',
+    ])
+    return payment
+
+
+def initiation_request(payment, return_url):
+    """
+    Arguments of ChapaService.initiate_payment (and AsyncChapaService) for a pending payment
+    """
+    booking = payment.booking
+    user = booking.user
+    return {
+        'amount': float(payment.amount),
+        'email': user.email,
+        'first_name': user.first_name or 'Customer',
+        'last_name': user.last_name or 'User',
+        'tx_ref': payment.chapa_reference,
+        'return_url': return_url,
+        'custom_title': f"Payment for {booking.listing.title}",
+        'custom_description': f"Booking reference: {booking.id}",
+    }
+
+
+def record_initiation(payment, result, record_failure=True):
+    """
+    Store the outcome of a gateway initiation on the payment (a failure only with record_failure)
+    """
+    if result['success']:
+        payment.checkout_url = result['checkout_url']
+        payment.initiation_response = result.get('response_data')
+    elif not record_failure:
+        return
+    else:
+        payment.status = 'failed'
+        payment.initiation_response = {'error': result.get('error'), 'message': result.get('message')}
+    # Only written while the payment is still waiting for this gateway transaction, so a late answer
+    # cannot overwrite a retry or a webhook that got there first
+    Payment.objects.filter(
+        pk=payment.pk, status='pending', chapa_reference=payment.chapa_reference,
+    ).update(
+        status=payment.status,
+        checkout_url=payment.checkout_url,
+        initiation_response=payment.initiation_response,
+        updated_at=timezone.now(),
+    )
+    # update() skips the post_save handlers; booking representations include the payment status
+    bump_version('bookings')
+
+
+def initiate_with_gateway(payment, return_url, chapa=None, record_failure=True):
+    """
+    Ask the gateway for a checkout URL for a pending payment and store the outcome on the payment
+    (a failure only with record_failure, callers that try again leave the payment pending).
+    Returns the result of ChapaService.initiate_payment.
+    """
+    result = (chapa or ChapaService()).initiate_payment(**initiation_request(payment, return_url))
+    record_initiation(payment, result, record_failure)
+    return result
+
+
+def apply_verification(payment, tx_ref, result):
+    """
+    Apply a successful ChapaService.verify_payment result for tx_ref, one of the payment's transactions,
+    to a payment. A paid transaction completes the payment whichever transaction it is (one replaced by a
+    retry included) and becomes its chapa_reference; a failure only counts for the current transaction.
+    Returns the new status, or None when the payment was left alone (unknown gateway status, transition
+    not allowed, or the payment moved on to another transaction or status in the meantime).
+    """
+    gateway_status = result.get('status')
+    target = next_status(payment.status, gateway_status)
+    if target is None:
+        return None
+    _, allowed = GATEWAY_TRANSITIONS[gateway_status]
+    now = timezone.now()
+    changes = {'status': target, 'verification_response': result.get('response_data'), 'updated_at': now}
+    # Conditional on the state that was read, so concurrent deliveries for the same payment apply once
+    payments = Payment.objects.filter(pk=payment.pk, status__in=allowed)
+    if target == 'completed':
+        changes['paid_at'] = now
+        changes['chapa_reference'] = tx_ref
+    else:
+        payments = payments.filter(chapa_reference=tx_ref)
+    updated = payments.update(**changes)
+    if not updated:
+        return None
+    for field, value in changes.items():
+        setattr(payment, field, value)
+    bump_version('bookings')
+    return target
@@ -0,0 +1,115 @@
+# Price quotes
+# A stay costs the sum of its nights (price_per_night unless a NightlyRate overrides the night) minus
+# the largest StayDiscount the number of nights reaches. Each listing's prices are loaded into a RateTable
+# that is cached under a per-listing version bumped by the signal handlers whenever the listing, its
+# nightly rates or its discounts change, so quoting a stay is pure arithmetic on a cache hit.
+# rate_tables() loads the tables of a whole result page with two cache round trips (versions, tables)
+# and, for the misses, three queries regardless of the page size.
+from collections import defaultdict
+from decimal import Decimal
+from django.core.cache import cache
+from .availability import nights_between
+from .caching import get_versions, versioned_caching_enabled
+from .models import Listing, NightlyRate, StayDiscount
+
+PRICING_CACHE_TIMEOUT = 60 * 60 * 24
+MAX_QUOTE_NIGHTS = 366
+CENT = Decimal('0.01')
+
+
+def pricing_scope(listing_id):
+    return f'pricing:{listing_id}'
+
+
+class RateTable:
+    """
+    Base nightly price, per-night overrides and length-of-stay discounts of one listing
+    """
+    def __init__(self, base, overrides=None, discounts=()):
+        self.base = base
+        self.overrides = overrides or {}
+        # (min_nights, percent), largest min_nights first
+        self.discounts = sorted(discounts, reverse=True)
+
+    def discount_percent(self, nights):
+        for min_nights, percent in self.discounts:
+            if nights >= min_nights:
+                return percent
+        return Decimal('0.00')
+
+    def quote(self, start_date, end_date, nights=None):
+        """
+        Price of a stay from start_date up to (not including) end_date; nights may be passed in when
+        the same stay is quoted for many listings
+        """
+        if nights is None:
+            nights = nights_between(start_date, end_date)
+        subtotal = sum((self.overrides.get(night, self.base) for night in nights), Decimal('0'))
+        percent = self.discount_percent(len(nights))
+        discount = (subtotal * percent / 100).quantize(CENT)
+        return {
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'nights': len(nights),
+            'subtotal': str(subtotal.quantize(CENT)),
+            'discount_percent': str(percent),
+            'discount': str(discount),
+            'total': str((subtotal - discount).quantize(CENT)),
+        }
+
+
+def build_rate_tables(listing_ids):
+    """
+    Load the rate tables of the given listings from the database (three queries)
+    """
+    tables = {
+        pk: RateTable(price)
+        for pk, price in Listing.objects.filter(pk__in=listing_ids).values_list('pk', 'price_per_night')
+    }
+    overrides = NightlyRate.objects.filter(listing_id__in=list(tables)).values_list('listing_id', 'night', 'price')
+    for listing_id, night, price in overrides:
+        tables[listing_id].overrides[night] = price
+    discounts = defaultdict(list)
+    for listing_id, min_nights, percent in StayDiscount.objects.filter(listing_id__in=list(tables)).values_list(
+        'listing_id', 'min_nights', 'percent',
+    ):
+        discounts[listing_id].append((min_nights, percent))
+    for listing_id, listing_discounts in discounts.items():
+        tables[listing_id].discounts = sorted(listing_discounts, reverse=True)
+    return tables
+
+
+def rate_tables(listing_ids):
+    """
+    Cached rate tables of the given listings as {pk: RateTable}; unknown listings are left out
+    """
+    if not versioned_caching_enabled():
+        return build_rate_tables(listing_ids)
+    versions = get_versions([pricing_scope(pk) for pk in listing_ids])
+    keys = {f'rate-table:{pk}:{versions[pricing_scope(pk)]}': pk for pk in listing_ids}
+    tables = {keys[key]: table for key, table in cache.get_many(list(keys)).items()}
+    missing = [pk for pk in listing_ids if pk not in tables]
+    if missing:
+        built = build_rate_tables(missing)
+        cache.set_many(
+            {key: built[pk] for key, pk in keys.items() if pk in built},
+            PRICING_CACHE_TIMEOUT,
+        )
+        tables.update(built)
+    return tables
+
+
+def rate_table(listing_id):
+    """
+    Cached rate table of one listing, or None when the listing does not exist
+    """
+    return rate_tables([listing_id]).get(listing_id)
+
+
+def price_page(listing_ids, start_date, end_date):
+    """
+    Quotes of the same stay for every listing of a page, as {pk: quote}
+    """
+    nights = nights_between(start_date, end_date)
+    tables = rate_tables(listing_ids)
+    return {pk: table.quote(start_date, end_date, nights) for pk, table in tables.items()}
@@ -0,0 +1,148 @@
+# SQL query budgets per endpoint
+# QUERY_BUDGETS caps the number of queries a request to each named route may run. They are enforced by
+#   * `manage.py check_query_budgets`, which calls every route with a small and a large data set and fails
+#     when a route exceeds its budget or when its query count grows with the number of rows (N+1), and
+#   * QueryBudgetMiddleware (optional, for development), which counts the queries of every request, adds an
+#     X-Query-Count header and logs (or raises, with QUERY_BUDGET_STRICT) when a budget is exceeded.
+# Budgets include the Basic authentication lookup and the savepoints of nested transactions, and assume
+# empty caches. Settings can override single entries with QUERY_BUDGETS.
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('listings.query_budget')
+
+# Route name (see `listings/urls.py`) -> maximum number of queries per request
+QUERY_BUDGETS = {
+    'api-root': 1,
+    'listing-list': 6,
+    'listing-detail': 2,
+    'listing-bookings': 3,
+    'listing-reviews': 4,
+    'listing-import-listings': 9,
+    'listing-create-booking': 16,
+    'listing-facets': 2,
+    'listing-calendar': 3,
+    'listing-quote': 4,
+    'listing-availability': 2,
+    'listing-my-listings': 2,
+    'booking-list': 3,
+    'booking-detail': 2,
+    'booking-my-bookings': 3,
+    'booking-host-bookings': 3,
+    'booking-export': 2,
+    'booking-cancel': 6,
+    'booking-reschedule': 15,
+    'booking-confirm': 2,
+    'booking-initiate-payment': 2,
+    'payment-list': 2,
+    'payment-detail': 2,
+    'payment-export': 2,
+    'payment-retry-payment': 4,
+    'payment-checkout': 2,
+    'payment-status': 2,
+    'chapa-webhook': 3,
+    'payment-success': 1,
+    'async-payment-create': 7,
+    'async-payment-status': 3,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def get_budget(route_name):
+    """
+    Query budget of a route, or None when it has no budget
+    """
+    overrides = getattr(settings, 'QUERY_BUDGETS', {})
+    return overrides.get(route_name, QUERY_BUDGETS.get(route_name))
+
+
+class QueryLog:
+    """
+    SQL statements executed while capturing, as (sql, milliseconds) pairs
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - started) * 1000))
+
+    def repeated(self, threshold=2):
+        """
+        Statements run at least threshold times - the usual sign of an N+1 pattern
+        """
+        counts = Counter(sql for sql, _ in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count >= threshold]
+
+    def summary(self, limit=3):
+        lines = [f'{len(self)} queries']
+        for sql, count in self.repeated()[:limit]:
+            lines.append(f'  {count}x {sql[:200]}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def capture_queries(using=None):
+    """
+    Record every query run on the given database aliases (all of them by default), without DEBUG=True
+    """
+    log = QueryLog()
+    aliases = [using] if using else list(connections)
+    wrappers = [connections[alias].execute_wrapper(log) for alias in aliases]
+    for wrapper in wrappers:
+        wrapper.__enter__()
+    try:
+        yield log
+    finally:
+        for wrapper in reversed(wrappers):
+            wrapper.__exit__(None, None, None)
+
+
+def check_budget(route_name, log):
+    """
+    Raise QueryBudgetExceeded when log went over the budget of route_name
+    """
+    budget = get_budget(route_name)
+    if budget is not None and len(log) > budget:
+        raise QueryBudgetExceeded(f'{route_name}: {len(log)} queries, budget is {budget}\n{log.summary()}')
+
+
+class QueryBudgetMiddleware:
+    """
+    Development middleware counting the queries of each request against QUERY_BUDGETS.
+    Queries run while a streamed response is consumed happen after the middleware and are not counted.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+
+    def __call__(self, request):
+        with capture_queries() as log:
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        route_name = match.url_name if match else None
+        response['X-Query-Count'] = str(len(log))
+        if route_name:
+            try:
+                check_budget(route_name, log)
+            except QueryBudgetExceeded as e:
+                if self.strict:
+                    raise
+                logger.warning(f'⚠️ Query budget exceeded: {e}', extra={
+                    'path': request.path,
+                    'action': 'query_budget_exceeded'
+                })
+        return response
@@ -0,0 +1,373 @@
+# Query count checks for every route in listings/urls.py
+# Each route is called twice, against a small and a large data set, inside a rolled back transaction with
+# empty caches (worst case). A route fails when it does not answer with a 2xx status (or the status its
+# check expects), so that budgets are never measured on an error path, when it runs more queries than its
+# budget in listings/query_budget.py or when the large data set needs more queries than the small one.
+# Run with: python manage.py check_query_budgets (or the RouteQueryBudgetTests in listings/tests.py)
+import base64
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+from django.core.cache import caches
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from .benchmarks import rolled_back
+from .async_chapa import AsyncChapaService
+from .chapa_service import ChapaService
+from .models import Booking, Listing, Payment, Review, User
+from .query_budget import capture_queries, get_budget
+
+ROUTE_CHECKS = {}
+PASSWORD = 'query-budget'
+
+
+def route_check(route_name):
+    """
+    Register the request used to measure a route: func(fixture) returns a dict with method, user,
+    kwargs (URL arguments), query, data, content_type and expected_status (None for any 2xx)
+    """
+    def register(func):
+        ROUTE_CHECKS[route_name] = func
+        return func
+    return register
+
+
+def listing_route_names():
+    """
+    Names of every route defined by listings/urls.py
+    """
+    from . import urls
+    names = set()
+
+    def collect(patterns):
+        for pattern in patterns:
+            if hasattr(pattern, 'url_patterns'):
+                collect(pattern.url_patterns)
+            elif pattern.name:
+                names.add(pattern.name)
+    collect(urls.urlpatterns)
+    return names
+
+
+def make_fixture(size):
+    """
+    A host with one main listing (size bookings with payments, size reviews) and size other listings
+    """
+    def user(name, **extra):
+        account = User(username=f'qb_{name}', email=f'qb_{name}@example.com', first_name='Query', last_name=name, **extra)
+        account.set_password(PASSWORD)
+        account.save()
+        return account
+
+    host = user('host', role='host')
+    guest = user('guest')
+    staff = user('staff', is_staff=True)
+    listings = [
+        Listing.objects.create(
+            host=host, title=f'Budget listing {i}', description='Query budget fixture', property_type='apartment',
+            amenities=['wifi'], address=f'{i} Budget street', price_per_night=Decimal('50.00'),
+        )
+        for i in range(size + 1)
+    ]
+    listing = listings[0]
+    first_day = date.today() + timedelta(days=30)
+    bookings = []
+    for i in range(size):
+        start = first_day + timedelta(days=3 * i)
+        booking = Booking.objects.create(
+            listing=listing, user=guest, start_date=start, end_date=start + timedelta(days=2),
+            total_price=Decimal('100.00'),
+        )
+        Payment.objects.create(booking=booking, amount=booking.total_price)
+        bookings.append(booking)
+    for i in range(size):
+        Review.objects.create(listing=listing, user=user(f'reviewer{i}'), rating=1 + i % 5, comment='Fine')
+    return SimpleNamespace(
+        size=size, host=host, guest=guest, staff=staff, listing=listing, listings=listings,
+        bookings=bookings, booking=bookings[0], payment=bookings[0].payment,
+        free_day=first_day + timedelta(days=3 * size + 10),
+    )
+
+
+def _request(method='get', user=None, kwargs=None, query=None, data=None, content_type=None, expected_status=None):
+    return {
+        'method': method, 'user': user, 'kwargs': kwargs or {}, 'query': query or {},
+        'data': data, 'content_type': content_type, 'expected_status': expected_status,
+    }
+
+
+def _unpaid_booking(fx):
+    # A booking of the guest without a payment yet
+    return Booking.objects.create(
+        listing=fx.listing, user=fx.guest, start_date=fx.free_day, end_date=fx.free_day + timedelta(days=2),
+        total_price=Decimal('100.00'),
+    )
+
+
+@route_check('api-root')
+def api_root(fx):
+    return _request(user=fx.guest)
+
+
+@route_check('listing-list')
+def listing_list(fx):
+    # A dated search also filters on availability and prices the page
+    return _request(user=fx.guest, query={
+        'start_date': fx.free_day.isoformat(), 'end_date': (fx.free_day + timedelta(days=2)).isoformat(),
+    })
+
+
+@route_check('listing-detail')
+def listing_detail(fx):
+    return _request(user=fx.guest, kwargs={'pk': fx.listing.pk})
+
+
+@route_check('listing-bookings')
+def listing_bookings(fx):
+    return _request(user=fx.host, kwargs={'pk': fx.listing.pk})
+
+
+@route_check('listing-reviews')
+def listing_reviews(fx):
+    return _request(user=fx.guest, kwargs={'pk': fx.listing.pk})
+
+
+@route_check('listing-calendar')
+def listing_calendar(fx):
+    return _request(user=fx.guest, kwargs={'pk': fx.listing.pk}, query={
+        'start': fx.booking.start_date.isoformat(), 'end': fx.free_day.isoformat(), 'encoding': 'bitmap',
+    })
+
+
+@route_check('listing-quote')
+def listing_quote(fx):
+    return _request(user=fx.guest, kwargs={'pk': fx.listing.pk}, query={
+        'start_date': fx.free_day.isoformat(), 'end_date': (fx.free_day + timedelta(days=7)).isoformat(),
+    })
+
+
+@route_check('listing-availability')
+def listing_availability(fx):
+    data = {
+        'listing_ids': [str(listing.pk) for listing in fx.listings],
+        'ranges': [
+            {'start_date': fx.booking.start_date.isoformat(), 'end_date': fx.booking.end_date.isoformat()},
+            {'start_date': fx.free_day.isoformat(), 'end_date': (fx.free_day + timedelta(days=3)).isoformat()},
+        ],
+    }
+    return _request('post', fx.guest, data=data, content_type='application/json')
+
+
+@route_check('listing-import-listings')
+def listing_import(fx):
+    lines = [
+        json.dumps({
+            'title': f'Imported {i}', 'description': 'Imported', 'property_type': 'house',
+            'amenities': ['wifi'], 'address': f'{i} Import road', 'price_per_night': '70.00',
+        })
+        for i in range(fx.size)
+    ]
+    return _request('post', fx.host, data='\n'.join(lines), content_type='application/x-ndjson')
+
+
+@route_check('listing-create-booking')
+def listing_create_booking(fx):
+    data = {'start_date': fx.free_day.isoformat(), 'end_date': (fx.free_day + timedelta(days=2)).isoformat()}
+    return _request('post', fx.guest, kwargs={'pk': fx.listing.pk}, data=data, content_type='application/json')
+
+
+@route_check('listing-facets')
+def listing_facets(fx):
+    return _request(user=fx.guest)
+
+
+@route_check('listing-my-listings')
+def listing_my_listings(fx):
+    return _request(user=fx.host)
+
+
+@route_check('booking-list')
+def booking_list(fx):
+    return _request(user=fx.guest)
+
+
+@route_check('booking-detail')
+def booking_detail(fx):
+    return _request(user=fx.guest, kwargs={'pk': fx.booking.pk})
+
+
+@route_check('booking-my-bookings')
+def booking_my_bookings(fx):
+    return _request(user=fx.guest)
+
+
+@route_check('booking-host-bookings')
+def booking_host_bookings(fx):
+    return _request(user=fx.host)
+
+
+@route_check('booking-export')
+def booking_export(fx):
+    return _request(user=fx.staff)
+
+
+@route_check('booking-cancel')
+def booking_cancel(fx):
+    return _request('post', fx.guest, kwargs={'pk': fx.booking.pk})
+
+
+@route_check('booking-reschedule')
+def booking_reschedule(fx):
+    data = {'start_date': fx.free_day.isoformat(), 'end_date': (fx.free_day + timedelta(days=1)).isoformat()}
+    return _request('post', fx.guest, kwargs={'pk': fx.booking.pk}, data=data, content_type='application/json')
+
+
+@route_check('booking-confirm')
+def booking_confirm(fx):
+    return _request(user=fx.host, kwargs={'pk': fx.booking.pk})
+
+
+@route_check('booking-initiate-payment')
+def booking_initiate_payment(fx):
+    return _request('post', fx.guest, kwargs={'pk': _unpaid_booking(fx).pk})
+
+
+@route_check('payment-list')
+def payment_list(fx):
+    return _request(user=fx.staff)
+
+
+@route_check('payment-detail')
+def payment_detail(fx):
+    return _request(user=fx.guest, kwargs={'id': fx.payment.pk})
+
+
+@route_check('payment-export')
+def payment_export(fx):
+    return _request(user=fx.staff)
+
+
+@route_check('payment-retry-payment')
+def payment_retry(fx):
+    # Only a payment whose transaction failed can be retried without asking the gateway
+    Payment.objects.filter(pk=fx.payment.pk).update(status='failed')
+    return _request('post', fx.guest, kwargs={'id': fx.payment.pk})
+
+
+@route_check('payment-checkout')
+def payment_checkout(fx):
+    return _request(user=fx.guest, kwargs={'id': fx.payment.pk})
+
+
+@route_check('payment-status')
+def payment_status(fx):
+    return _request(user=fx.guest, query={'booking_id': str(fx.booking.pk)})
+
+
+@route_check('chapa-webhook')
+def chapa_webhook(fx):
+    # Webhooks are not authenticated
+    data = {'tx_ref': str(fx.payment.pk), 'event': 'charge.success'}
+    return _request('post', data=data, content_type='application/json')
+
+
+@route_check('async-payment-create')
+def async_payment_create(fx):
+    return _request('post', fx.guest, data={'booking_id': str(_unpaid_booking(fx).pk)}, content_type='application/json')
+
+
+@route_check('async-payment-status')
+def async_payment_status(fx):
+    Payment.objects.filter(pk=fx.payment.pk).update(chapa_reference=str(fx.payment.pk))
+    return _request(user=fx.guest, query={'booking_id': str(fx.booking.pk), 'verify': 'true'})
+
+
+@route_check('payment-success')
+def payment_success(fx):
+    return _request(user=fx.guest, query={'booking': str(fx.booking.pk)})
+
+
+# The payment gateway is never called: every Chapa call answers like a successful sandbox transaction
+FAKE_CHAPA_RESULT = {
+    'success': True, 'status': 'success', 'message': 'ok',
+    'checkout_url': 'https://checkout.example.com/pay', 'response_data': {},
+}
+
+
+def measure(route_name, size):
+    """
+    Return (status code, expected status or None, QueryLog) for one call of a route against a fixture of
+    the given size
+    """
+    with rolled_back():
+        fx = make_fixture(size)
+        spec = ROUTE_CHECKS[route_name](fx)
+        # Errors are reported as 500 responses instead of being raised
+        client = APIClient(raise_request_exception=False)
+        if spec['user'] is not None:
+            token = base64.b64encode(f'{spec["user"].username}:{PASSWORD}'.encode()).decode()
+            client.credentials(HTTP_AUTHORIZATION=f'Basic {token}')
+        url = reverse(route_name, kwargs=spec['kwargs'])
+        for alias in ('default', 'fragments'):
+            caches[alias].clear()
+        call = getattr(client, spec['method'])
+        extra = {'content_type': spec['content_type']} if spec['content_type'] else {}
+        with mock.patch.object(ChapaService, 'initiate_payment', return_value=FAKE_CHAPA_RESULT), \
+                mock.patch.object(ChapaService, 'verify_payment', return_value=FAKE_CHAPA_RESULT), \
+                mock.patch.object(AsyncChapaService, 'initiate_payment', return_value=FAKE_CHAPA_RESULT), \
+                mock.patch.object(AsyncChapaService, 'verify_payment', return_value=FAKE_CHAPA_RESULT), \
+                capture_queries() as log:
+            if spec['method'] == 'get':
+                response = call(url, spec['query'])
+            else:
+                if spec['query']:
+                    url = f'{url}?{"&".join(f"{key}={value}" for key, value in spec["query"].items())}'
+                response = call(url, spec['data'], **extra)
+            # Streamed responses run their queries while being consumed
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response.status_code, spec['expected_status'], log
+
+
+def status_problem(status, expected_status):
+    if expected_status is not None:
+        return None if status == expected_status else f'answered {status} instead of {expected_status}'
+    return None if 200 <= status < 300 else f'answered {status} instead of a 2xx status'
+
+
+def run_route_checks(small=2, large=10, routes=None):
+    """
+    Measure every route and return a list of result namespaces (route, status, small, large, budget, problems)
+    """
+    results = []
+    names = sorted(routes or listing_route_names())
+    # Measured in this one process, with the version-keyed caches on as in production (shared cache)
+    with override_settings(
+        ALLOWED_HOSTS=['testserver'],
+        PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+        CACHE_SINGLE_PROCESS=True,
+    ):
+        for name in names:
+            budget = get_budget(name)
+            if name not in ROUTE_CHECKS:
+                results.append(SimpleNamespace(route=name, status=None, small=None, large=None, budget=budget,
+                                               problems=['no route check registered'], log=None))
+                continue
+            status, expected_status, small_log = measure(name, small)
+            large_status, _, large_log = measure(name, large)
+            problems = [
+                problem for problem in {status_problem(status, expected_status), status_problem(large_status, expected_status)}
+                if problem
+            ]
+            if budget is None:
+                problems.append('no query budget')
+            elif len(large_log) > budget:
+                problems.append(f'over budget ({len(large_log)} > {budget})')
+            if len(large_log) > len(small_log):
+                problems.append(f'query count grows with rows ({len(small_log)} -> {len(large_log)})')
+            results.append(SimpleNamespace(route=name, status=status, small=len(small_log), large=len(large_log),
+                                           budget=budget, problems=problems, log=large_log))
+    return results
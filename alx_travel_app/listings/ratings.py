@@ -0,0 +1,73 @@
+# Denormalized review aggregates on Listing
+# rating_sum and review_count are adjusted incrementally on every review change instead of
+# aggregating the review table on each request; average_rating is derived from the two integers, never
+# from its previous value. rebuild_ratings() recomputes them from scratch.
+from django.db import transaction
+from django.db.models import Count, Sum
+from .models import Listing, Review
+
+
+def apply_rating_change(listing_id, removed=None, added=None):
+    """
+    Adjust a listing's aggregates for one review rating being removed and/or added.
+    The listing row is locked so concurrent review changes cannot lose updates.
+    """
+    with transaction.atomic():
+        listing = (
+            Listing.objects.select_for_update()
+            .filter(pk=listing_id)
+            .only('id', 'rating_sum', 'review_count')
+            .first()
+        )
+        if listing is None:
+            return
+        count = listing.review_count
+        total = listing.rating_sum
+        if removed is not None and count > 0:
+            total -= removed
+            count -= 1
+        if added is not None:
+            total += added
+            count += 1
+        if count == 0:
+            total = 0
+        Listing.objects.filter(pk=listing_id).update(
+            review_count=count,
+            rating_sum=total,
+            average_rating=average(total, count),
+        )
+
+
+def average(total, count):
+    return total / count if count else 0
+
+
+def rebuild_ratings(batch_size=1000):
+    """
+    Recompute rating_sum, review_count and average_rating for every listing in bulk
+    """
+    fields = ['rating_sum', 'review_count', 'average_rating']
+    aggregates = {
+        row['listing']: row
+        for row in Review.objects.order_by().values('listing').annotate(
+            total=Sum('rating'), count=Count('id'),
+        )
+    }
+    updated = 0
+    batch = []
+    with transaction.atomic():
+        listings = Listing.objects.only('id', *fields).order_by('pk')
+        for listing in listings.iterator(chunk_size=batch_size):
+            row = aggregates.get(listing.pk)
+            listing.rating_sum = row['total'] if row else 0
+            listing.review_count = row['count'] if row else 0
+            listing.average_rating = average(listing.rating_sum, listing.review_count)
+            batch.append(listing)
+            if len(batch) >= batch_size:
+                Listing.objects.bulk_update(batch, fields)
+                updated += len(batch)
+                batch = []
+        if batch:
+            Listing.objects.bulk_update(batch, fields)
+            updated += len(batch)
+    return updated
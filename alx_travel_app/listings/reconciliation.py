@@ -0,0 +1,164 @@
+# Reconciliation of pending payments
+# A payment whose webhook never arrived stays pending. Payments pending for more than
+# PAYMENT_RECONCILE_AFTER_MINUTES are walked in batches (keyset over the pk); every transaction of a batch
+# (the current tx_ref and the ones retries replaced, see payments.transaction_references()) is verified
+# with the gateway from a bounded thread pool sharing the pooled ChapaService session, and the resulting
+# transitions are written with one bulk_update per batch. A paid transaction completes the payment
+# whichever one it is; otherwise the current transaction decides (payments.next_status). A payment the
+# gateway has never heard of (its initiation was lost or never sent) is failed once it has been pending
+# for PAYMENT_ABANDON_AFTER_MINUTES, so it leaves the backlog. The rows are locked and checked again
+# first, so a webhook or a retry that got there in between wins.
+# Runs from `manage.py reconcile_payments` and the periodic listings.tasks.reconcile_pending_payments task.
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .caching import bump_version
+from .chapa_service import ChapaService
+from .models import Payment
+from .payments import next_status, transaction_references
+
+RECONCILE_BATCH_SIZE = 200
+RECONCILE_FIELDS = ['status', 'chapa_reference', 'verification_response', 'paid_at', 'updated_at']
+ABANDONED_RESPONSE = {'error': 'Transaction not found', 'message': 'The gateway never received this payment'}
+
+
+def reconcile_cutoff(minutes=None):
+    """
+    Payments pending since before this moment are reconciled
+    """
+    if minutes is None:
+        minutes = getattr(settings, 'PAYMENT_RECONCILE_AFTER_MINUTES', 30)
+    return timezone.now() - timedelta(minutes=minutes)
+
+
+def abandon_cutoff(minutes=None):
+    """
+    Pending payments unknown to the gateway and unchanged since before this moment are failed
+    """
+    if minutes is None:
+        minutes = getattr(settings, 'PAYMENT_ABANDON_AFTER_MINUTES', 24 * 60)
+    return timezone.now() - timedelta(minutes=minutes)
+
+
+def stale_payments(cutoff):
+    """
+    Pending payments that have not changed since cutoff
+    """
+    return Payment.objects.filter(status='pending', updated_at__lt=cutoff)
+
+
+def verify_all(tx_refs, chapa, workers):
+    """
+    Verify many transactions concurrently; returns {tx_ref: ChapaService.verify_payment result}
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tx_refs)))) as pool:
+        return dict(zip(tx_refs, pool.map(chapa.verify_payment, tx_refs)))
+
+
+def reconciled_target(tx_refs, results, abandoned):
+    """
+    (payment status, tx_ref, verification response) for a pending payment with the given transactions
+    (current first), or (outcome, None, None) when it stays pending: unchanged, not_found or errors
+    """
+    for tx_ref in tx_refs:
+        result = results[tx_ref]
+        if result['success'] and next_status('pending', result.get('status')) == 'completed':
+            return 'completed', tx_ref, result.get('response_data')
+    if any(not results[tx_ref]['success'] and not results[tx_ref].get('not_found') for tx_ref in tx_refs):
+        # A transaction that could not be checked may have been paid
+        return 'errors', None, None
+    current = results[tx_refs[0]]
+    if current.get('not_found'):
+        if abandoned:
+            return 'failed', tx_refs[0], ABANDONED_RESPONSE
+        return 'not_found', None, None
+    target = next_status('pending', current.get('status'))
+    if target is None:
+        return 'unchanged', None, None
+    return target, tx_refs[0], current.get('response_data')
+
+
+def reconcile_batch(payment_ids, chapa, workers, stats, abandon_before):
+    """
+    Verify and update one batch of payments, counting the outcomes in stats
+    """
+    payments = Payment.objects.filter(pk__in=payment_ids, status='pending').only(
+        'pk', 'chapa_reference', 'previous_references', 'updated_at',
+    )
+    references = {payment.pk: (payment.chapa_reference, transaction_references(payment)) for payment in payments}
+    abandoned = {payment.pk for payment in payments if payment.updated_at < abandon_before}
+    tx_refs = list(dict.fromkeys(tx_ref for _, refs in references.values() for tx_ref in refs))
+    results = verify_all(tx_refs, chapa, workers) if tx_refs else {}
+    stats['checked'] += len(references)
+    stats['transactions'] += len(tx_refs)
+    targets = {}
+    for pk, (_, refs) in references.items():
+        target, tx_ref, response = reconciled_target(refs, results, pk in abandoned)
+        if tx_ref is None:
+            stats[target] += 1
+        else:
+            targets[pk] = (target, tx_ref, response)
+    if not targets:
+        return
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Lock the rows and check them again: only payments still pending on the verified transaction
+        changed = []
+        for payment in Payment.objects.select_for_update().filter(pk__in=list(targets), status='pending'):
+            if payment.chapa_reference != references[payment.pk][0]:
+                continue
+            target, tx_ref, response = targets[payment.pk]
+            payment.status = target
+            payment.chapa_reference = tx_ref
+            payment.verification_response = response
+            payment.updated_at = now
+            if target == 'completed':
+                payment.paid_at = now
+            changed.append(payment)
+            stats[target] += 1
+        stats['skipped'] += len(targets) - len(changed)
+        Payment.objects.bulk_update(changed, RECONCILE_FIELDS)
+    if changed:
+        # bulk_update() skips the post_save handlers; booking representations include the payment status
+        bump_version('bookings')
+
+
+def reconcile_payments(minutes=None, batch_size=RECONCILE_BATCH_SIZE, workers=None, limit=None, chapa=None,
+                       abandon_minutes=None):
+    """
+    Reconcile every stale pending payment (at most limit of them). Returns a Counter of outcomes
+    (checked, transactions, completed, failed, unchanged, not_found, skipped, errors) with the elapsed
+    seconds.
+    """
+    if workers is None:
+        workers = getattr(settings, 'PAYMENT_RECONCILE_WORKERS', 8)
+    chapa = chapa or ChapaService()
+    candidates = stale_payments(reconcile_cutoff(minutes)).order_by('pk').values_list('pk', flat=True)
+    abandon_before = abandon_cutoff(abandon_minutes)
+    stats = Counter()
+    started = time.perf_counter()
+    last_pk = None
+    seen = 0
+    while limit is None or seen < limit:
+        size = batch_size if limit is None else min(batch_size, limit - seen)
+        batch = candidates if last_pk is None else candidates.filter(pk__gt=last_pk)
+        payment_ids = list(batch[:size])
+        if not payment_ids:
+            break
+        reconcile_batch(payment_ids, chapa, workers, stats, abandon_before)
+        seen += len(payment_ids)
+        last_pk = payment_ids[-1]
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def throughput(stats):
+    """
+    Payments verified per second
+    """
+    return stats['checked'] / stats['seconds'] if stats['seconds'] else 0.0
@@ -0,0 +1,71 @@
+# JSON rendering for large responses
+# ORJSONRenderer is a drop-in JSONRenderer using orjson (optional dependency, the stdlib encoder is used
+# when it is not installed). StreamingJSONResponse writes a JSON array element by element from keyset
+# batches, so the worker only ever holds one batch regardless of the result size.
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from .pagination import keyset_batches
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Page size used when streaming, also the number of rows serialized at a time
+STREAM_BATCH_SIZE = 500
+
+
+def _default(value):
+    # Types orjson does not know (Decimal, lazy translation strings, ...) are encoded like DRF does
+    return JSONEncoder().default(value)
+
+
+def dumps(data):
+    """
+    Encode data as compact UTF-8 JSON bytes
+    """
+    if orjson is not None:
+        # Non-string keys (e.g. the star histogram of listing reviews) are stringified like the stdlib does
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return JSONRenderer().render(data)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson. Indented output (browsable API, ?indent=) still uses the stdlib encoder.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+def stream_json_array(batches, serialize):
+    """
+    Yield the JSON encoding of a list built from batches of rows; serialize(batch) returns their representations
+    """
+    yield b'['
+    first = True
+    for batch in batches:
+        items = serialize(batch)
+        if not items:
+            continue
+        chunk = b','.join(dumps(item) for item in items)
+        yield chunk if first else b',' + chunk
+        first = False
+    yield b']'
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    Stream every row of queryset as one JSON array. serialize(batch) must return a list of representations.
+    """
+    def __init__(self, queryset, serialize, ordering=None, batch_size=STREAM_BATCH_SIZE, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(
+            stream_json_array(keyset_batches(queryset, ordering, batch_size), serialize),
+            **kwargs,
+        )
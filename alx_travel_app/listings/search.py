@@ -0,0 +1,138 @@
+# Full-text search for listings
+# Listings are tokenized into ListingToken rows (an inverted index stored in our own database), so keyword
+# search becomes indexed prefix lookups on the token column instead of icontains scans over every listing.
+import re
+from collections import Counter
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from rest_framework.filters import SearchFilter
+from .models import AMENITIES, Listing, ListingToken
+
+# Indexed fields and how much a single occurrence of a token in that field counts towards relevance
+INDEXED_FIELDS = {
+    'title': 4,
+    'amenities': 3,
+    'address': 2,
+    'description': 1,
+}
+
+TOKEN_MAX_LENGTH = ListingToken._meta.get_field('token').max_length
+TOKEN_PATTERN = re.compile(r'\w+')
+AMENITY_LABELS = dict(AMENITIES)
+
+
+def tokenize(text):
+    """
+    Split text into lower-cased word tokens
+    """
+    return [token[:TOKEN_MAX_LENGTH] for token in TOKEN_PATTERN.findall(str(text or '').lower())]
+
+
+def amenity_tokens(amenities):
+    """
+    Tokens for a list of amenity codes: the code itself plus the words of the code and of its label
+    """
+    tokens = []
+    for code in amenities or []:
+        code = str(code)
+        tokens.append(code.lower()[:TOKEN_MAX_LENGTH])
+        tokens.extend(tokenize(code.replace('_', ' ')))
+        tokens.extend(tokenize(AMENITY_LABELS.get(code, '')))
+    return tokens
+
+
+def listing_weights(listing):
+    """
+    Return {token: weight} for a listing
+    """
+    weights = Counter()
+    for field, boost in INDEXED_FIELDS.items():
+        value = getattr(listing, field)
+        tokens = amenity_tokens(value) if field == 'amenities' else tokenize(value)
+        # Count each distinct token once per amenity list, every occurrence elsewhere
+        if field == 'amenities':
+            tokens = set(tokens)
+        for token in tokens:
+            weights[token] += boost
+    return weights
+
+
+def build_tokens(listing):
+    return [
+        ListingToken(listing_id=listing.pk, token=token, weight=weight)
+        for token, weight in listing_weights(listing).items()
+    ]
+
+
+def index_listings(listings, batch_size=1000):
+    """
+    (Re)index a batch of listings, replacing their previous tokens
+    """
+    listings = list(listings)
+    if not listings:
+        return 0
+    rows = []
+    for listing in listings:
+        rows.extend(build_tokens(listing))
+    with transaction.atomic():
+        ListingToken.objects.filter(listing_id__in=[listing.pk for listing in listings]).delete()
+        ListingToken.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def index_listing(listing):
+    return index_listings([listing])
+
+
+def rebuild_search_index(batch_size=500):
+    """
+    Rebuild the whole search index from the listing table
+    """
+    total = 0
+    batch = []
+    fields = ['id', *INDEXED_FIELDS]
+    with transaction.atomic():
+        ListingToken.objects.all().delete()
+        for listing in Listing.objects.only(*fields).order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(listing)
+            if len(batch) >= batch_size:
+                total += index_listings(batch)
+                batch = []
+        total += index_listings(batch)
+    return total
+
+
+def search_listings(queryset, query):
+    """
+    Restrict a listing queryset to listings matching every word of query and rank them by relevance.
+    Each query word matches indexed tokens by prefix, so "apart" finds "apartment".
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return queryset
+    for term in terms:
+        queryset = queryset.filter(
+            pk__in=ListingToken.objects.filter(token__startswith=term).values('listing_id')
+        )
+    matches = Q()
+    for term in terms:
+        matches |= Q(token__startswith=term)
+    rank = (
+        ListingToken.objects.filter(matches, listing=OuterRef('pk'))
+        .order_by()
+        .values('listing')
+        .annotate(total=Sum('weight'))
+        .values('total')
+    )
+    return queryset.annotate(search_rank=Subquery(rank)).order_by('-search_rank')
+
+
+class ListingSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on listings that queries the inverted index
+    """
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        return search_listings(queryset, ' '.join(search_terms))
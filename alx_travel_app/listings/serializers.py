@@ -1,29 +1,49 @@
 # Serializers for Listing and Booking models
 from rest_framework import serializers
-from .models import Listing, Booking, Review, User, Payment
+from .models import Listing, Booking, Review, User, Payment, ArchivedBooking, ArchivedPayment
+from .fieldsets import FieldSetMixin
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(FieldSetMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role', 'date_joined']
 
 # Serializer for the Listing model
-class ListingSerializer(serializers.ModelSerializer):
-    host = UserSerializer()
+# Read endpoints accept ?fields= and ?expand= (see listings/fieldsets.py)
+class ListingSerializer(FieldSetMixin, serializers.ModelSerializer):
+    host = UserSerializer(read_only=True)
     host_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), source='host', write_only=True)
-    reviews = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
+    # Reviews themselves are paged through /api/listings/{id}/reviews/
     class Meta:
         model = Listing
-        fields = ['host_id', 'host', 'title', 'listing_image', 'description', 'description_image', 'property_type', 'amenities', 'address', 'price_per_night', 'created_at', 'reviews']
-        read_only_fields = ['id', 'created_at', 'reviews']
+        fields = ['host_id', 'host', 'title', 'listing_image', 'description', 'description_image', 'property_type', 'amenities', 'address', 'price_per_night', 'created_at', 'review_count']
+        read_only_fields = ['id', 'created_at', 'review_count']
+
+# Serializer for rows of the bulk listing import (see listings/imports.py)
+# Hosts are checked for a whole batch at once, so host_id is a plain UUID here
+class ListingImportSerializer(ListingSerializer):
+    host_id = serializers.UUIDField(required=False)
+
+    class Meta(ListingSerializer.Meta):
+        fields = [name for name in ListingSerializer.Meta.fields if name != 'host']
+
+# Serializer for the Review model
+class ReviewSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Review
+        fields = ['id', 'user', 'username', 'rating', 'comment', 'created_at']
+        read_only_fields = fields
 
 #Serializer for the Booking model
-class BookingSerializer(serializers.ModelSerializer):
-    user = UserSerializer()
-    user_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), source='user', write_only=True)
-    listing = ListingSerializer()
-    listing_id = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all(), source='listing', write_only=True)
+# Bookings are written through listings.booking_engine, which sets the user and total_price
+class BookingSerializer(FieldSetMixin, serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+    user_id = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), source='user', write_only=True, required=False)
+    listing = ListingSerializer(read_only=True)
+    listing_id = serializers.PrimaryKeyRelatedField(queryset=Listing.objects.all(), source='listing', write_only=True, required=False)
     payment_status = serializers.CharField(source='payment.status', read_only=True, allow_null=True)
     payment_id = serializers.UUIDField(source='payment.id', read_only=True, allow_null=True)
     
@@ -33,6 +53,40 @@ class BookingSerializer(serializers.ModelSerializer):
                   'payment_status', 'payment_id', 'total_price', 'created_at']
         read_only_fields = ['id', 'user', 'total_price', 'created_at']
 
+    def validate(self, attrs):
+        start_date = attrs.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = attrs.get('end_date', getattr(self.instance, 'end_date', None))
+        if start_date and end_date and end_date <= start_date:
+            raise serializers.ValidationError({'end_date': 'The end date must be after the start date.'})
+        return attrs
+
+
+# Request body of the batch availability check (POST /api/listings/availability/)
+MAX_AVAILABILITY_LISTINGS = 500
+MAX_AVAILABILITY_RANGES = 10
+
+class DateRangeSerializer(serializers.Serializer):
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate(self, attrs):
+        if attrs['end_date'] <= attrs['start_date']:
+            raise serializers.ValidationError({'end_date': 'The end date must be after the start date.'})
+        return attrs
+
+
+class AvailabilityCheckSerializer(serializers.Serializer):
+    listing_ids = serializers.ListField(
+        child=serializers.UUIDField(), min_length=1, max_length=MAX_AVAILABILITY_LISTINGS,
+    )
+    ranges = serializers.ListField(
+        child=DateRangeSerializer(), min_length=1, max_length=MAX_AVAILABILITY_RANGES,
+    )
+
+    def validate_listing_ids(self, value):
+        # Duplicates are answered once
+        return list(dict.fromkeys(value))
+
 
 class PaymentInitiationSerializer(serializers.Serializer):
     booking_id = serializers.UUIDField(required=True)
@@ -58,9 +112,10 @@ class PaymentInitiationSerializer(serializers.Serializer):
         except Booking.DoesNotExist:
             raise serializers.ValidationError("Booking not found.")
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(FieldSetMixin, serializers.ModelSerializer):
     """
     Serializer for Payment model - Updated for UUID
+    The full booking can be embedded with ?expand=booking
     """
     booking_id = serializers.UUIDField(source='booking.id', read_only=True)
     booking_reference = serializers.UUIDField(source='booking.id', read_only=True)
@@ -72,16 +127,36 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = [
             'transaction_id', 'booking_id', 'booking_reference', 'transaction_id', 
-            'amount', 'currency', 'status', 'chapa_reference', 'payment_method',
+            'amount', 'currency', 'status', 'chapa_reference', 'payment_method', 'checkout_url',
             'listing_title', 'user_email', 'user_name', 'created_at', 'updated_at', 'paid_at'
         ]
         read_only_fields = [
             'transaction_id', 'booking_id', 'booking_reference', 'transaction_id', 
-            'amount', 'currency', 'chapa_reference', 'payment_method',
+            'amount', 'currency', 'chapa_reference', 'payment_method', 'checkout_url',
             'listing_title', 'user_email', 'user_name', 'created_at', 'updated_at', 'paid_at'
         ]
+        expandable_fields = {
+            'booking': lambda: BookingSerializer(read_only=True),
+        }
     
     def get_user_name(self, obj):
         """Get user's full name"""
         user = obj.booking.user
         return f"{user.first_name} {user.last_name}".strip() or user.email
+
+# Archived rows (listings/archive.py) keep the shape of their live counterparts plus archived_at
+class ArchivedBookingSerializer(BookingSerializer):
+    class Meta(BookingSerializer.Meta):
+        model = ArchivedBooking
+        fields = BookingSerializer.Meta.fields + ['archived_at']
+        read_only_fields = fields
+
+
+class ArchivedPaymentSerializer(PaymentSerializer):
+    class Meta(PaymentSerializer.Meta):
+        model = ArchivedPayment
+        fields = PaymentSerializer.Meta.fields + ['archived_at']
+        read_only_fields = fields
+        expandable_fields = {
+            'booking': lambda: ArchivedBookingSerializer(read_only=True),
+        }
@@ -0,0 +1,144 @@
+# Signal handlers keeping derived data in sync with the core models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .models import Booking, Listing, NightlyRate, Payment, Review, StayDiscount, User
+from .availability import sync_booking_nights
+from .search import INDEXED_FIELDS, index_listing
+from .ratings import apply_rating_change
+from .caching import bump_version
+from .fragments import listing_fragments
+from .calendar import calendar_scope
+from .pricing import pricing_scope
+from .serializers import UserSerializer
+
+# User fields embedded in listing representations (the host)
+HOST_FIELDS = set(UserSerializer.Meta.fields)
+
+
+@receiver(post_save, sender=Booking)
+def update_booked_nights(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Booked nights are removed together with the booking through the CASCADE foreign key
+    if raw:
+        return
+    if update_fields and not {'listing', 'start_date', 'end_date'} & set(update_fields):
+        return
+    sync_booking_nights(instance)
+
+
+@receiver(post_save, sender=Listing)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Search tokens are removed together with the listing through the CASCADE foreign key
+    if raw:
+        return
+    if update_fields and not set(INDEXED_FIELDS) & set(update_fields):
+        return
+    index_listing(instance)
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    # Keep the stored listing and rating so post_save can apply the difference
+    instance._previous_rating = None
+    if raw or instance._state.adding:
+        return
+    instance._previous_rating = (
+        Review.objects.filter(pk=instance.pk).values_list('listing_id', 'rating').first()
+    )
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        apply_rating_change(instance.listing_id, added=instance.rating)
+        return
+    previous_listing_id, previous_rating = previous
+    if previous_listing_id != instance.listing_id:
+        apply_rating_change(previous_listing_id, removed=previous_rating)
+        apply_rating_change(instance.listing_id, added=instance.rating)
+    elif previous_rating != instance.rating:
+        apply_rating_change(instance.listing_id, removed=previous_rating, added=instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    apply_rating_change(instance.listing_id, removed=instance.rating)
+
+
+# Listing representations include reviews and the host (see bump_host_listings_version)
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_listings_version(sender, **kwargs):
+    bump_version('listings')
+
+
+# Booking representations include the payment status
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def bump_bookings_version(sender, **kwargs):
+    bump_version('bookings')
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def bump_calendar_version(sender, instance, **kwargs):
+    bump_version(calendar_scope(instance.listing_id))
+
+
+@receiver(post_delete, sender=Listing)
+def bump_deleted_listing_calendar_version(sender, instance, **kwargs):
+    bump_version(calendar_scope(instance.pk))
+
+
+# Rate tables hold the nightly price, the per-night overrides and the discounts of a listing;
+# 'pricing' versions the quotes embedded in dated listing searches
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def bump_listing_pricing_version(sender, instance, **kwargs):
+    bump_version(pricing_scope(instance.pk))
+
+
+@receiver(post_save, sender=NightlyRate)
+@receiver(post_delete, sender=NightlyRate)
+@receiver(post_save, sender=StayDiscount)
+@receiver(post_delete, sender=StayDiscount)
+def bump_rate_pricing_version(sender, instance, **kwargs):
+    bump_version('pricing', pricing_scope(instance.listing_id))
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_fragment(sender, instance, **kwargs):
+    listing_fragments.delete_many([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviewed_listing_fragment(sender, instance, **kwargs):
+    # A review moved to another listing changes both listings
+    previous = getattr(instance, '_previous_rating', None)
+    listing_ids = {instance.listing_id}
+    if previous is not None:
+        listing_ids.add(previous[0])
+    listing_fragments.delete_many(listing_ids)
+
+
+@receiver(post_save, sender=User)
+def bump_host_listings_version(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Listings embed their host, so every listing of the user is stale. Saves of other fields (a login
+    # only updates last_login) and users hosting nothing leave the listings alone; a deleted host's
+    # listings are deleted with it and handled by the Listing handlers.
+    if raw:
+        return
+    if update_fields and not HOST_FIELDS & set(update_fields):
+        return
+    listing_ids = list(Listing.objects.filter(host_id=instance.pk).values_list('pk', flat=True))
+    if listing_ids:
+        listing_fragments.delete_many(listing_ids)
+        bump_version('listings')
@@ -3,7 +3,11 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
 import logging
-from .models import Booking
+from .models import Booking, Payment
+from .archive import archive_bookings
+from .reconciliation import reconcile_payments, throughput
+from .payments import initiate_with_gateway
+from .webhooks import VerificationError, fail_event, process_event
 
 # Get logger for payments
 logger = logging.getLogger('chapa_payment')
@@ -90,4 +94,98 @@ def send_booking_confirmation(self, booking_id):
             'action': 'email_send_failed'
         })
         return f"Failed to send email: {str(e)}"
-    
\ No newline at end of file
+    
+
+
+@shared_task(ignore_result=True)
+def archive_old_bookings():
+    """
+    Periodic task (CELERY_BEAT_SCHEDULE) moving old bookings and settled payments to the archive tables
+    """
+    bookings, payments = archive_bookings()
+    logger.info(f"🗄️ Archived {bookings} bookings and {payments} payments", extra={
+        'bookings': bookings,
+        'payments': payments,
+        'action': 'bookings_archived'
+    })
+    return bookings
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=5, acks_late=True)
+def initiate_payment(self, transaction_id, return_url):
+    """
+    Ask the gateway for the checkout URL of a payment created in async mode (202 Accepted).
+    Redelivered or outdated tasks do nothing once the payment has left the pending state or has its URL.
+    """
+    try:
+        payment = Payment.objects.select_related('booking__user', 'booking__listing').get(pk=transaction_id)
+    except Payment.DoesNotExist:
+        logger.error("❌ Payment not found for initiation task", extra={
+            'transaction_id': transaction_id,
+            'action': 'payment_initiation_task_missing'
+        })
+        return None
+    if payment.status != 'pending' or payment.checkout_url:
+        return payment.status
+
+    # The last attempt records a failure on the payment; earlier ones are retried with backoff
+    if self.request.retries < self.max_retries:
+        result = initiate_with_gateway(payment, return_url, record_failure=False)
+        if not result['success']:
+            raise self.retry(countdown=self.default_retry_delay * 2 ** self.request.retries)
+    else:
+        result = initiate_with_gateway(payment, return_url)
+
+    logger.info("🔗 Payment initiation task finished", extra={
+        'transaction_id': transaction_id,
+        'success': result['success'],
+        'attempt': self.request.retries + 1,
+        'action': 'payment_initiation_task_done'
+    })
+    return 'initiated' if result['success'] else 'failed'
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=5, acks_late=True)
+def process_webhook_event(self, event_id):
+    """
+    Verify and apply a stored Chapa webhook event (listings/webhooks.py). Safe to run more than once
+    for the same event; gateway errors are retried with backoff and mark the event failed in the end.
+    """
+    try:
+        status = process_event(event_id)
+    except VerificationError as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(countdown=self.default_retry_delay * 2 ** self.request.retries)
+        fail_event(event_id, str(e))
+        logger.error("❌ Webhook event could not be verified", extra={
+            'event_id': event_id,
+            'error': str(e),
+            'action': 'webhook_event_failed'
+        })
+        return 'failed'
+
+    logger.info(f"🔔 Webhook event {status}", extra={
+        'event_id': event_id,
+        'status': status,
+        'action': 'webhook_event_done'
+    })
+    return status
+
+
+@shared_task(ignore_result=True)
+def reconcile_pending_payments():
+    """
+    Periodic task (CELERY_BEAT_SCHEDULE) verifying stale pending payments with the gateway
+    """
+    stats = reconcile_payments()
+    log = logger.warning if stats['errors'] else logger.info
+    log(f"🧾 Reconciled {stats['checked']} pending payments", extra={
+        'checked': stats['checked'],
+        'completed': stats['completed'],
+        'failed': stats['failed'],
+        'not_found': stats['not_found'],
+        'errors': stats['errors'],
+        'per_second': round(throughput(stats), 1),
+        'action': 'payments_reconciled'
+    })
+    return stats['checked']
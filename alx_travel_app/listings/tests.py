@@ -1,22 +1,1567 @@
-# test_uuid_payment.py
-import requests
+# Tests for the listings app
+# Run with: python manage.py test listings
+import base64
+import csv
+import io
 import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import skipIf
+from django.apps import apps
+from django.core.cache import caches
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from . import async_chapa
+from .archive import archive_bookings
+from .availability import rebuild_booked_nights
+from .booking_engine import BookingConflict, create_booking, reschedule_booking
+from .caching import VERSIONED_CACHE_ALIASES, bump_version, get_version, get_versions, versioned_caching_enabled
+from .calendar import month_window
+from .chapa_service import ChapaService, reset_session
+from .checks import check_shared_cache
+from .exports import export_lines
+from .fake_gateway import FakeChapaGateway
+from .fastpath import booking_values, listing_values
+from .fragments import listing_fragments
+from .models import (
+    AMENITY_BITS, ArchivedBooking, ArchivedPayment, BookedNight, Booking, Listing, ListingToken, NightlyRate, Payment,
+    Review, StayDiscount, User, WebhookEvent,
+)
+from .payments import new_payment, next_status, reset_for_retry
+from .query_checks import run_route_checks
+from .pricing import RateTable
+from .ratings import rebuild_ratings
+from .reconciliation import reconcile_payments
+from .renderers import ORJSONRenderer, dumps, stream_json_array
+from .search import listing_weights, rebuild_search_index, search_listings, tokenize
+from .serializers import BookingSerializer, ListingSerializer
+from .tasks import initiate_payment
+from .webhooks import VerificationError, fail_event, process_event, record_event
 
-# Configuration
-BASE_URL = "http://localhost:8000/api"
-AUTH_TOKEN = "your_jwt_token_here"
-BOOKING_UUID = "19664e38-302f-4995-8ec2-a8b93991e076"
 
-headers = {
-    "Authorization": f"Bearer {AUTH_TOKEN}",
-    "Content-Type": "application/json"
-}
+def make_user(name, **extra):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='test-password', first_name=name.title(),
+        last_name='Tester', **extra,
+    )
 
-# Test payment initiation
-payload = {
-    "booking_id": BOOKING_UUID
-}
 
-response = requests.post(f"{BASE_URL}/payments/", json=payload, headers=headers)
-print("Status Code:", response.status_code)
-print("Response:", json.dumps(response.json(), indent=2))
\ No newline at end of file
+def make_listing(host, title, price='50.00'):
+    return Listing.objects.create(
+        host=host, title=title, description='Test listing', property_type='apartment', amenities=['wifi'],
+        address=f'1 {title} street', price_per_night=Decimal(price),
+    )
+
+
+class GatewayTestCase(TestCase):
+    """
+    Test case talking to a FakeChapaGateway (self.gateway) through the pooled ChapaService session
+    """
+    def setUp(self):
+        self.gateway = FakeChapaGateway().start()
+        self.addCleanup(self.gateway.stop)
+        # No retries, so the gateway errors of fail_next() reach the code under test at once
+        overridden = override_settings(CHAPA_BASE_URL=self.gateway.base_url, CHAPA_MAX_RETRIES=0)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        reset_session()
+        self.addCleanup(reset_session)
+
+    def make_payment(self, days_ahead=30):
+        host = make_user(f'host{days_ahead}', role='host')
+        guest = make_user(f'guest{days_ahead}')
+        start = date.today() + timedelta(days=days_ahead)
+        booking = create_booking(make_listing(host, f'Flat {days_ahead}'), guest, start, start + timedelta(days=2))
+        return new_payment(booking)
+
+
+@override_settings(CACHE_SINGLE_PROCESS=True)
+class SharedCacheTestCase(TestCase):
+    """
+    Test case with the version-keyed caches turned on (one process shares the local caches) and emptied
+    """
+    def setUp(self):
+        for alias in VERSIONED_CACHE_ALIASES:
+            caches[alias].clear()
+
+
+class BookedNightTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Loft')
+        self.other = make_listing(self.host, 'Barn')
+        self.day = date.today() + timedelta(days=30)
+
+    def nights(self, booking):
+        return list(BookedNight.objects.filter(booking=booking).order_by('night').values_list('night', flat=True))
+
+    def stay(self, first, last):
+        return [self.day + timedelta(days=offset) for offset in range(first, last)]
+
+    def test_nights_follow_the_booking(self):
+        booking = create_booking(self.listing, self.guest, self.day, self.day + timedelta(days=3))
+        self.assertEqual(self.nights(booking), self.stay(0, 3))
+
+        reschedule_booking(booking, self.day + timedelta(days=5), self.day + timedelta(days=7))
+        self.assertEqual(self.nights(booking), self.stay(5, 7))
+
+        booking.delete()
+        self.assertFalse(BookedNight.objects.exists())
+
+    def test_saving_other_fields_keeps_the_nights(self):
+        booking = create_booking(self.listing, self.guest, self.day, self.day + timedelta(days=2))
+        before = list(BookedNight.objects.filter(booking=booking).values_list('pk', flat=True))
+        booking.total_price = Decimal('90.00')
+        booking.save(update_fields=['total_price'])
+        self.assertEqual(list(BookedNight.objects.filter(booking=booking).values_list('pk', flat=True)), before)
+
+    def test_dated_search_returns_each_free_listing_once(self):
+        create_booking(self.listing, self.guest, self.day, self.day + timedelta(days=2))
+        create_booking(self.other, self.guest, self.day + timedelta(days=2), self.day + timedelta(days=4))
+        client = APIClient()
+        client.force_authenticate(self.guest)
+
+        def search(first, last):
+            response = client.get('/api/listings/', {
+                'start_date': (self.day + timedelta(days=first)).isoformat(),
+                'end_date': (self.day + timedelta(days=last)).isoformat(),
+            })
+            return [listing['title'] for listing in response.data['results']]
+
+        self.assertEqual(search(1, 2), ['Barn'])
+        self.assertEqual(search(2, 3), ['Loft'])
+        self.assertEqual(sorted(search(4, 6)), ['Barn', 'Loft'])
+        self.assertEqual(search(1, 3), [])
+
+    def test_migration_and_rebuild_fill_the_index_from_existing_bookings(self):
+        create_booking(self.listing, self.guest, self.day, self.day + timedelta(days=3))
+        create_booking(self.other, self.guest, self.day, self.day + timedelta(days=1))
+        expected = sorted(BookedNight.objects.values_list('listing_id', 'booking_id', 'night'))
+
+        BookedNight.objects.all().delete()
+        import_module('listings.migrations.0005_bookednight').fill_booked_nights(apps, None)
+        self.assertEqual(sorted(BookedNight.objects.values_list('listing_id', 'booking_id', 'night')), expected)
+
+        self.assertEqual(rebuild_booked_nights(), 4)
+        self.assertEqual(sorted(BookedNight.objects.values_list('listing_id', 'booking_id', 'night')), expected)
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def search(self, query):
+        return [listing['title'] for listing in self.client.get('/api/listings/', {'search': query}).data['results']]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Sunny Apartment, 2nd floor!'), ['sunny', 'apartment', '2nd', 'floor'])
+        self.assertEqual(tokenize(None), [])
+        self.assertEqual(len(tokenize('x' * 100)[0]), ListingToken._meta.get_field('token').max_length)
+
+    def test_amenities_are_indexed_by_code_and_label(self):
+        listing = make_listing(self.host, 'Flat')
+        listing.amenities = ['air_conditioning']
+        weights = listing_weights(listing)
+        self.assertEqual(weights['air_conditioning'], 3)
+        self.assertEqual(weights['air'], 3)
+        self.assertEqual(weights['conditioning'], 3)
+
+    def test_every_word_must_match_by_prefix(self):
+        make_listing(self.host, 'Seaside apartment')
+        make_listing(self.host, 'Mountain apartment')
+        make_listing(self.host, 'Seaside villa')
+        self.assertEqual(sorted(self.search('apart')), ['Mountain apartment', 'Seaside apartment'])
+        self.assertEqual(self.search('SEA apart'), ['Seaside apartment'])
+        self.assertEqual(self.search('castle'), [])
+
+    def test_title_matches_rank_above_description_matches(self):
+        in_description = make_listing(self.host, 'Quiet flat')
+        in_description.description = 'Close to the harbour'
+        in_description.save()
+        make_listing(self.host, 'Harbour view')
+        self.assertEqual(self.search('harbour'), ['Harbour view', 'Quiet flat'])
+        ranks = dict(search_listings(Listing.objects.all(), 'harbour').values_list('title', 'search_rank'))
+        # Title and address of 'Harbour view' (4 + 2), description of 'Quiet flat'
+        self.assertEqual(ranks, {'Harbour view': 6, 'Quiet flat': 1})
+
+    def test_index_follows_edits_and_deletes(self):
+        listing = make_listing(self.host, 'Loft')
+        listing.description = 'Sauna in the basement'
+        listing.save()
+        self.assertEqual(self.search('sauna'), ['Loft'])
+        listing.description = 'Fireplace in the lounge'
+        listing.save()
+        self.assertEqual(self.search('sauna'), [])
+        self.assertEqual(self.search('firepl'), ['Loft'])
+        listing.delete()
+        self.assertFalse(ListingToken.objects.exists())
+
+    def test_migration_and_rebuild_index_existing_listings(self):
+        make_listing(self.host, 'Garden cottage')
+        make_listing(self.host, 'City studio')
+        expected = sorted(ListingToken.objects.values_list('listing_id', 'token', 'weight'))
+
+        ListingToken.objects.all().delete()
+        import_module('listings.migrations.0006_listingtoken').fill_search_index(apps, None)
+        self.assertEqual(sorted(ListingToken.objects.values_list('listing_id', 'token', 'weight')), expected)
+
+        self.assertEqual(rebuild_search_index(), len(expected))
+        self.assertEqual(self.search('cottage'), ['Garden cottage'])
+
+
+class AmenityFilterTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        for title, amenities in (('Basic', ['wifi']), ('Family', ['wifi', 'pool', 'kitchen']), ('Pool', ['pool'])):
+            listing = make_listing(self.host, title)
+            listing.amenities = amenities
+            listing.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def titles(self, amenities):
+        response = self.client.get('/api/listings/', {'amenities': amenities})
+        self.assertEqual(response.status_code, 200)
+        return sorted(listing['title'] for listing in response.data['results'])
+
+    def test_listings_must_have_every_requested_amenity(self):
+        self.assertEqual(self.titles('wifi'), ['Basic', 'Family'])
+        self.assertEqual(self.titles('pool, wifi'), ['Family'])
+        self.assertEqual(self.titles('pool,wifi,gym'), [])
+
+    def test_empty_amenity_list_does_not_filter(self):
+        self.assertEqual(self.titles(','), ['Basic', 'Family', 'Pool'])
+
+    def test_unknown_amenities_are_rejected(self):
+        response = self.client.get('/api/listings/', {'amenities': 'wifi,sauna'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sauna', response.data['amenities'])
+
+    def test_mask_is_kept_in_sync_on_save(self):
+        listing = Listing.objects.get(title='Family')
+        self.assertEqual(listing.amenity_mask, AMENITY_BITS['wifi'] | AMENITY_BITS['pool'] | AMENITY_BITS['kitchen'])
+        listing.amenities = ['gym', 7, None, 'sauna']
+        listing.save(update_fields=['amenities'])
+        listing.refresh_from_db()
+        self.assertEqual(listing.amenity_mask, AMENITY_BITS['gym'])
+
+    def test_migration_fills_the_mask_of_existing_listings(self):
+        expected = dict(Listing.objects.values_list('title', 'amenity_mask'))
+        Listing.objects.update(amenity_mask=0)
+        import_module('listings.migrations.0007_listing_amenity_mask').fill_amenity_mask(apps, None)
+        self.assertEqual(dict(Listing.objects.values_list('title', 'amenity_mask')), expected)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Chalet')
+        self.other = make_listing(self.host, 'Yurt')
+
+    def review(self, rating, listing=None):
+        return Review.objects.create(listing=listing or self.listing, user=self.guest, rating=rating, comment='Nice')
+
+    def aggregates(self, listing=None):
+        listing = Listing.objects.get(pk=(listing or self.listing).pk)
+        return listing.rating_sum, listing.review_count, listing.average_rating
+
+    def test_aggregates_follow_review_changes(self):
+        first = self.review(5)
+        self.review(4)
+        self.review(4)
+        self.assertEqual(self.aggregates(), (13, 3, 13 / 3))
+
+        first.rating = 2
+        first.save()
+        self.assertEqual(self.aggregates(), (10, 3, 10 / 3))
+
+        first.comment = 'Changed my mind'
+        first.save()
+        self.assertEqual(self.aggregates(), (10, 3, 10 / 3))
+
+        first.delete()
+        self.assertEqual(self.aggregates(), (8, 2, 4))
+
+        Review.objects.filter(listing=self.listing).delete()
+        self.assertEqual(self.aggregates(), (0, 0, 0))
+
+    def test_moving_a_review_to_another_listing_updates_both(self):
+        review = self.review(3)
+        self.review(5)
+        review.listing = self.other
+        review.save()
+        self.assertEqual(self.aggregates(), (5, 1, 5))
+        self.assertEqual(self.aggregates(self.other), (3, 1, 3))
+
+    def test_average_does_not_drift_over_many_changes(self):
+        review = self.review(1)
+        self.review(2)
+        self.review(2)
+        for rating in [5, 1, 4, 2, 3, 5, 1] * 20:
+            review.rating = rating
+            review.save()
+        # Exactly (1 + 2 + 2) / 3, not an accumulated floating point error
+        self.assertEqual(self.aggregates(), (5, 3, 5 / 3))
+
+    def test_rebuild_recomputes_every_listing(self):
+        self.review(5)
+        self.review(2)
+        self.review(4, self.other)
+        Listing.objects.update(rating_sum=99, review_count=7, average_rating=1)
+        self.assertEqual(rebuild_ratings(batch_size=1), 2)
+        self.assertEqual(self.aggregates(), (7, 2, 3.5))
+        self.assertEqual(self.aggregates(self.other), (4, 1, 4))
+
+    def test_migration_fills_rating_sum_from_the_reviews(self):
+        self.review(5)
+        self.review(2)
+        Listing.objects.update(rating_sum=0, review_count=0, average_rating=0)
+        import_module('listings.migrations.0014_listing_rating_sum').fill_rating_sum(apps, None)
+        self.assertEqual(self.aggregates(), (7, 2, 3.5))
+        self.assertEqual(self.aggregates(self.other), (0, 0, 0))
+
+
+class VersionedCacheTests(SharedCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Lodge')
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def test_bumps_increment_the_counters(self):
+        first = get_version('test')
+        bump_version('test', 'other')
+        self.assertEqual(get_version('test'), first + 1)
+        # A bump of a scope without a counter starts one
+        self.assertEqual(set(get_versions(['test', 'other'])), {'test', 'other'})
+        caches['default'].clear()
+        bump_version('test')
+        self.assertGreater(get_version('test'), first + 1)
+
+    def test_process_local_caches_are_reported_and_turned_off(self):
+        self.assertEqual(check_shared_cache(None), [])
+        self.assertTrue(versioned_caching_enabled())
+        with self.settings(CACHE_SINGLE_PROCESS=False):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['listings.W001'])
+            self.assertFalse(versioned_caching_enabled())
+
+    def facets(self, **params):
+        return self.client.get('/api/listings/facets/', params).data
+
+    def test_facets_follow_listing_and_booking_changes(self):
+        self.assertEqual(self.facets()['total'], 1)
+        make_listing(self.host, 'Hut', price='150.00')
+        facets = self.facets()
+        self.assertEqual((facets['total'], facets['price']['100-200']), (2, 1))
+
+        start = date.today() + timedelta(days=30)
+        stay = {'start_date': start.isoformat(), 'end_date': (start + timedelta(days=2)).isoformat()}
+        self.assertEqual(self.facets(**stay)['total'], 2)
+        create_booking(self.listing, self.guest, start, start + timedelta(days=2))
+        self.assertEqual(self.facets(**stay)['total'], 1)
+
+    def test_facets_are_cached_only_with_a_shared_cache(self):
+        self.assertEqual(self.facets()['property_type']['apartment'], 1)
+        # update() sends no signal, so the cached counts stay
+        Listing.objects.update(property_type='villa')
+        self.assertEqual(self.facets()['property_type']['apartment'], 1)
+        with self.settings(CACHE_SINGLE_PROCESS=False):
+            self.assertEqual(self.facets()['property_type']['villa'], 1)
+
+    def test_only_changes_to_embedded_host_fields_bump_listings(self):
+        version = get_version('listings')
+        self.host.last_login = timezone.now()
+        self.host.save(update_fields=['last_login'])
+        self.guest.first_name = 'Renamed'
+        self.guest.save()
+        self.assertEqual(get_version('listings'), version)
+
+        self.host.first_name = 'Renamed'
+        self.host.save(update_fields=['first_name'])
+        self.assertEqual(get_version('listings'), version + 1)
+        self.host.save()
+        self.assertEqual(get_version('listings'), version + 2)
+
+
+class ListingFragmentTests(SharedCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Manor')
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def cached(self):
+        return self.listing.pk in listing_fragments.get_many([self.listing.pk])
+
+    def titles(self):
+        return [listing['title'] for listing in self.client.get('/api/listings/').data['results']]
+
+    def test_listing_pages_are_served_from_fragments(self):
+        self.assertEqual(self.titles(), ['Manor'])
+        self.assertTrue(self.cached())
+        # update() sends no signal, so the fragment is served as it was
+        Listing.objects.update(title='Renamed')
+        self.assertEqual(self.titles(), ['Manor'])
+
+    def test_fragments_are_deleted_when_the_listing_changes(self):
+        self.titles()
+        self.listing.title = 'Grand manor'
+        self.listing.save()
+        self.assertFalse(self.cached())
+        self.assertEqual(self.titles(), ['Grand manor'])
+
+        Review.objects.create(listing=self.listing, user=self.guest, rating=4, comment='Nice')
+        self.assertFalse(self.cached())
+        self.assertEqual(self.client.get('/api/listings/').data['results'][0]['review_count'], 1)
+
+        self.listing.delete()
+        self.assertFalse(self.cached())
+        self.assertEqual(self.titles(), [])
+
+    def test_fragments_are_deleted_when_embedded_host_fields_change(self):
+        self.titles()
+        self.host.last_login = timezone.now()
+        self.host.save(update_fields=['last_login'])
+        self.assertTrue(self.cached())
+
+        self.host.first_name = 'Renamed'
+        self.host.save()
+        self.assertFalse(self.cached())
+        self.assertEqual(self.client.get('/api/listings/').data['results'][0]['host']['first_name'], 'Renamed')
+
+    def test_nothing_is_cached_without_a_shared_cache(self):
+        with self.settings(CACHE_SINGLE_PROCESS=False):
+            self.titles()
+        self.assertFalse(self.cached())
+
+
+class ConditionalGetTests(SharedCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Cabana')
+        start = date.today() + timedelta(days=30)
+        self.booking = create_booking(self.listing, self.guest, start, start + timedelta(days=2))
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_listings_answer_304_until_they_change(self):
+        response = self.client.get('/api/listings/')
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.revalidate('/api/listings/', etag).status_code, 304)
+
+        self.listing.title = 'Beach cabana'
+        self.listing.save()
+        response = self.revalidate('/api/listings/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['results'][0]['title'], 'Beach cabana')
+
+    def test_booking_etag_follows_its_payment(self):
+        url = f'/api/bookings/{self.booking.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+        Payment.objects.create(booking=self.booking, amount=self.booking.total_price, status='completed')
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['payment_status'], 'completed')
+
+    def test_etags_differ_per_user(self):
+        etag = self.client.get('/api/listings/')['ETag']
+        other = APIClient()
+        other.force_authenticate(self.host)
+        self.assertEqual(other.get('/api/listings/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_etag_without_a_shared_cache(self):
+        with self.settings(CACHE_SINGLE_PROCESS=False):
+            response = self.client.get('/api/listings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class FieldSetTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Riad')
+        start = date.today() + timedelta(days=30)
+        self.booking = create_booking(self.listing, self.guest, start, start + timedelta(days=2))
+        self.payment = Payment.objects.create(booking=self.booking, amount=self.booking.total_price)
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_sparse_listing_fields(self):
+        listing = self.get('/api/listings/', fields='title,price_per_night')['results'][0]
+        self.assertEqual(listing, {'title': 'Riad', 'price_per_night': '50.00'})
+        listing = self.get('/api/listings/', fields='title,host.username')['results'][0]
+        self.assertEqual(listing, {'title': 'Riad', 'host': {'username': 'host'}})
+
+    def test_relations_not_expanded_are_rendered_as_ids(self):
+        listing = self.get('/api/listings/', expand='')['results'][0]
+        self.assertEqual(listing['host'], self.host.pk)
+        self.assertEqual(self.get('/api/listings/')['results'][0]['host']['username'], 'host')
+
+    def test_booking_fields_and_expand(self):
+        url = f'/api/bookings/{self.booking.pk}/'
+        booking = self.get(url, fields='id,listing.title,payment_status')
+        self.assertEqual(
+            booking, {'id': str(self.booking.pk), 'listing': {'title': 'Riad'}, 'payment_status': 'pending'},
+        )
+        booking = self.get(url, expand='listing')
+        self.assertEqual(booking['user'], self.guest.pk)
+        self.assertEqual(booking['listing']['title'], 'Riad')
+        self.assertEqual(booking['listing']['host'], self.host.pk)
+        booking = self.get(url, expand='listing.host')
+        self.assertEqual(booking['listing']['host']['username'], 'host')
+
+    def test_payments_embed_their_booking_on_request(self):
+        url = f'/api/payments/{self.payment.pk}/'
+        self.assertNotIn('booking', self.get(url))
+        payment = self.get(url, fields='status,booking.id,booking.start_date', expand='booking')
+        self.assertEqual(payment, {
+            'status': 'pending',
+            'booking': {'id': str(self.booking.pk), 'start_date': self.booking.start_date.isoformat()},
+        })
+
+
+class ListingReviewTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.listing = make_listing(self.host, 'Bungalow')
+        self.ratings = [5, 4, 4, 2, 5]
+        for position, rating in enumerate(self.ratings):
+            Review.objects.create(
+                listing=self.listing, user=make_user(f'reviewer{position}'), rating=rating, comment=f'Stay {position}',
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+        self.url = f'/api/listings/{self.listing.pk}/reviews/'
+
+    def test_reviews_are_paged_newest_first(self):
+        comments = []
+        url = f'{self.url}?page_size=2'
+        while url:
+            page = self.client.get(url).data
+            comments += [review['comment'] for review in page['results']]
+            url = page['next']
+        self.assertEqual(comments, [f'Stay {position}' for position in reversed(range(len(self.ratings)))])
+
+    def test_histogram_and_aggregates(self):
+        data = self.client.get(self.url).data
+        self.assertEqual(data['histogram'], {1: 0, 2: 1, 3: 0, 4: 2, 5: 2})
+        self.assertEqual(data['review_count'], 5)
+        self.assertEqual(data['average_rating'], 4)
+        self.assertEqual(data['results'][0]['username'], 'reviewer4')
+
+    def test_listing_representations_carry_only_the_review_count(self):
+        listing = self.client.get(f'/api/listings/{self.listing.pk}/').data
+        self.assertNotIn('reviews', listing)
+        self.assertEqual(listing['review_count'], 5)
+
+    def test_unknown_listing(self):
+        self.assertEqual(self.client.get(f'/api/listings/{uuid.uuid4()}/reviews/').status_code, 404)
+
+
+class FastPathTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listings = [make_listing(self.host, 'Plain'), make_listing(self.host, 'Fancy', price='1234.50')]
+        fancy = self.listings[1]
+        fancy.amenities = ['pool', 'gym']
+        fancy.description = 'Ünïcode "quotes" and\nnew lines'
+        fancy.save()
+        Review.objects.create(listing=fancy, user=self.guest, rating=5, comment='Great')
+        start = date.today() + timedelta(days=30)
+        self.unpaid = create_booking(self.listings[0], self.guest, start, start + timedelta(days=2))
+        self.paid = create_booking(fancy, self.guest, start, start + timedelta(days=3))
+        Payment.objects.create(booking=self.paid, amount=self.paid.total_price, status='completed')
+        self.client = APIClient()
+
+    def assertSameBytes(self, expected, actual):
+        for render in (JSONRenderer().render, dumps):
+            self.assertEqual(render(actual), render(expected))
+
+    def test_listings_render_like_the_serializer(self):
+        queryset = Listing.objects.select_related('host').order_by('pk')
+        self.assertSameBytes(ListingSerializer(queryset, many=True).data, listing_values.serialize(queryset))
+
+    def test_bookings_with_and_without_payment_render_like_the_serializer(self):
+        queryset = Booking.objects.select_related('user', 'listing__host', 'payment').order_by('pk')
+        self.assertSameBytes(BookingSerializer(queryset, many=True).data, booking_values.serialize(queryset))
+        self.assertEqual(
+            {booking['payment_status'] for booking in booking_values.serialize(queryset)}, {None, 'completed'},
+        )
+
+    def test_booking_lists_render_like_the_serializer(self):
+        for user, url in ((self.guest, '/api/bookings/my_bookings/'), (self.host, '/api/bookings/host_bookings/')):
+            with self.subTest(url=url):
+                self.client.force_authenticate(user)
+                results = self.client.get(url).data['results']
+                bookings = [Booking.objects.get(pk=booking['id']) for booking in results]
+                self.assertEqual(len(bookings), 2)
+                self.assertSameBytes(BookingSerializer(bookings, many=True).data, results)
+
+    def test_booking_lists_honour_fields_and_expand(self):
+        for user, url in ((self.guest, '/api/bookings/my_bookings/'), (self.host, '/api/bookings/host_bookings/')):
+            with self.subTest(url=url):
+                self.client.force_authenticate(user)
+                results = self.client.get(url, {'fields': 'id,listing.title,payment_status'}).data['results']
+                self.assertEqual(
+                    sorted((booking['listing']['title'], booking['payment_status']) for booking in results),
+                    [('Fancy', 'completed'), ('Plain', None)],
+                )
+                self.assertEqual({tuple(booking) for booking in results}, {('id', 'listing', 'payment_status')})
+                results = self.client.get(url, {'expand': ''}).data['results']
+                self.assertEqual({booking['user'] for booking in results}, {self.guest.pk})
+                self.assertIn(results[0]['listing'], [listing.pk for listing in self.listings])
+
+
+class JSONRenderingTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.staff = make_user('staff', is_staff=True)
+        listing = make_listing(self.host, 'Tower')
+        start = date.today() + timedelta(days=30)
+        self.bookings = [
+            create_booking(listing, self.guest, start + timedelta(days=2 * i), start + timedelta(days=2 * i + 1))
+            for i in range(5)
+        ]
+        for booking in self.bookings[:3]:
+            Payment.objects.create(booking=booking, amount=booking.total_price)
+        self.client = APIClient()
+
+    def test_orjson_renders_like_the_stdlib_renderer(self):
+        data = {
+            'price': Decimal('12.50'), 'id': uuid.uuid4(), 'text': 'Ünïcode "quoted"\n',
+            'nested': [1, 2.5, None, True], 'histogram': {1: 0, 5: 2},
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        context = {'indent': 2}
+        self.assertEqual(ORJSONRenderer().render(data, renderer_context=context),
+                         JSONRenderer().render(data, renderer_context=context))
+
+    def test_stream_json_array(self):
+        def streamed(batches):
+            return b''.join(stream_json_array(batches, lambda batch: [{'n': n} for n in batch]))
+
+        self.assertEqual(streamed([]), b'[]')
+        self.assertEqual(streamed([[1, 2], [], [3]]), b'[{"n":1},{"n":2},{"n":3}]')
+
+    def test_host_bookings_stream_every_row(self):
+        self.client.force_authenticate(self.host)
+        paged = self.client.get('/api/bookings/host_bookings/', {'page_size': 100}).data['results']
+        response = self.client.get('/api/bookings/host_bookings/', {'stream': 'true'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(streamed, json.loads(dumps(paged)))
+        self.assertEqual(len(streamed), 5)
+        # Sparse fieldsets are paged
+        response = self.client.get('/api/bookings/host_bookings/', {'stream': 'true', 'fields': 'id'})
+        self.assertFalse(response.streaming)
+
+    def test_only_staff_stream_payments(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/payments/', {'stream': 'true'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 3)
+        self.client.force_authenticate(self.guest)
+        response = self.client.get('/api/payments/', {'stream': 'true'})
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.staff = make_user('staff', is_staff=True)
+        listing = make_listing(self.host, 'Tower, "top" floor')
+        start = date.today() + timedelta(days=30)
+        self.bookings = [
+            create_booking(listing, self.guest, start + timedelta(days=2 * i), start + timedelta(days=2 * i + 1))
+            for i in range(3)
+        ]
+        self.payment = Payment.objects.create(booking=self.bookings[0], amount=self.bookings[0].total_price)
+        self.client = APIClient()
+
+    def export(self, path, **params):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_exports_are_staff_only(self):
+        for user in (self.guest, self.host):
+            self.client.force_authenticate(user)
+            for path in ('/api/bookings/export/', '/api/payments/export/'):
+                self.assertEqual(self.client.get(path).status_code, 403)
+
+    def test_ndjson_export(self):
+        response, content = self.export('/api/bookings/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="bookings.ndjson"')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [str(booking.pk) for booking in self.bookings])
+        self.assertEqual(rows[0]['listing_title'], 'Tower, "top" floor')
+        self.assertEqual(rows[0]['user_name'], 'Guest Tester')
+        self.assertEqual(rows[0]['total_price'], str(self.bookings[0].total_price))
+        self.assertEqual(rows[0]['payment_status'], 'pending')
+        self.assertIsNone(rows[1]['payment_status'])
+
+    def test_csv_export(self):
+        response, content = self.export('/api/payments/export/', export_format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="payments.csv"')
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['transaction_id'], str(self.payment.transaction_id))
+        self.assertEqual(rows[0]['listing_title'], 'Tower, "top" floor')
+        self.assertEqual(rows[0]['chapa_reference'], '')
+        self.assertEqual(rows[0]['paid_at'], '')
+
+    def test_export_filters_and_errors(self):
+        Booking.objects.filter(pk=self.bookings[0].pk).update(created_at=timezone.now() - timedelta(days=10))
+        since = (date.today() - timedelta(days=1)).isoformat()
+        _, content = self.export('/api/bookings/export/', since=since)
+        self.assertEqual(len(content.splitlines()), 2)
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.get('/api/bookings/export/', {'export_format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/bookings/export/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_batches_do_not_change_the_output(self):
+        self.assertEqual(list(export_lines('bookings', batch_size=1)), list(export_lines('bookings')))
+
+
+class ListingImportTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.other = make_user('other', role='host')
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def row(self, title, **extra):
+        row = {
+            'title': title, 'description': 'Imported listing', 'property_type': 'apartment',
+            'amenities': ['wifi', 'pool'], 'address': '1 Import street', 'price_per_night': '80.00',
+        }
+        row.update(extra)
+        return json.dumps(row)
+
+    def post(self, lines, content_type='application/x-ndjson', **params):
+        body = b'\n'.join(line if isinstance(line, bytes) else line.encode() for line in lines)
+        path = '/api/listings/import/'
+        if params:
+            path += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.generic('POST', path, body, content_type=content_type)
+
+    def test_import_sets_mask_and_search_index(self):
+        response = self.post([self.row('Harbour loft'), '', self.row('Garden flat')])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 2, 'failed': 0, 'errors': []})
+        listing = Listing.objects.get(title='Harbour loft')
+        self.assertEqual(listing.host, self.host)
+        self.assertEqual(listing.amenity_mask, AMENITY_BITS['wifi'] | AMENITY_BITS['pool'])
+        self.assertEqual([found.pk for found in search_listings(Listing.objects.all(), 'harbour')], [listing.pk])
+
+    def test_partial_failure_reports_sorted_lines(self):
+        lines = [
+            self.row('Good one'),
+            self.row('', price_per_night='-1'),
+            '{not json',
+            b'{"title": "\xff"}',
+            '[1, 2]',
+            self.row('Good two'),
+            self.row('Not mine', host_id=str(self.other.pk)),
+        ]
+        response = self.post(lines)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 5)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3, 4, 5, 7])
+        self.assertIn('Invalid UTF-8', response.data['errors'][2]['errors']['non_field_errors'][0])
+        self.assertEqual(set(Listing.objects.values_list('title', flat=True)), {'Good one', 'Good two'})
+
+    def test_nothing_imported_is_a_400(self):
+        response = self.post(['{not json'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['failed'], 1)
+
+    def test_staff_import_for_other_hosts(self):
+        self.client.force_authenticate(make_user('staff', is_staff=True))
+        response = self.post([self.row('For other', host_id=str(self.other.pk))])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Listing.objects.get(title='For other').host, self.other)
+
+    def test_requires_ndjson(self):
+        response = self.post([self.row('Harbour loft')], content_type='application/json')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self.post([self.row('Harbour loft')], batch_size=0).status_code, 400)
+        self.assertFalse(Listing.objects.exists())
+
+
+class CalendarTests(SharedCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Tower')
+        create_booking(self.listing, self.guest, date(2031, 2, 27), date(2031, 3, 3))
+        create_booking(self.listing, self.guest, date(2031, 3, 3), date(2031, 3, 5))
+        create_booking(self.listing, self.guest, date(2031, 3, 10), date(2031, 3, 12))
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+        self.path = f'/api/listings/{self.listing.pk}/calendar/'
+
+    def test_ranges_are_merged_and_clipped(self):
+        response = self.client.get(self.path, {'month': '2031-03'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'start': '2031-03-01', 'end': '2031-04-01',
+            'booked': [['2031-03-01', '2031-03-05'], ['2031-03-10', '2031-03-12']],
+        })
+
+    def test_bitmap(self):
+        response = self.client.get(self.path, {'start': '2031-03-03', 'end': '2031-03-12', 'encoding': 'bitmap'})
+        self.assertEqual(response.data['bitmap'], '110000011')
+
+    def test_month_window(self):
+        self.assertEqual(month_window('2031-12'), (date(2031, 12, 1), date(2032, 1, 1)))
+        response = self.client.get(self.path, {'month': '2031-04'})
+        self.assertEqual(response.data['booked'], [])
+
+    def test_invalid_windows(self):
+        for params in (
+            {}, {'month': '2031-13'}, {'month': 'march'}, {'start': '2031-03-05', 'end': '2031-03-05'},
+            {'start': '2031-01-01', 'end': '2032-01-03'}, {'month': '2031-03', 'encoding': 'svg'},
+        ):
+            self.assertEqual(self.client.get(self.path, params).status_code, 400, params)
+        for pk in (uuid.uuid4(), 'not-a-uuid'):
+            self.assertEqual(self.client.get(f'/api/listings/{pk}/calendar/', {'month': '2031-03'}).status_code, 404)
+
+    def test_cached_until_the_listing_bookings_change(self):
+        self.client.get(self.path, {'month': '2031-03'})
+        with self.assertNumQueries(0):
+            self.client.get(self.path, {'month': '2031-03'})
+        # Bookings of other listings keep the cached calendar
+        create_booking(make_listing(self.host, 'Barn'), self.guest, date(2031, 3, 20), date(2031, 3, 22))
+        with self.assertNumQueries(0):
+            self.client.get(self.path, {'month': '2031-03'})
+        booking = create_booking(self.listing, self.guest, date(2031, 3, 20), date(2031, 3, 22))
+        response = self.client.get(self.path, {'month': '2031-03'})
+        self.assertEqual(response.data['booked'][-1], ['2031-03-20', '2031-03-22'])
+        booking.delete()
+        response = self.client.get(self.path, {'month': '2031-03'})
+        self.assertEqual(len(response.data['booked']), 2)
+        self.listing.delete()
+        self.assertEqual(self.client.get(self.path, {'month': '2031-03'}).status_code, 404)
+
+
+class BatchAvailabilityTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.tower = make_listing(self.host, 'Tower')
+        self.barn = make_listing(self.host, 'Barn')
+        self.cabin = make_listing(self.host, 'Cabin')
+        create_booking(self.tower, self.guest, date(2031, 3, 3), date(2031, 3, 6))
+        create_booking(self.barn, self.guest, date(2031, 3, 10), date(2031, 3, 12))
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def check(self, listing_ids, ranges):
+        return self.client.post('/api/listings/availability/', {
+            'listing_ids': [str(pk) for pk in listing_ids],
+            'ranges': [{'start_date': start, 'end_date': end} for start, end in ranges],
+        }, format='json')
+
+    def test_each_range_lists_free_listings_in_request_order(self):
+        missing = uuid.uuid4()
+        ids = [self.cabin.pk, missing, self.barn.pk, self.tower.pk, self.barn.pk]
+        ranges = [('2031-03-01', '2031-03-03'), ('2031-03-05', '2031-03-11'), ('2031-03-06', '2031-03-10')]
+        with self.assertNumQueries(1):
+            response = self.check(ids, ranges)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([stay['available'] for stay in response.data['ranges']], [
+            [self.cabin.pk, self.barn.pk, self.tower.pk],
+            [self.cabin.pk],
+            [self.cabin.pk, self.barn.pk, self.tower.pk],
+        ])
+        self.assertEqual(response.data['ranges'][1]['start_date'], date(2031, 3, 5))
+        self.assertEqual(response.data['unknown'], [missing])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.check([], [('2031-03-01', '2031-03-03')]).status_code, 400)
+        self.assertEqual(self.check([self.tower.pk], []).status_code, 400)
+        self.assertEqual(self.check([self.tower.pk], [('2031-03-03', '2031-03-03')]).status_code, 400)
+        self.assertEqual(self.check(['nope'], [('2031-03-01', '2031-03-03')]).status_code, 400)
+        self.assertEqual(self.check([self.tower.pk], [('2031-03-01', '2031-03-03')] * 11).status_code, 400)
+
+
+class QuoteTests(SharedCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Tower', price='100.00')
+        NightlyRate.objects.create(listing=self.listing, night=date(2031, 3, 2), price=Decimal('150.00'))
+        StayDiscount.objects.create(listing=self.listing, min_nights=3, percent=Decimal('10.00'))
+        StayDiscount.objects.create(listing=self.listing, min_nights=7, percent=Decimal('20.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def quote(self, start_date, end_date, listing=None):
+        return self.client.get(
+            f'/api/listings/{(listing or self.listing).pk}/quote/', {'start_date': start_date, 'end_date': end_date},
+        )
+
+    def test_rate_table_quote(self):
+        table = RateTable(Decimal('100.00'), {date(2031, 3, 2): Decimal('150.00')}, [(3, Decimal('10.00'))])
+        self.assertEqual(table.quote(date(2031, 3, 1), date(2031, 3, 3)), {
+            'start_date': '2031-03-01', 'end_date': '2031-03-03', 'nights': 2, 'subtotal': '250.00',
+            'discount_percent': '0.00', 'discount': '0.00', 'total': '250.00',
+        })
+        self.assertEqual(table.quote(date(2031, 3, 1), date(2031, 3, 4))['total'], '315.00')
+
+    def test_quote_endpoint(self):
+        response = self.quote('2031-03-01', '2031-03-08')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['listing_id'], self.listing.pk)
+        self.assertEqual(response.data['subtotal'], '750.00')
+        self.assertEqual(response.data['discount_percent'], '20.00')
+        self.assertEqual(response.data['total'], '600.00')
+        self.assertEqual(self.quote('2031-03-03', '2031-03-01').status_code, 400)
+        self.assertEqual(self.quote('2031-03-01', '2032-03-02').status_code, 400)
+        self.assertEqual(self.quote('2031-03-01', '2031-03-02', listing=Listing(pk=uuid.uuid4())).status_code, 404)
+
+    def test_quotes_follow_rate_changes(self):
+        self.assertEqual(self.quote('2031-03-01', '2031-03-03').data['total'], '250.00')
+        with self.assertNumQueries(0):
+            self.quote('2031-03-01', '2031-03-03')
+        NightlyRate.objects.create(listing=self.listing, night=date(2031, 3, 1), price=Decimal('120.00'))
+        self.assertEqual(self.quote('2031-03-01', '2031-03-03').data['total'], '270.00')
+        self.listing.price_per_night = Decimal('80.00')
+        self.listing.save()
+        self.assertEqual(self.quote('2031-03-03', '2031-03-04').data['total'], '80.00')
+
+    def test_dated_search_quotes_every_listing(self):
+        make_listing(self.host, 'Barn', price='40.00')
+        response = self.client.get('/api/listings/', {'start_date': '2031-03-01', 'end_date': '2031-03-03'})
+        quotes = {row['title']: row['quote']['total'] for row in response.data['results']}
+        self.assertEqual(quotes, {'Tower': '250.00', 'Barn': '80.00'})
+        self.assertNotIn('quote', self.client.get('/api/listings/').data['results'][0])
+
+    def test_bookings_are_priced_from_the_database(self):
+        self.assertEqual(self.quote('2031-03-05', '2031-03-07').data['total'], '200.00')
+        # A price change the cached rate table has not seen (no signal is sent)
+        Listing.objects.filter(pk=self.listing.pk).update(price_per_night=Decimal('90.00'))
+        self.assertEqual(self.quote('2031-03-05', '2031-03-07').data['total'], '200.00')
+        booking = create_booking(self.listing, self.guest, date(2031, 3, 5), date(2031, 3, 7))
+        self.assertEqual(booking.total_price, Decimal('180.00'))
+
+
+class GatewayRetryTests(GatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        overridden = override_settings(CHAPA_MAX_RETRIES=2, CHAPA_RETRY_BACKOFF=0, CHAPA_MAX_RETRY_AFTER=0.2)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        reset_session()
+        self.gateway.add_transaction('tx-1')
+
+    def test_verification_is_retried(self):
+        self.gateway.fail_next(2)
+        result = ChapaService().verify_payment('tx-1')
+        self.assertTrue(result['success'])
+        self.assertEqual(self.gateway.requests, 3)
+
+    def test_retries_give_up(self):
+        self.gateway.fail_next(5)
+        result = ChapaService().verify_payment('tx-1')
+        self.assertFalse(result['success'])
+        self.assertEqual(self.gateway.requests, 3)
+
+    def test_retry_after_is_capped(self):
+        self.gateway.fail_next(2, retry_after=30)
+        started = time.monotonic()
+        result = ChapaService().verify_payment('tx-1')
+        elapsed = time.monotonic() - started
+        self.assertTrue(result['success'])
+        self.assertEqual(self.gateway.requests, 3)
+        self.assertGreaterEqual(elapsed, 0.4)
+        self.assertLess(elapsed, 5)
+
+    def test_initialization_is_not_retried(self):
+        self.gateway.fail_next(1)
+        payment = self.make_payment()
+        result = ChapaService().initiate_payment(
+            payment.amount, 'guest@example.com', 'Guest', 'Tester', str(payment.transaction_id), 'https://example.com/',
+        )
+        self.assertFalse(result['success'])
+        self.assertEqual(self.gateway.requests, 1)
+
+
+class PaymentInitiationTests(GatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.guest = make_user('guest')
+        start = date.today() + timedelta(days=30)
+        listing = make_listing(make_user('host', role='host'), 'Tower')
+        self.booking = create_booking(listing, self.guest, start, start + timedelta(days=2))
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def test_synchronous_initiation(self):
+        response = self.client.post('/api/payments/', {'booking_id': str(self.booking.pk)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        payment = Payment.objects.get(booking=self.booking)
+        self.assertEqual(response.data['checkout_url'], f'{self.gateway.base_url}/checkout/{payment.transaction_id}')
+        self.assertEqual(payment.checkout_url, response.data['checkout_url'])
+
+    def test_async_initiation_is_polled(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                '/api/payments/', {'booking_id': str(self.booking.pk)}, format='json', HTTP_PREFER='respond-async',
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response['Location'], response.data['status_url'])
+        self.assertEqual(self.gateway.requests, 0)
+
+        poll = self.client.get(response['Location'])
+        self.assertEqual(poll.status_code, 202)
+        self.assertEqual(poll['Retry-After'], '1')
+        self.assertFalse(poll.data['ready'])
+
+        # The task is queued once the payment row is committed; run it here as a worker would
+        self.assertEqual(len(callbacks), 1)
+        payment = Payment.objects.get(booking=self.booking)
+        initiate_payment.apply(args=[str(payment.transaction_id), 'https://example.com/'])
+        poll = self.client.get(response['Location'])
+        self.assertEqual(poll.status_code, 200)
+        self.assertTrue(poll.data['ready'])
+        self.assertEqual(poll.data['checkout_url'], f'{self.gateway.base_url}/checkout/{payment.transaction_id}')
+        self.assertNotIn('Retry-After', poll)
+
+    @override_settings(PAYMENT_INITIATION_ASYNC=True)
+    def test_async_by_default(self):
+        with self.captureOnCommitCallbacks():
+            response = self.client.post('/api/payments/', {'booking_id': str(self.booking.pk)}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.booking.payment.delete()
+        response = self.client.post('/api/payments/?async=false', {'booking_id': str(self.booking.pk)}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def retry(self, payment):
+        return self.client.post(f'/api/payments/{payment.pk}/retry_payment/')
+
+    def test_retry_refused_while_the_checkout_is_open(self):
+        payment = new_payment(self.booking)
+        self.gateway.add_transaction(payment.chapa_reference, status='pending')
+        response = self.retry(payment)
+        self.assertEqual(response.status_code, 409)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')
+
+    def test_retry_refused_when_paid(self):
+        payment = new_payment(self.booking)
+        self.gateway.add_transaction(payment.chapa_reference, status='success')
+        self.assertEqual(self.retry(payment).status_code, 409)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertEqual(self.retry(payment).status_code, 409)
+
+    def test_retry_when_the_gateway_is_down(self):
+        payment = new_payment(self.booking)
+        self.gateway.fail_next(1)
+        self.assertEqual(self.retry(payment).status_code, 503)
+
+    def test_retry_after_a_failed_transaction(self):
+        payment = new_payment(self.booking)
+        first_reference = payment.chapa_reference
+        self.gateway.add_transaction(first_reference, status='failed')
+        response = self.retry(payment)
+        self.assertEqual(response.status_code, 200)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')
+        self.assertEqual(payment.previous_references, [first_reference])
+        self.assertNotEqual(payment.chapa_reference, first_reference)
+        self.assertEqual(response.data['checkout_url'], payment.checkout_url)
+        self.assertIn(payment.chapa_reference, self.gateway.transactions)
+
+
+@skipIf(async_chapa.httpx is None, 'httpx is not installed')
+class AsyncPaymentViewTests(GatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.guest = make_user('guest')
+        start = date.today() + timedelta(days=30)
+        listing = make_listing(make_user('host', role='host'), 'Tower')
+        self.booking = create_booking(listing, self.guest, start, start + timedelta(days=2))
+        self.pending = self.make_payment()
+        self.auth = self.basic_auth(self.guest)
+
+    def basic_auth(self, user):
+        credentials = base64.b64encode(f'{user.username}:test-password'.encode()).decode()
+        return {'Authorization': f'Basic {credentials}'}
+
+    async def create(self, body, headers=None):
+        response = await self.async_client.post(
+            '/api/async/payments/', body, content_type='application/json', headers=headers,
+        )
+        await async_chapa.close_async_client()
+        return response
+
+    async def test_create_payment(self):
+        response = await self.create({'booking_id': str(self.booking.pk)}, headers=self.auth)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        payment = await Payment.objects.aget(booking=self.booking)
+        self.assertEqual(data['checkout_url'], f'{self.gateway.base_url}/checkout/{payment.transaction_id}')
+        self.assertEqual(payment.checkout_url, data['checkout_url'])
+        self.assertEqual(data['payment']['transaction_id'], str(payment.transaction_id))
+
+    async def test_gateway_failure(self):
+        self.gateway.fail_next(1)
+        response = await self.create({'booking_id': str(self.booking.pk)}, headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        payment = await Payment.objects.aget(booking=self.booking)
+        self.assertEqual(payment.status, 'failed')
+        self.assertEqual(response.json()['transaction_id'], str(payment.transaction_id))
+
+    async def test_request_errors(self):
+        response = await self.create({'booking_id': str(self.booking.pk)})
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response['WWW-Authenticate'].startswith('Basic'))
+        response = await self.create('{"booking_id": ', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+        response = await self.create({'booking_id': str(uuid.uuid4())}, headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('booking_id', response.json())
+        response = await self.async_client.get('/api/async/payments/', headers=self.auth)
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(self.gateway.requests, 0)
+        self.assertFalse(await Payment.objects.filter(booking=self.booking).aexists())
+
+    async def test_payment_status_is_verified(self):
+        self.gateway.add_transaction(self.pending.chapa_reference, status='success')
+        auth = self.basic_auth(await User.objects.aget(pk=self.pending.booking.user_id))
+        path = '/api/async/payments/status/'
+        response = await self.async_client.get(path, {'transaction_id': str(self.pending.pk)}, headers=auth)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(self.gateway.requests, 0)
+
+        params = {'transaction_id': str(self.pending.pk), 'verify': 'true'}
+        response = await self.async_client.get(path, params, headers=auth)
+        await async_chapa.close_async_client()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'completed')
+        self.assertEqual((await Payment.objects.aget(pk=self.pending.pk)).status, 'completed')
+
+        response = await self.async_client.get(path, {'transaction_id': str(self.pending.pk)}, headers=self.auth)
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get(path, headers=auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        # Pairs of equal prices, so the primary key has to break the ties
+        for i in range(7):
+            make_listing(self.host, f'Listing {i}', price=f'{50 + i // 2}.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def walk(self, url):
+        titles = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            titles += [listing['title'] for listing in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return titles, pages
+
+    def test_pages_cover_every_row_once_in_order(self):
+        titles, pages = self.walk('/api/listings/?page_size=2&ordering=price_per_night')
+        self.assertEqual(pages, 4)
+        self.assertEqual(sorted(titles), sorted(Listing.objects.values_list('title', flat=True)))
+        expected = list(Listing.objects.order_by('price_per_night', 'pk').values_list('title', flat=True))
+        self.assertEqual(titles, expected)
+
+    def test_rows_inserted_while_paging_do_not_shift_pages(self):
+        first = self.client.get('/api/listings/?page_size=3').data
+        # Newer than every listing, so it sorts before the cursor of the default -created_at ordering
+        make_listing(self.host, 'Inserted')
+        rest, _ = self.walk(first['next'])
+        titles = [listing['title'] for listing in first['results']] + rest
+        self.assertEqual(len(titles), 7)
+        self.assertNotIn('Inserted', titles)
+
+    def test_previous_link_returns_the_previous_page(self):
+        first = self.client.get('/api/listings/?page_size=3&ordering=price_per_night').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+
+    def test_cursor_of_another_ordering_is_rejected(self):
+        cursor = self.client.get('/api/listings/?page_size=2&ordering=price_per_night').data['next']
+        query = cursor.split('?', 1)[1].replace('ordering=price_per_night', 'ordering=-created_at')
+        self.assertEqual(self.client.get(f'/api/listings/?{query}').status_code, 404)
+
+
+class BookingConflictTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Cabin')
+        self.day = date.today() + timedelta(days=30)
+        self.booking = create_booking(self.listing, self.guest, self.day, self.day + timedelta(days=3))
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def book(self, start, nights):
+        return self.client.post(f'/api/listings/{self.listing.pk}/create_booking/', {
+            'start_date': (self.day + timedelta(days=start)).isoformat(),
+            'end_date': (self.day + timedelta(days=start + nights)).isoformat(),
+        }, format='json')
+
+    def test_overlapping_nights_are_rejected_with_409(self):
+        response = self.book(2, 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['conflicting_nights'], [(self.day + timedelta(days=2)).isoformat()])
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_back_to_back_stays_do_not_conflict(self):
+        # Check-out day of one stay is the check-in day of the next
+        self.assertEqual(self.book(3, 2).status_code, 201)
+        self.assertEqual(self.book(-2, 2).status_code, 201)
+        self.assertEqual(BookedNight.objects.filter(listing=self.listing).count(), 7)
+
+    def test_reschedule_ignores_own_nights_and_rejects_taken_ones(self):
+        other = create_booking(self.listing, self.guest, self.day + timedelta(days=5), self.day + timedelta(days=7))
+        reschedule_booking(self.booking, self.day + timedelta(days=1), self.day + timedelta(days=4))
+        with self.assertRaises(BookingConflict) as raised:
+            reschedule_booking(other, self.day + timedelta(days=3), self.day + timedelta(days=6))
+        self.assertEqual(raised.exception.nights, [self.day + timedelta(days=3)])
+        response = self.client.post(f'/api/bookings/{other.pk}/reschedule/', {
+            'start_date': self.day.isoformat(), 'end_date': (self.day + timedelta(days=2)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+        other.refresh_from_db()
+        self.assertEqual(other.start_date, self.day + timedelta(days=5))
+
+
+# Needs row locks (MySQL, PostgreSQL); SQLite's in-memory test database locks whole tables without waiting
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentBookingTests(TransactionTestCase):
+    def test_only_one_of_many_concurrent_requests_for_the_same_nights_wins(self):
+        host = make_user('host', role='host')
+        listing = make_listing(host, 'Villa')
+        guests = [make_user(f'guest{i}') for i in range(8)]
+        start = date.today() + timedelta(days=30)
+
+        def attempt(guest):
+            try:
+                create_booking(listing, guest, start, start + timedelta(days=2))
+                return 'booked'
+            except BookingConflict:
+                return 'conflict'
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(guests)) as pool:
+            outcomes = list(pool.map(attempt, guests))
+        self.assertEqual(sorted(outcomes), ['booked'] + ['conflict'] * (len(guests) - 1))
+        self.assertEqual(Booking.objects.filter(listing=listing).count(), 1)
+        self.assertEqual(BookedNight.objects.filter(listing=listing).count(), 2)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host', role='host')
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, 'Cottage')
+        long_ago = date.today() - timedelta(days=400)
+        self.settled = create_booking(self.listing, self.guest, long_ago, long_ago + timedelta(days=2))
+        Payment.objects.create(
+            booking=self.settled, amount=self.settled.total_price, status='completed', chapa_reference='tx-2',
+            previous_references=['tx-1'],
+        )
+        self.unpaid = create_booking(self.listing, self.guest, long_ago + timedelta(days=5), long_ago + timedelta(days=7))
+        self.pending = create_booking(self.listing, self.guest, long_ago + timedelta(days=10), long_ago + timedelta(days=12))
+        Payment.objects.create(booking=self.pending, amount=self.pending.total_price, status='pending')
+        self.recent = create_booking(self.listing, self.guest, date.today(), date.today() + timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+
+    def test_settled_old_bookings_round_trip_through_the_archive(self):
+        before = self.client.get(f'/api/bookings/{self.settled.pk}/').data
+        payment_before = self.client.get(f'/api/payments/{self.settled.payment.pk}/').data
+
+        self.assertEqual(archive_bookings(days=365), (2, 1))
+
+        self.assertFalse(Booking.objects.filter(pk__in=[self.settled.pk, self.unpaid.pk]).exists())
+        self.assertFalse(BookedNight.objects.filter(booking_id=self.settled.pk).exists())
+        self.assertEqual(ArchivedBooking.objects.count(), 2)
+        archived_payment = ArchivedPayment.objects.get()
+        self.assertEqual(archived_payment.chapa_reference, 'tx-2')
+        self.assertEqual(archived_payment.previous_references, ['tx-1'])
+        self.assertEqual(self.client.get(f'/api/bookings/{self.settled.pk}/').status_code, 404)
+
+        after = self.client.get(f'/api/bookings/{self.settled.pk}/?include_archived=true').data
+        self.assertIsNotNone(after.pop('archived_at'))
+        self.assertEqual(after, before)
+        payment_after = self.client.get(f'/api/payments/{self.settled.payment.pk}/?include_archived=true').data
+        self.assertIsNotNone(payment_after.pop('archived_at'))
+        self.assertEqual(payment_after, payment_before)
+
+    def test_pending_payments_and_recent_bookings_stay(self):
+        archive_bookings(days=365)
+        self.assertEqual(
+            set(Booking.objects.values_list('pk', flat=True)), {self.pending.pk, self.recent.pk},
+        )
+        # Archiving again finds nothing new
+        self.assertEqual(archive_bookings(days=365), (0, 0))
+
+    def test_archived_bookings_are_listed_only_on_request(self):
+        archive_bookings(days=365)
+        live = self.client.get('/api/bookings/my_bookings/').data['results']
+        archived = self.client.get('/api/bookings/my_bookings/?include_archived=true').data['results']
+        self.assertEqual({booking['id'] for booking in live}, {str(self.pending.pk), str(self.recent.pk)})
+        self.assertEqual({booking['id'] for booking in archived}, {str(self.settled.pk), str(self.unpaid.pk)})
+
+
+class PaymentTransitionTests(SimpleTestCase):
+    def test_transition_table(self):
+        cases = [
+            ('pending', 'success', 'completed'),
+            ('failed', 'success', 'completed'),
+            ('completed', 'success', None),
+            ('pending', 'failed', 'failed'),
+            ('failed', 'failed', None),
+            ('completed', 'failed', None),
+            ('pending', 'cancelled', 'failed'),
+            ('completed', 'cancelled', None),
+            ('pending', 'pending', None),
+            ('pending', None, None),
+        ]
+        for current, gateway_status, expected in cases:
+            with self.subTest(current=current, gateway_status=gateway_status):
+                self.assertEqual(next_status(current, gateway_status), expected)
+
+
+class WebhookTests(GatewayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = self.make_payment()
+        self.tx_ref = self.payment.chapa_reference
+        self.client = APIClient()
+
+    def deliver(self, tx_ref, event='charge.success'):
+        # Returns the response and the number of events queued on commit
+        with self.captureOnCommitCallbacks() as queued:
+            response = self.client.post('/api/chapa-webhook/', {'tx_ref': tx_ref, 'event': event}, format='json')
+        return response, len(queued)
+
+    def process(self, tx_ref, event='charge.success'):
+        event, _ = record_event({'tx_ref': tx_ref, 'event': event})
+        return process_event(event.pk), event
+
+    def test_duplicate_deliveries_are_recorded_and_queued_once(self):
+        self.gateway.add_transaction(self.tx_ref)
+        response, queued = self.deliver(self.tx_ref)
+        self.assertEqual((response.status_code, response.data['status'], queued), (200, 'accepted', 1))
+        event_id = response.data['event_id']
+        self.assertEqual(process_event(event_id), 'processed')
+
+        response, queued = self.deliver(self.tx_ref)
+        self.assertEqual((response.data['status'], response.data['requeued'], queued), ('duplicate', False, 0))
+        self.assertEqual(response.data['event_id'], event_id)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_duplicate_of_an_event_that_never_got_through_is_queued_again(self):
+        self.gateway.add_transaction(self.tx_ref)
+        response, _ = self.deliver(self.tx_ref)
+        fail_event(response.data['event_id'], 'Gateway unavailable')
+        response, queued = self.deliver(self.tx_ref)
+        self.assertEqual((response.data['requeued'], queued), (True, 1))
+        self.assertEqual(process_event(response.data['event_id']), 'processed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+
+    def test_payload_is_not_trusted(self):
+        self.gateway.add_transaction(self.tx_ref, status='failed')
+        self.assertEqual(self.process(self.tx_ref, 'charge.success')[0], 'processed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'failed')
+
+    def test_late_events_do_not_undo_a_completed_payment(self):
+        self.gateway.add_transaction(self.tx_ref, status='success')
+        self.assertEqual(self.process(self.tx_ref, 'charge.success')[0], 'processed')
+        self.gateway.add_transaction(self.tx_ref, status='failed')
+        status, event = self.process(self.tx_ref, 'charge.failed')
+        self.assertEqual(status, 'ignored')
+        event.refresh_from_db()
+        self.assertEqual(event.error, 'Payment already completed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        # Processing an event again does nothing
+        self.assertEqual(process_event(event.pk), 'ignored')
+
+    def test_late_success_completes_a_failed_payment(self):
+        self.gateway.add_transaction(self.tx_ref, status='failed')
+        self.assertEqual(self.process(self.tx_ref, 'charge.failed')[0], 'processed')
+        status, _ = self.process(self.tx_ref, 'charge.failed.redelivered')
+        self.assertEqual(status, 'ignored')
+        self.gateway.add_transaction(self.tx_ref, status='success')
+        self.assertEqual(self.process(self.tx_ref, 'charge.success')[0], 'processed')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertIsNotNone(self.payment.paid_at)
+
+    def test_superseded_transaction_completes_the_payment_when_paid(self):
+        reset_for_retry(self.payment)
+        self.gateway.add_transaction(self.tx_ref, status='success')
+        self.assertEqual(self.process(self.tx_ref)[0], 'processed')
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.chapa_reference), ('completed', self.tx_ref))
+
+    def test_failure_of_a_superseded_transaction_is_ignored(self):
+        reset_for_retry(self.payment)
+        self.gateway.add_transaction(self.tx_ref, status='failed')
+        status, event = self.process(self.tx_ref, 'charge.failed')
+        self.assertEqual(status, 'ignored')
+        event.refresh_from_db()
+        self.assertIn('superseded', event.error)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+
+    def test_gateway_errors_leave_the_event_to_be_retried(self):
+        self.gateway.add_transaction(self.tx_ref)
+        self.gateway.fail_next()
+        event, _ = record_event({'tx_ref': self.tx_ref, 'event': 'charge.success'})
+        with self.assertRaises(VerificationError):
+            process_event(event.pk)
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('received', 1))
+        self.assertEqual(process_event(event.pk), 'processed')
+
+    def test_unknown_transactions_are_ignored(self):
+        self.assertEqual(self.process(self.tx_ref)[0], 'ignored')
+        self.assertEqual(self.process('not-a-payment')[0], 'ignored')
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')
+
+    def test_bodies_that_are_not_objects_are_rejected(self):
+        for body in ([], ['tx_ref'], 'tx_ref', 1, None):
+            with self.captureOnCommitCallbacks() as queued:
+                response = self.client.post('/api/chapa-webhook/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(queued, [])
+        response, queued = self.deliver('')
+        self.assertEqual((response.status_code, queued), (400, 0))
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+class ReconciliationTests(GatewayTestCase):
+    def stale(self, *payments, hours=2):
+        Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(
+            updated_at=timezone.now() - timedelta(hours=hours),
+        )
+
+    def reconcile(self, **kwargs):
+        return reconcile_payments(minutes=30, batch_size=2, workers=4, abandon_minutes=24 * 60, **kwargs)
+
+    def statuses(self, *payments):
+        return [Payment.objects.get(pk=payment.pk).status for payment in payments]
+
+    def test_stale_pending_payments_follow_the_gateway(self):
+        paid, failed, cancelled, open_ = (self.make_payment(days) for days in (30, 40, 50, 60))
+        for payment, status in ((paid, 'success'), (failed, 'failed'), (cancelled, 'cancelled'), (open_, 'pending')):
+            self.gateway.add_transaction(payment.chapa_reference, status=status)
+        fresh = self.make_payment(70)
+        self.gateway.add_transaction(fresh.chapa_reference)
+        self.stale(paid, failed, cancelled, open_)
+
+        stats = self.reconcile()
+
+        self.assertEqual(
+            {key: stats[key] for key in ('checked', 'completed', 'failed', 'unchanged')},
+            {'checked': 4, 'completed': 1, 'failed': 2, 'unchanged': 1},
+        )
+        self.assertEqual(self.statuses(paid, failed, cancelled, open_), ['completed', 'failed', 'failed', 'pending'])
+        self.assertEqual(self.statuses(fresh), ['pending'])
+        self.assertIsNotNone(Payment.objects.get(pk=paid.pk).paid_at)
+
+    def test_paid_transaction_replaced_by_a_retry_completes_the_payment(self):
+        payment = self.make_payment()
+        first_ref = payment.chapa_reference
+        reset_for_retry(payment)
+        self.gateway.add_transaction(first_ref, status='success')
+        self.gateway.add_transaction(payment.chapa_reference, status='pending')
+        self.stale(payment)
+
+        stats = self.reconcile()
+
+        self.assertEqual((stats['completed'], stats['transactions']), (1, 2))
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.chapa_reference), ('completed', first_ref))
+
+    def test_transactions_unknown_to_the_gateway_fail_once_abandoned(self):
+        young, old = self.make_payment(30), self.make_payment(40)
+        self.stale(young)
+        self.stale(old, hours=25)
+
+        stats = self.reconcile()
+
+        self.assertEqual((stats['not_found'], stats['failed']), (1, 1))
+        self.assertEqual(self.statuses(young, old), ['pending', 'failed'])
+
+    def test_gateway_errors_leave_payments_pending(self):
+        payment = self.make_payment()
+        self.gateway.add_transaction(payment.chapa_reference, status='failed')
+        self.stale(payment, hours=25)
+        self.gateway.fail_next()
+
+        self.assertEqual(self.reconcile()['errors'], 1)
+        self.assertEqual(self.statuses(payment), ['pending'])
+        # The next run gets through
+        self.assertEqual(self.reconcile()['failed'], 1)
+
+
+class RouteQueryBudgetTests(TestCase):
+    def test_every_route_answers_within_its_query_budget(self):
+        # Same checks as `manage.py check_query_budgets`: status, budget and N+1 of every route
+        failures = {result.route: result.problems for result in run_route_checks() if result.problems}
+        self.assertEqual(failures, {})
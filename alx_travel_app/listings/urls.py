@@ -1,5 +1,6 @@
 from django.urls import path
 from .views import ListingViewSet, BookingViewSet, PaymentViewSet, ChapaWebhookView, PaymentSuccessView
+from . import async_views
 from rest_framework.routers import DefaultRouter
 from django.urls import include
 
@@ -12,4 +13,7 @@ urlpatterns = [
     path('', include(router.urls)),
     path('chapa-webhook/', ChapaWebhookView.as_view(), name='chapa-webhook'),
     path('payment-success/', PaymentSuccessView.as_view(), name='payment-success'),
+    # ASGI versions of payment creation and status (listings/async_views.py)
+    path('async/payments/', async_views.create_payment, name='async-payment-create'),
+    path('async/payments/status/', async_views.payment_status, name='async-payment-status'),
 ]
\ No newline at end of file
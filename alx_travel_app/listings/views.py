@@ -1,58 +1,294 @@
 from django.shortcuts import render, get_object_or_404
 from rest_framework import viewsets, status
-from .models import Listing, Booking, User, Payment
+from .models import Listing, Booking, User, Payment, Review, ArchivedBooking, ArchivedPayment, AMENITY_BITS, amenity_mask
 from rest_framework.response import Response
-from .serializers import ListingSerializer, BookingSerializer, PaymentSerializer, PaymentInitiationSerializer
-from .tasks import send_booking_confirmation
+from .serializers import ListingSerializer, BookingSerializer, PaymentSerializer, PaymentInitiationSerializer, ReviewSerializer, AvailabilityCheckSerializer, ArchivedBookingSerializer, ArchivedPaymentSerializer
+from .tasks import send_booking_confirmation, initiate_payment as initiate_payment_task, process_webhook_event as process_webhook_event_task
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action, api_view, permission_classes
-from django.db.models import Avg
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.conf import settings
 from django.urls import reverse
 from .chapa_service import ChapaService
+from .availability import available_listing_ids, filter_available
+from .search import ListingSearchFilter
+from .facets import listing_facets
+from .caching import filter_signature, get_version, versioned_caching_enabled
+from .fragments import listing_fragments, serialize_listings
+from .conditional import ConditionalGetMixin
+from .fieldsets import FieldSet, listing_relations, booking_relations, payment_relations
+from .fastpath import booking_values
+from .renderers import StreamingJSONResponse
+from .exports import EXPORT_FORMATS, EXPORT_CONTENT_TYPES, export_lines, parse_boundary
+from .imports import IMPORT_BATCH_SIZE, import_listings
+from .booking_engine import create_booking, reschedule_booking
+from .payments import CHECKOUT_RETRY_AFTER, apply_verification, ensure_retryable, initiate_with_gateway, new_payment, reset_for_retry
+from .webhooks import VerificationError, process_event, record_event
+from .pricing import MAX_QUOTE_NIGHTS, price_page, rate_table
+from .calendar import CALENDAR_ENCODINGS, MAX_CALENDAR_NIGHTS, calendar_payload, listing_occupancy, month_window
+from django.utils.dateparse import parse_date
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .parsers import NDJSONParser
+from django.http import Http404, StreamingHttpResponse
+from rest_framework.generics import get_object_or_404 as get_object_or_404_drf
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
+from rest_framework.exceptions import NotFound, ValidationError
+from collections.abc import Mapping
 import logging
 import uuid
 
 logger = logging.getLogger('chapa_payment')
 
+
+def query_flag(request, name):
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def wants_stream(request):
+    # ?stream=true returns every row as one streamed JSON array instead of a page
+    return query_flag(request, 'stream')
+
+
+def wants_async(request):
+    # Payment initiation in the background: `Prefer: respond-async` (RFC 7240) or ?async=true,
+    # by default with PAYMENT_INITIATION_ASYNC; `Prefer: respond-sync` or ?async=false opt out
+    prefer = request.headers.get('Prefer', '').lower()
+    if 'respond-async' in prefer:
+        return True
+    if 'respond-sync' in prefer:
+        return False
+    if 'async' in request.query_params:
+        return query_flag(request, 'async')
+    return settings.PAYMENT_INITIATION_ASYNC
+
+
+def enqueue_initiation(payment, return_url):
+    # The task is sent once the payment row is committed; without a broker the gateway is called inline
+    def send():
+        try:
+            initiate_payment_task.delay(str(payment.transaction_id), return_url)
+        except Exception as e:
+            logger.error("💥 Failed to queue payment initiation, initiating inline", extra={
+                'transaction_id': str(payment.transaction_id),
+                'error': str(e),
+                'action': 'payment_initiation_enqueue_failed'
+            })
+            initiate_with_gateway(payment, return_url)
+    transaction.on_commit(send)
+
+
+def enqueue_webhook(event):
+    # Same as enqueue_initiation: sent on commit, processed inline when the broker is unreachable
+    def send():
+        try:
+            process_webhook_event_task.delay(event.pk)
+        except Exception as e:
+            logger.error("💥 Failed to queue webhook event, processing inline", extra={
+                'event_id': event.pk,
+                'error': str(e),
+                'action': 'webhook_enqueue_failed'
+            })
+            try:
+                process_event(event.pk)
+            except VerificationError as e:
+                # The event stays unprocessed; the gateway's next delivery of it queues it again
+                logger.warning("⚠️ Webhook event could not be verified inline", extra={
+                    'event_id': event.pk,
+                    'error': str(e),
+                    'action': 'webhook_inline_verification_failed'
+                })
+    transaction.on_commit(send)
+
+
+def find_status_payment(request):
+    """
+    Payment of GET .../payments/status/ (?transaction_id= or ?booking_id=), shared with the ASGI view.
+    Returns (payment, serializer class, None), or (None, None, (error body, HTTP status)).
+    """
+    transaction_id = request.query_params.get('transaction_id')
+    booking_id = request.query_params.get('booking_id')
+    
+    logger.info("Payment status check", extra={
+        'transaction_id': transaction_id,
+        'booking_id': booking_id,
+        'action': 'payment_status_check'
+    })
+    
+    if not transaction_id and not booking_id:
+        return None, None, ({'error': 'Either transaction_id or booking_id is required.'}, status.HTTP_400_BAD_REQUEST)
+    
+    if booking_id and not transaction_id:
+        # Convert string booking_id to UUID
+        try:
+            booking_id = uuid.UUID(booking_id)
+        except ValueError:
+            return None, None, ({'error': 'Invalid booking ID format.'}, status.HTTP_400_BAD_REQUEST)
+
+    def lookup(payments):
+        # The booking and its user are needed for the permission check and the serializer
+        payments = payments.select_related('booking__user', 'booking__listing')
+        if transaction_id:
+            return payments.get(transaction_id=transaction_id)
+        return payments.get(booking_id=booking_id)
+
+    try:
+        serializer_class = PaymentSerializer
+        try:
+            payment = lookup(Payment.objects)
+        except Payment.DoesNotExist:
+            # Settled payments of old bookings are only searched with ?include_archived=true
+            if not wants_archived(request):
+                raise
+            payment = lookup(ArchivedPayment.objects)
+            serializer_class = ArchivedPaymentSerializer
+    except (Payment.DoesNotExist, ArchivedPayment.DoesNotExist, Booking.DoesNotExist, DjangoValidationError):
+        return None, None, ({'error': 'Payment not found.'}, status.HTTP_404_NOT_FOUND)
+    
+    # Check permissions
+    if payment.booking.user != request.user and not request.user.is_staff:
+        return None, None, ({'error': 'You do not have permission to view this payment.'}, status.HTTP_403_FORBIDDEN)
+    return payment, serializer_class, None
+
+
+def wants_verification(request, payment, serializer_class):
+    # ?verify=true asks the gateway about a live payment that is still pending on a transaction
+    return (
+        query_flag(request, 'verify') and serializer_class is PaymentSerializer
+        and payment.status == 'pending' and bool(payment.chapa_reference)
+    )
+
+
+def wants_archived(request):
+    # Archived bookings and payments (listings/archive.py) are only looked at with ?include_archived=true
+    return query_flag(request, 'include_archived')
+
+
+def stay_window(query_params):
+    # (start_date, end_date) of ?start_date=&end_date=, or None when they are missing or not a valid stay
+    try:
+        start_date = parse_date(query_params.get('start_date', ''))
+        end_date = parse_date(query_params.get('end_date', ''))
+    except ValueError:
+        return None
+    if start_date is None or end_date is None or end_date <= start_date:
+        return None
+    return start_date, end_date
+
+
+def load_booking(pk):
+    # A booking with everything BookingSerializer renders, in one query
+    return Booking.objects.select_related('user', 'listing__host', 'payment').get(pk=pk)
+
+
+def export_response(request, name):
+    """
+    Stream a staff export (?export_format=ndjson|csv, optional ?since= and ?until= on created_at)
+    """
+    export_format = request.query_params.get('export_format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        raise ValidationError({'export_format': f'Choose one of: {", ".join(EXPORT_FORMATS)}'})
+    try:
+        since = parse_boundary(request.query_params.get('since'))
+        until = parse_boundary(request.query_params.get('until'))
+    except ValueError as e:
+        raise ValidationError({'detail': str(e)})
+
+    logger.info(f"📤 Exporting {name}", extra={
+        'user': request.user.email,
+        'export_format': export_format,
+        'action': 'export_records'
+    })
+    response = StreamingHttpResponse(
+        export_lines(name, export_format, since, until),
+        content_type=EXPORT_CONTENT_TYPES[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{name}.{export_format}"'
+    return response
+
+
 # Create your views here.
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # Ensuring CRUD operations for Listing model
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # ?search= is answered from the inverted index in listings/search.py (title, description, address, amenities)
+    filter_backends = [DjangoFilterBackend, ListingSearchFilter, OrderingFilter]
     filterset_fields = ['property_type', 'price_per_night']
-    search_fields = ['title', 'description', 'address', 'amenities']
     ordering_fields = ['price_per_night', 'created_at']
 
     def get_queryset(self):
-        # filter the queryset to include related host and reviews for optimization
-        queryset = Listing.objects.select_related('host').prefetch_related('reviews').all()
+        # filter the queryset to include the related host for optimization
+        # (only when ?fields= / ?expand= actually render it)
+        select, prefetch = listing_relations(FieldSet.from_request(self.request))
+        queryset = Listing.objects.select_related(*select).prefetch_related(*prefetch).all()
         
         # filter by avalability if start_date and end_date are provided in query params
+        # (anti-join against the booked nights index, see listings/availability.py)
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
         if start_date and end_date:
-            queryset = queryset.exclude(
-                bookings__start_date__lt=end_date,
-                bookings__end_date__gt=start_date
-            )
+            queryset = filter_available(queryset, start_date, end_date)
+
+        # filter by amenities if amenities=wifi,pool is provided in query params (listing must have all of them:
+        # a bitwise AND of the stored mask keeps every requested bit)
+        amenities = self.request.query_params.get('amenities')
+        if amenities:
+            codes = [code.strip() for code in amenities.split(',') if code.strip()]
+            unknown = [code for code in codes if code not in AMENITY_BITS]
+            if unknown:
+                raise ValidationError({'amenities': f'Unknown amenities: {", ".join(unknown)}'})
+            if codes:
+                mask = amenity_mask(codes)
+                queryset = queryset.alias(amenity_match=F('amenity_mask').bitand(mask)).filter(amenity_match=mask)
         
         # filter by price range if min_price and max_price are provided in query params
         min_price = self.request.query_params.get('min_price')
         max_price = self.request.query_params.get('max_price')
         if min_price and max_price:
             queryset = queryset.filter(price_per_night__gte=min_price, price_per_night__lte=max_price)
-            queryset = queryset.annotate(average_rating=Avg('reviews__rating'))
+            # average_rating is kept up to date on the listing row, see listings/ratings.py
             queryset = queryset.order_by('-average_rating')
 
-        return queryset.distinct()
+        return queryset
+
+    def get_conditional_scopes(self, request):
+        # Availability filters also depend on bookings
+        # and carry quotes (listings/pricing.py)
+        if request.query_params.get('start_date') and request.query_params.get('end_date'):
+            return ('listings', 'bookings', 'pricing')
+        return ('listings',)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.list_from_fragments, *args, **kwargs)
+
+    def list_from_fragments(self, request, *args, **kwargs):
+        # Fragments hold the default representation; sparse or expanded requests are serialized directly
+        if not FieldSet.from_request(request).is_default:
+            return viewsets.ModelViewSet.list(self, request, *args, **kwargs)
+
+        # Page through plain listing rows, then assemble the response from cached serialized fragments
+        # (only cache misses are serialized, through the values-based fast path)
+        queryset = self.filter_queryset(self.get_queryset()).select_related(None).prefetch_related(None)
+        page = self.paginate_queryset(queryset)
+        listings = page if page is not None else list(queryset)
+        fragments = listing_fragments.render_pairs(listings, serialize_listings)
+        stay = stay_window(request.query_params)
+        if stay is None:
+            data = [fragment for _, fragment in fragments]
+        else:
+            # Dated searches price the stay for the whole page at once
+            quotes = price_page([pk for pk, _ in fragments], *stay)
+            data = [{**fragment, 'quote': quotes.get(pk)} for pk, fragment in fragments]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
 
     def perform_create(self, serializer):
         # Automatically set the host to the logged-in user when creating a listing
@@ -62,9 +298,117 @@ class ListingViewSet(viewsets.ModelViewSet):
     def bookings(self, request, pk=None):
         # Retrieve bookings for a specific listing
         listing = self.get_object()
-        bookings = listing.bookings.all()
-        serializer = BookingSerializer(bookings, many=True)
-        return Response(serializer.data)
+        select, prefetch = booking_relations(FieldSet.from_request(request))
+        bookings = listing.bookings.select_related(*select).prefetch_related(*prefetch)
+        page = self.paginate_queryset(bookings)
+        serializer = BookingSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def reviews(self, request, pk=None):
+        # Page through the reviews of a listing (newest first) together with its rating histogram
+        listing = get_object_or_404(Listing.objects.only('id', 'average_rating', 'review_count'), pk=pk)
+        reviews = Review.objects.filter(listing=listing).select_related('user').order_by('-created_at')
+        page = self.paginate_queryset(reviews)
+        serializer = ReviewSerializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+
+        histogram = {rating: 0 for rating in range(1, 6)}
+        for row in Review.objects.filter(listing=listing).order_by().values('rating').annotate(count=Count('id')):
+            histogram[row['rating']] = row['count']
+        response.data['average_rating'] = listing.average_rating
+        response.data['review_count'] = listing.review_count
+        response.data['histogram'] = histogram
+        return response
+
+    @action(detail=True, methods=['get'])
+    def calendar(self, request, pk=None):
+        # Compact occupancy calendar: ?month=YYYY-MM or ?start=YYYY-MM-DD&end=YYYY-MM-DD (end exclusive),
+        # as booked ranges (default) or as a per-night bitmap with ?encoding=bitmap
+        try:
+            listing_id = uuid.UUID(str(pk))
+        except ValueError:
+            raise NotFound()
+        params = request.query_params
+        encoding = params.get('encoding', 'ranges')
+        if encoding not in CALENDAR_ENCODINGS:
+            raise ValidationError({'encoding': f'Choose one of: {", ".join(CALENDAR_ENCODINGS)}'})
+        try:
+            if 'month' in params:
+                start_date, end_date = month_window(params['month'])
+            else:
+                start_date, end_date = parse_date(params.get('start', '')), parse_date(params.get('end', ''))
+        except ValueError:
+            start_date = end_date = None
+        if start_date is None or end_date is None:
+            raise ValidationError({'detail': 'Pass ?month=YYYY-MM or ?start=YYYY-MM-DD&end=YYYY-MM-DD.'})
+        if not 0 < (end_date - start_date).days <= MAX_CALENDAR_NIGHTS:
+            raise ValidationError({'end': f'The window must cover between 1 and {MAX_CALENDAR_NIGHTS} nights.'})
+
+        # Cached calendars belong to existing listings; the listing is only looked up on a cache miss
+        ranges = listing_occupancy(
+            listing_id, start_date, end_date, exists=Listing.objects.filter(pk=listing_id).exists,
+        )
+        if ranges is None:
+            raise NotFound()
+        return Response(calendar_payload(ranges, start_date, end_date, encoding))
+
+    @action(detail=True, methods=['get'])
+    def quote(self, request, pk=None):
+        # Price of a stay (?start_date=&end_date=, end exclusive) from the cached rate table of the listing
+        try:
+            listing_id = uuid.UUID(str(pk))
+        except ValueError:
+            raise NotFound()
+        stay = stay_window(request.query_params)
+        if stay is None:
+            raise ValidationError({'detail': 'Pass ?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD with end_date after start_date.'})
+        if (stay[1] - stay[0]).days > MAX_QUOTE_NIGHTS:
+            raise ValidationError({'end_date': f'A stay can last at most {MAX_QUOTE_NIGHTS} nights.'})
+        table = rate_table(listing_id)
+        if table is None:
+            raise NotFound()
+        return Response({'listing_id': listing_id, **table.quote(*stay)})
+
+    @action(detail=False, methods=['post'], url_path='availability')
+    def availability(self, request):
+        # Batch availability check: which of listing_ids are free for each of the requested date ranges,
+        # answered by a single query (one indexed NOT EXISTS per listing and range)
+        serializer = AvailabilityCheckSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ranges = [(stay['start_date'], stay['end_date']) for stay in serializer.validated_data['ranges']]
+        available, unknown = available_listing_ids(serializer.validated_data['listing_ids'], ranges)
+        return Response({
+            'ranges': [
+                {'start_date': start_date, 'end_date': end_date, 'available': listing_ids}
+                for (start_date, end_date), listing_ids in zip(ranges, available)
+            ],
+            'unknown': unknown,
+        })
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[NDJSONParser],
+            permission_classes=[IsAuthenticated])
+    def import_listings(self, request):
+        # Bulk import listings from an NDJSON body (one listing per line).
+        # Hosts import their own listings; staff may set host_id per row (defaults to themselves).
+        user = request.user
+        try:
+            batch_size = int(request.query_params.get('batch_size', IMPORT_BATCH_SIZE))
+        except ValueError:
+            batch_size = 0
+        if not 1 <= batch_size <= 5000:
+            raise ValidationError({'batch_size': 'Must be an integer between 1 and 5000.'})
+        result = import_listings(
+            request.data,
+            default_host=user,
+            restrict_to_host=None if user.is_staff else user,
+            batch_size=batch_size,
+        )
+        logger.info(f"📥 Imported {result.created} listings ({len(result.errors)} rejected)", extra={
+            'user': user.email,
+            'action': 'listing_import'
+        })
+        return Response(result.as_dict(), status=201 if result.created else 400)
 
     @action(detail=True, methods=['post'])
     def create_booking(self, request, pk=None):
@@ -72,22 +416,43 @@ class ListingViewSet(viewsets.ModelViewSet):
         listing = self.get_object()
         serializer = BookingSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(listing=listing, user=request.user)
+            # Raises BookingConflict (409) when a night is already taken
+            booking = create_booking(
+                listing, request.user, serializer.validated_data['start_date'], serializer.validated_data['end_date'],
+            )
+            serializer.instance = load_booking(booking.pk)
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
     
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        # Facet counts (property type, price bucket, amenity) for the current filters in one aggregate query
+        if not versioned_caching_enabled():
+            return Response(listing_facets(self.filter_queryset(self.get_queryset())))
+        cache_key = 'listing-facets:{}:{}:{}'.format(
+            get_version('listings'), get_version('bookings'), filter_signature(request.query_params)
+        )
+        facets = cache.get(cache_key)
+        if facets is None:
+            facets = listing_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(cache_key, facets, settings.LISTING_FACETS_CACHE_TIMEOUT)
+        return Response(facets)
+
     @action(detail=False, methods=['get'])
     def my_listings(self, request):
         # Retrieve listings for the logged-in user
         user = request.user
-        listings = Listing.objects.filter(host=user)
-        serializer = self.get_serializer(listings, many=True)
-        return Response(serializer.data)
+        listings = Listing.objects.filter(host=user).select_related('host')
+        page = self.paginate_queryset(listings)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # Ensuring CRUD operations for Booking model
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
+    # Bookings embed their listing, so listing changes count too
+    conditional_scopes = ('bookings', 'listings')
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['start_date', 'end_date', 'total_price']
     search_fields = ['listing__title', 'user__username']
@@ -96,9 +461,14 @@ class BookingViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # users can only see their own bookings unless they are staff
         user = self.request.user
-        queryset = Booking.objects.select_related('listing', 'user').all()
+        select, prefetch = booking_relations(FieldSet.from_request(self.request))
+        queryset = Booking.objects.select_related(*select).prefetch_related(*prefetch).all()
         if not user.is_staff:
-            queryset = queryset.filter(user=user)
+            if self.action == 'confirm':
+                # Hosts confirm the bookings made on their listings
+                queryset = queryset.filter(Q(user=user) | Q(listing__host=user))
+            else:
+                queryset = queryset.filter(user=user)
 
         # filter by date range if start_date and end_date are provided in query params
         start_date = self.request.query_params.get('start_date')
@@ -111,29 +481,112 @@ class BookingViewSet(viewsets.ModelViewSet):
         if listing_title:
             queryset = queryset.filter(listing__title__icontains=listing_title)
         return queryset.distinct()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.list_values, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not wants_archived(request):
+                raise
+        select, prefetch = booking_relations(FieldSet.from_request(request))
+        archived = ArchivedBooking.objects.select_related(*select).prefetch_related(*prefetch)
+        if not request.user.is_staff:
+            archived = archived.filter(user=request.user)
+        booking = get_object_or_404_drf(archived, pk=kwargs['pk'])
+        return Response(ArchivedBookingSerializer(booking, context=self.get_serializer_context()).data)
+
+    def archived_response(self, archived):
+        # ?include_archived=true on the booking lists pages through the archive instead of the live bookings
+        select, prefetch = booking_relations(FieldSet.from_request(self.request))
+        page = self.paginate_queryset(archived.select_related(*select).prefetch_related(*prefetch))
+        serializer = ArchivedBookingSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    def list_values(self, request, *args, **kwargs):
+        return self.values_response(self.filter_queryset(self.get_queryset()))
+
+    def values_response(self, queryset):
+        # Read-only fast path: page through plain booking rows, then render the page with one values query
+        # (see listings/fastpath.py; the output is identical to BookingSerializer). ?fields= and ?expand=
+        # change the output, so those requests go through BookingSerializer.
+        if not FieldSet.from_request(self.request).is_default:
+            return self.serializer_response(queryset)
+        queryset = queryset.select_related(None).prefetch_related(None)
+        page = self.paginate_queryset(queryset)
+        bookings = page if page is not None else list(queryset)
+        data = booking_values.serialize_pks(Booking.objects.all(), [booking.pk for booking in bookings])
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def serializer_response(self, queryset):
+        select, prefetch = booking_relations(FieldSet.from_request(self.request))
+        queryset = queryset.select_related(*select).prefetch_related(*prefetch)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
     
     def perform_create(self, serializer):
         # Automatically set the user to the logged-in user when creating a booking
-        serializer.save(user=self.request.user)
+        # (the booking engine locks the listing and raises BookingConflict (409) on overlapping nights)
+        listing = serializer.validated_data.get('listing')
+        if listing is None:
+            raise ValidationError({'listing_id': 'This field is required.'})
+        booking = create_booking(
+            listing, self.request.user, serializer.validated_data['start_date'], serializer.validated_data['end_date'],
+        )
+        serializer.instance = booking = load_booking(booking.pk)
         # Trigger email task asynchronously
         self.send_booking_confirmation_email_async(booking)
 
+    def perform_update(self, serializer):
+        # Date changes go through the booking engine like reschedule; bookings cannot move to another listing
+        booking = serializer.instance
+        listing = serializer.validated_data.get('listing')
+        if listing is not None and listing.pk != booking.listing_id:
+            raise ValidationError({'listing_id': 'A booking cannot be moved to another listing.'})
+        reschedule_booking(
+            booking,
+            serializer.validated_data.get('start_date', booking.start_date),
+            serializer.validated_data.get('end_date', booking.end_date),
+        )
+
     @action(detail=False, methods=['get'])
     def my_bookings(self, request):
+        return self.conditional_response(request, self.list_my_bookings)
+
+    def list_my_bookings(self, request):
         # Retrieve bookings for the logged-in user
         user = request.user
+        if wants_archived(request):
+            return self.archived_response(ArchivedBooking.objects.filter(user=user))
         bookings = Booking.objects.filter(user=user)
-        serializer = self.get_serializer(bookings, many=True)
-        return Response(serializer.data)
+        return self.values_response(bookings)
     
     @action(detail=False, methods=['get'])
     def host_bookings(self, request):
         # Retrieve bookings for listings owned by the logged-in host
         user = request.user
         listings = Listing.objects.filter(host=user)
+        if wants_archived(request):
+            return self.archived_response(ArchivedBooking.objects.filter(listing__in=listings))
         bookings = Booking.objects.filter(listing__in=listings)
-        serializer = self.get_serializer(bookings, many=True)
-        return Response(serializer.data)
+        if wants_stream(request) and FieldSet.from_request(request).is_default:
+            return StreamingJSONResponse(
+                bookings.only('pk', 'created_at'),
+                lambda batch: booking_values.serialize_pks(Booking.objects.all(), [booking.pk for booking in batch]),
+                ordering=['-created_at'],
+            )
+        return self.values_response(bookings)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        # Staff export of every booking with listing title and guest email
+        return export_response(request, 'bookings')
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -152,7 +605,11 @@ class BookingViewSet(viewsets.ModelViewSet):
             return Response({'error': 'You do not have permission to reschedule this booking.'}, status=403)
         serializer = BookingSerializer(booking, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            reschedule_booking(
+                booking,
+                serializer.validated_data.get('start_date', booking.start_date),
+                serializer.validated_data.get('end_date', booking.end_date),
+            )
             return Response(serializer.data)
         return Response(serializer.errors, status=400)
     
@@ -212,23 +669,60 @@ class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
-    lookup_field = 'id'  # Use UUID as lookup field
+    # The UUID primary key (transaction_id) is exposed as {id} in the URLs
+    lookup_field = 'pk'
+    lookup_url_kwarg = 'id'
     
     def get_queryset(self):
         """
         Users can only see payments for their own bookings unless they are staff
         """
         user = self.request.user
-        queryset = Payment.objects.select_related('booking', 'booking__user', 'booking__listing').all()
+        select, prefetch = payment_relations(FieldSet.from_request(self.request))
+        queryset = Payment.objects.select_related(*select).prefetch_related(*prefetch).all()
         
         if not user.is_staff:
             queryset = queryset.filter(booking__user=user)
         
         return queryset
+
+    def list(self, request, *args, **kwargs):
+        # Staff can stream every payment with ?stream=true instead of paging through them
+        if request.user.is_staff and wants_stream(request):
+            return StreamingJSONResponse(
+                self.filter_queryset(self.get_queryset()),
+                lambda batch: self.get_serializer(batch, many=True).data,
+                ordering=['-created_at'],
+            )
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        # Staff export of every payment with listing title and guest details
+        return export_response(request, 'payments')
+
+    def archived_payments(self):
+        select, prefetch = payment_relations(FieldSet.from_request(self.request))
+        archived = ArchivedPayment.objects.select_related(*select).prefetch_related(*prefetch)
+        if not self.request.user.is_staff:
+            archived = archived.filter(booking__user=self.request.user)
+        return archived
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not wants_archived(request):
+                raise
+        payment = get_object_or_404_drf(self.archived_payments(), pk=kwargs[self.lookup_url_kwarg])
+        return Response(ArchivedPaymentSerializer(payment, context=self.get_serializer_context()).data)
     
     def create(self, request, *args, **kwargs):
         """
         Create a payment for a booking - Updated for UUID
+        With `Prefer: respond-async` or ?async=true the gateway is called by a Celery task and the
+        answer is 202 Accepted with the URL to poll for the checkout URL (PAYMENT_INITIATION_ASYNC
+        makes this the default)
         """
         serializer = PaymentInitiationSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -236,8 +730,8 @@ class PaymentViewSet(viewsets.ModelViewSet):
         booking_id = serializer.validated_data['booking_id']
         
         try:
-            # Get the booking using UUID
-            booking = get_object_or_404(Booking, id=booking_id)
+            # Get the booking using UUID (with what the gateway call needs)
+            booking = get_object_or_404(Booking.objects.select_related('user', 'listing'), id=booking_id)
             
             logger.info("Processing payment for booking", extra={
                 'booking_id': str(booking_id),
@@ -245,42 +739,40 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 'action': 'payment_processing_start'
             })
             
-            # Generate unique transaction reference with UUID
-            transaction_id = f"txn_{uuid.uuid4().hex[:10]}_{booking_id.hex[:8]}"
-            
             # Prepare return URL
             return_url = request.build_absolute_uri(
                 reverse('payment-success')
             ) + f"?booking={booking_id}"
             
-            # Initialize Chapa service
-            chapa = ChapaService()
-            
-            # Get user details
-            user = booking.user
-            first_name = user.first_name or 'Customer'
-            last_name = user.last_name or 'User'
+            # The payment is recorded as pending first; its transaction_id is the gateway tx_ref
+            payment = new_payment(booking)
             
             # Log payment details
             logger.info("Payment details", extra={
                 'booking_id': str(booking_id),
                 'amount': float(booking.total_price),
-                'user_email': user.email,
-                'transaction_id': transaction_id,
+                'user_email': booking.user.email,
+                'transaction_id': str(payment.transaction_id),
                 'action': 'payment_details'
             })
             
+            if wants_async(request):
+                enqueue_initiation(payment, return_url)
+                status_url = request.build_absolute_uri(
+                    reverse('payment-checkout', kwargs={'id': payment.transaction_id})
+                )
+                response = Response({
+                    'success': True,
+                    'payment': PaymentSerializer(payment).data,
+                    'status_url': status_url,
+                    'message': 'Payment accepted. Poll the status URL for the checkout URL.'
+                }, status=status.HTTP_202_ACCEPTED)
+                response['Location'] = status_url
+                response['Retry-After'] = str(CHECKOUT_RETRY_AFTER)
+                return response
+            
             # Initiate payment with Chapa
-            payment_result = chapa.initiate_payment(
-                amount=float(booking.total_price),
-                email=user.email,
-                first_name=first_name,
-                last_name=last_name,
-                tx_ref=transaction_id,
-                return_url=return_url,
-                custom_title=f"Payment for {booking.listing.title}",
-                custom_description=f"Booking reference: {booking_id}"
-            )
+            payment_result = initiate_with_gateway(payment, return_url)
             
             if not payment_result['success']:
                 logger.error("Payment initiation failed", extra={
@@ -289,24 +781,13 @@ class PaymentViewSet(viewsets.ModelViewSet):
                     'action': 'payment_initiation_failed'
                 })
                 return Response(
-                    {'error': payment_result['message']},
+                    {'error': payment_result['message'], 'transaction_id': payment.transaction_id},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Create payment record
-            payment = Payment.objects.create(
-                booking=booking,
-                transaction_id=transaction_id,
-                amount=booking.total_price,
-                status='pending',
-                chapa_reference=transaction_id,
-                initiation_response=payment_result.get('response_data')
-            )
-            
             logger.info("Payment record created successfully", extra={
-                'payment_id': str(payment.id),
+                'transaction_id': str(payment.transaction_id),
                 'booking_id': str(booking_id),
-                'transaction_id': transaction_id,
                 'action': 'payment_created'
             })
             
@@ -331,50 +812,70 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=True, methods=['get'])
+    def checkout(self, request, id=None):
+        """
+        Poll for the checkout URL of a payment, answered at once: 200 once the checkout URL is known or
+        the payment left the pending state, 202 with Retry-After while the gateway call is in flight
+        """
+        payment = self.get_object()
+        ready = payment.status != 'pending' or bool(payment.checkout_url)
+        response = Response({
+            'transaction_id': payment.transaction_id,
+            'status': payment.status,
+            'checkout_url': payment.checkout_url,
+            'ready': ready,
+        }, status=status.HTTP_200_OK if ready else status.HTTP_202_ACCEPTED)
+        if not ready:
+            response['Retry-After'] = str(CHECKOUT_RETRY_AFTER)
+        return response
+    
     @action(detail=True, methods=['post'])
     def retry_payment(self, request, id=None):  # Changed pk to id for UUID
         """
         Retry payment for a failed payment - Updated for UUID
+        The gateway gets a new tx_ref (chapa_reference); async mode works as in create().
+        A pending payment is verified with the gateway first: 409 while its checkout can still be paid.
         """
         payment = self.get_object()
         
+        # Raises RetryRefused (409, or 503 when the gateway cannot be reached)
+        ensure_retryable(payment)
+        
         logger.info("Retrying payment", extra={
-            'payment_id': str(payment.id),
+            'transaction_id': str(payment.transaction_id),
             'booking_id': str(payment.booking.id),
             'action': 'payment_retry_start'
         })
         
-        # Generate new transaction ID with UUID
-        new_transaction_id = f"txn_{uuid.uuid4().hex[:10]}_{payment.booking.id.hex[:8]}"
-        
         # Prepare return URL
         return_url = request.build_absolute_uri(
             reverse('payment-success')
         ) + f"?booking={payment.booking.id}"
         
-        # Initialize Chapa service
-        chapa = ChapaService()
+        reset_for_retry(payment)
         
-        # Get user details
-        user = payment.booking.user
-        first_name = user.first_name or 'Customer'
-        last_name = user.last_name or 'User'
+        if wants_async(request):
+            enqueue_initiation(payment, return_url)
+            status_url = request.build_absolute_uri(
+                reverse('payment-checkout', kwargs={'id': payment.transaction_id})
+            )
+            response = Response({
+                'success': True,
+                'transaction_id': payment.transaction_id,
+                'status_url': status_url,
+                'message': 'Payment retry accepted. Poll the status URL for the checkout URL.'
+            }, status=status.HTTP_202_ACCEPTED)
+            response['Location'] = status_url
+            response['Retry-After'] = str(CHECKOUT_RETRY_AFTER)
+            return response
         
         # Initiate new payment
-        payment_result = chapa.initiate_payment(
-            amount=float(payment.amount),
-            email=user.email,
-            first_name=first_name,
-            last_name=last_name,
-            tx_ref=new_transaction_id,
-            return_url=return_url,
-            custom_title=f"Payment for {payment.booking.listing.title}",
-            custom_description=f"Booking reference: {payment.booking.id}"
-        )
+        payment_result = initiate_with_gateway(payment, return_url)
         
         if not payment_result['success']:
             logger.error("Payment retry failed", extra={
-                'payment_id': str(payment.id),
+                'transaction_id': str(payment.transaction_id),
                 'error': payment_result.get('message'),
                 'action': 'payment_retry_failed'
             })
@@ -383,25 +884,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Update payment record
-        payment.transaction_id = new_transaction_id
-        payment.status = 'pending'
-        payment.chapa_reference = new_transaction_id
-        payment.initiation_response = payment_result.get('response_data')
-        payment.verification_response = None
-        payment.paid_at = None
-        payment.save()
-        
         logger.info("Payment retry successful", extra={
-            'payment_id': str(payment.id),
-            'new_transaction_id': new_transaction_id,
+            'transaction_id': str(payment.transaction_id),
+            'chapa_reference': payment.chapa_reference,
             'action': 'payment_retry_success'
         })
         
         return Response({
             'success': True,
             'checkout_url': payment_result['checkout_url'],
-            'transaction_id': new_transaction_id,
+            'transaction_id': payment.transaction_id,
             'message': 'Payment retry initiated successfully. Redirect to checkout URL.'
         })
     
@@ -409,53 +901,17 @@ class PaymentViewSet(viewsets.ModelViewSet):
     def status(self, request):
         """
         Get payment status by transaction ID or booking ID - Updated for UUID
+        With ?verify=true a pending payment is first checked with the gateway
         """
-        transaction_id = request.query_params.get('transaction_id')
-        booking_id = request.query_params.get('booking_id')
-        
-        logger.info("Payment status check", extra={
-            'transaction_id': transaction_id,
-            'booking_id': booking_id,
-            'action': 'payment_status_check'
-        })
-        
-        if not transaction_id and not booking_id:
-            return Response(
-                {'error': 'Either transaction_id or booking_id is required.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            if transaction_id:
-                payment = Payment.objects.get(transaction_id=transaction_id)
-            else:
-                # Convert string booking_id to UUID
-                from django.core.exceptions import ValidationError
-                try:
-                    booking_uuid = uuid.UUID(booking_id)
-                    booking = Booking.objects.get(id=booking_uuid)
-                    payment = Payment.objects.get(booking=booking)
-                except (ValueError, ValidationError):
-                    return Response(
-                        {'error': 'Invalid booking ID format.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            # Check permissions
-            if payment.booking.user != request.user and not request.user.is_staff:
-                return Response(
-                    {'error': 'You do not have permission to view this payment.'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            serializer = self.get_serializer(payment)
-            return Response(serializer.data)
-            
-        except (Payment.DoesNotExist, Booking.DoesNotExist):
-            return Response(
-                {'error': 'Payment not found.'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        payment, serializer_class, error = find_status_payment(request)
+        if error:
+            return Response(*error)
+        if wants_verification(request, payment, serializer_class):
+            result = ChapaService().verify_payment(payment.chapa_reference)
+            if result['success']:
+                apply_verification(payment, payment.chapa_reference, result)
+        serializer = serializer_class(payment, context=self.get_serializer_context())
+        return Response(serializer.data)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -467,81 +923,45 @@ class ChapaWebhookView(APIView):
     permission_classes = []
     
     def post(self, request):
-        try:
-            webhook_data = request.data
-            transaction_id = webhook_data.get('tx_ref')
-            event_type = webhook_data.get('event')
-            
-            logger.info("Webhook received", extra={
+        # Stored and acknowledged right away; verification happens in listings.tasks.process_webhook_event
+        if not isinstance(request.data, Mapping):
+            logger.error("Webhook body is not an object", extra={
+                'action': 'webhook_invalid_body'
+            })
+            return Response({'error': 'Expected a JSON object'}, status=400)
+        webhook_data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
+        transaction_id = webhook_data.get('tx_ref')
+        event_type = webhook_data.get('event')
+
+        logger.info("Webhook received", extra={
+            'transaction_id': transaction_id,
+            'event_type': event_type,
+            'action': 'webhook_received'
+        })
+
+        if not transaction_id or len(str(transaction_id)) > 100 or len(str(event_type or '')) > 50:
+            logger.error("Webhook missing transaction reference", extra={
+                'action': 'webhook_missing_tx_ref'
+            })
+            return Response({'error': 'No transaction reference'}, status=400)
+
+        event, created = record_event(webhook_data)
+        if not created:
+            # A redelivery of an event that never got through (queueing and verification failed) is retried
+            requeued = event.status not in ('processed', 'ignored')
+            logger.info("Duplicate webhook delivery", extra={
                 'transaction_id': transaction_id,
                 'event_type': event_type,
-                'action': 'webhook_received'
+                'event_status': event.status,
+                'requeued': requeued,
+                'action': 'webhook_duplicate'
             })
-            
-            if not transaction_id:
-                logger.error("Webhook missing transaction reference", extra={
-                    'action': 'webhook_missing_tx_ref'
-                })
-                return Response({'error': 'No transaction reference'}, status=400)
-            
-            # Find payment
-            try:
-                payment = Payment.objects.get(transaction_id=transaction_id)
-                
-                # Verify payment with Chapa
-                chapa = ChapaService()
-                verification_result = chapa.verify_payment(transaction_id)
-                
-                if verification_result['success']:
-                    chapa_status = verification_result['status']
-                    
-                    if chapa_status == 'success':
-                        payment.status = 'completed'
-                        payment.paid_at = timezone.now()
-                        payment.booking.status = 'confirmed'
-                        payment.booking.save()
-                        payment.verification_response = verification_result.get('response_data')
-                        payment.save()
-                        
-                        logger.info("Payment completed via webhook", extra={
-                            'payment_id': payment.id,
-                            'booking_id': payment.booking.id,
-                            'action': 'payment_completed_webhook'
-                        })
-                    
-                    elif chapa_status in ['failed', 'cancelled']:
-                        payment.status = 'failed'
-                        payment.verification_response = verification_result.get('response_data')
-                        payment.save()
-                        
-                        logger.warning("Payment failed via webhook", extra={
-                            'payment_id': payment.id,
-                            'status': chapa_status,
-                            'action': 'payment_failed_webhook'
-                        })
-                
-                else:
-                    logger.error("Payment verification failed in webhook", extra={
-                        'transaction_id': transaction_id,
-                        'error': verification_result.get('message'),
-                        'action': 'verification_failed_webhook'
-                    })
-            
-            except Payment.DoesNotExist:
-                logger.error("Payment not found for webhook", extra={
-                    'transaction_id': transaction_id,
-                    'action': 'payment_not_found_webhook'
-                })
-                return Response({'error': 'Payment not found'}, status=404)
-            
-            return Response({'status': 'webhook processed'})
-            
-        except Exception as e:
-            logger.error("Unexpected error in webhook processing", extra={
-                'error': str(e),
-                'action': 'webhook_processing_error'
-            })
-            return Response({'error': 'Internal server error'}, status=500)
+            if requeued:
+                enqueue_webhook(event)
+            return Response({'status': 'duplicate', 'event_id': event.pk, 'requeued': requeued})
+
+        enqueue_webhook(event)
+        return Response({'status': 'accepted', 'event_id': event.pk})
 
 class PaymentSuccessView(APIView):
     """
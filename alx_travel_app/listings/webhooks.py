@@ -0,0 +1,95 @@
+# Chapa webhook ingestion
+# ChapaWebhookView stores every delivery as a WebhookEvent, unique per (tx_ref, event), and answers at
+# once; the gateway's redeliveries hit the unique constraint and are acknowledged without doing anything.
+# The listings.tasks.process_webhook_event task then runs process_event() in the Celery worker pool: the
+# payload is never trusted, the transaction is verified with the gateway and the payment moved with
+# payments.apply_verification(). Deliveries that arrive late or out of order are no-ops, because a
+# transition is only applied from the states it is allowed from. Events for a tx_ref that a retry replaced
+# are verified too: the customer may have paid on that first checkout page, which completes the payment,
+# while a failure of a replaced transaction is ignored.
+import uuid
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .chapa_service import ChapaService
+from .models import Payment, WebhookEvent
+from .payments import apply_verification
+
+
+class VerificationError(Exception):
+    """
+    The gateway could not verify a transaction (the event is retried)
+    """
+
+
+def record_event(payload):
+    """
+    Store a webhook delivery; returns (event, created), created is False for a duplicate delivery
+    """
+    tx_ref = str(payload.get('tx_ref'))
+    event = str(payload.get('event') or '')
+    try:
+        # Savepoint, so a duplicate does not break a surrounding transaction
+        with transaction.atomic():
+            return WebhookEvent.objects.create(tx_ref=tx_ref, event=event, payload=payload), True
+    except IntegrityError:
+        return WebhookEvent.objects.get(tx_ref=tx_ref, event=event), False
+
+
+def payment_for(tx_ref):
+    """
+    The payment a tx_ref belongs to: the one whose current transaction it is, otherwise the payment it
+    is a transaction of (tx_refs start with the payment's transaction_id), otherwise None
+    """
+    payment = Payment.objects.filter(chapa_reference=tx_ref).first()
+    if payment is not None:
+        return payment
+    try:
+        transaction_id = uuid.UUID(tx_ref[:36])
+    except ValueError:
+        return None
+    return Payment.objects.filter(pk=transaction_id).first()
+
+
+def finish(event, status, error=''):
+    event.status = status
+    event.error = error
+    event.processed_at = timezone.now()
+    event.save(update_fields=['status', 'error', 'processed_at', 'attempts'])
+    return status
+
+
+def process_event(event_id, chapa=None):
+    """
+    Verify the transaction of a stored webhook event and apply it to its payment.
+    Returns the final status of the event; raises VerificationError when the gateway gave no answer.
+    """
+    event = WebhookEvent.objects.filter(pk=event_id).first()
+    if event is None or event.status in ('processed', 'ignored'):
+        return getattr(event, 'status', None)
+    event.attempts += 1
+    payment = payment_for(event.tx_ref)
+    if payment is None:
+        return finish(event, 'ignored', 'Payment not found')
+    if payment.status == 'completed':
+        return finish(event, 'ignored', 'Payment already completed')
+
+    result = (chapa or ChapaService()).verify_payment(event.tx_ref)
+    if not result['success']:
+        if result.get('not_found'):
+            return finish(event, 'ignored', 'Transaction unknown to the gateway')
+        event.save(update_fields=['attempts'])
+        raise VerificationError(result.get('message') or 'Verification failed')
+    if apply_verification(payment, event.tx_ref, result) is None:
+        if payment.chapa_reference != event.tx_ref:
+            return finish(event, 'ignored', f'Transaction was superseded by a retry ({result.get("status")})')
+        return finish(event, 'ignored', f'No transition from {payment.status} on {result.get("status")}')
+    return finish(event, 'processed')
+
+
+def fail_event(event_id, error):
+    """
+    Give up on an event after its last attempt (a redelivery of the event queues it again)
+    """
+    WebhookEvent.objects.filter(pk=event_id, status__in=('received', 'failed')).update(
+        status='failed', error=error, processed_at=timezone.now(),
+    )